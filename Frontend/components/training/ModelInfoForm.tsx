@@ -5,7 +5,7 @@ import { Input } from '@/components/ui/input';
 import { Label } from '@/components/ui/label';
 import { RadioGroup, RadioGroupItem } from '@/components/ui/radio-group';
 import { ImageGuidelines } from './ImageGuidelines';
-import { ModelInfo, ModelType, TrainingStatus, ModelCharacteristics, TrainingSettings, HumanCharacteristics, PetCharacteristics, ItemCharacteristics } from '@/types';
+import { ModelInfo, ModelType, TrainingStatus, JobStatus, ModelCharacteristics, TrainingSettings, HumanCharacteristics, PetCharacteristics, ItemCharacteristics } from '@/types';
 import { HelpCircle, ImageIcon, Play, Upload, Loader2 } from 'lucide-react';
 import { Button } from '@/components/ui/button';
 import { Tooltip, TooltipContent, TooltipTrigger } from '@/components/ui/tooltip';
@@ -53,6 +53,93 @@ export function ModelInfoForm({ onInfoChange, trainingSettings, modelInfo }: Mod
     setCharacteristics(modelInfo.characteristics || {});
   }, [modelInfo]);
 
+  // Poll a background job, reporting its stage until it succeeds or fails
+  const waitForJob = async (jobId: string): Promise<JobStatus> => {
+    while (true) {
+      const jobResponse = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/jobs/${jobId}`);
+      if (!jobResponse.ok) {
+        throw new Error('Failed to fetch training job status');
+      }
+
+      const job: JobStatus = await jobResponse.json();
+      if (job.status === 'succeeded') return job;
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Failed to prepare training data');
+      }
+
+      setTrainingStatus({
+        status: 'preparing',
+        stage: job.stage,
+        captioned: job.captioned,
+        total: job.total,
+      });
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+    }
+  };
+
+  const sha256Hex = async (data: ArrayBuffer): Promise<string> => {
+    const digest = await crypto.subtle.digest('SHA-256', data);
+    return Array.from(new Uint8Array(digest))
+      .map((byte) => byte.toString(16).padStart(2, '0'))
+      .join('');
+  };
+
+  // Upload the archive in checksummed chunks. A failed chunk is retried
+  // from the offset the backend last confirmed, and an archive uploaded
+  // before is not sent again.
+  const uploadArchive = async (file: File): Promise<string> => {
+    const apiUrl = process.env.NEXT_PUBLIC_API_URL;
+    const initResponse = await fetch(`${apiUrl}/uploads`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({
+        filename: file.name,
+        size: file.size,
+        sha256: await sha256Hex(await file.arrayBuffer()),
+      }),
+    });
+    if (!initResponse.ok) {
+      throw new Error('Failed to upload file');
+    }
+
+    let upload = await initResponse.json();
+    let attempts = 0;
+    while (!upload.complete && upload.offset < upload.size) {
+      const chunk = await file
+        .slice(upload.offset, upload.offset + upload.chunkSize)
+        .arrayBuffer();
+      try {
+        const chunkResponse = await fetch(`${apiUrl}/uploads/${upload.uploadId}?offset=${upload.offset}`, {
+          method: 'PUT',
+          headers: { 'X-Chunk-SHA256': await sha256Hex(chunk) },
+          body: chunk,
+        });
+        if (!chunkResponse.ok) {
+          throw new Error('Failed to upload chunk');
+        }
+        upload = await chunkResponse.json();
+        attempts = 0;
+      } catch (error) {
+        if (++attempts > 3) throw error;
+        await new Promise((resolve) => setTimeout(resolve, 1000 * attempts));
+        // Resume from what the backend actually received
+        const statusResponse = await fetch(`${apiUrl}/uploads/${upload.uploadId}`);
+        if (statusResponse.ok) upload = await statusResponse.json();
+      }
+    }
+
+    if (!upload.complete) {
+      const completeResponse = await fetch(`${apiUrl}/uploads/${upload.uploadId}/complete`, {
+        method: 'POST',
+      });
+      if (!completeResponse.ok) {
+        throw new Error('Failed to upload file');
+      }
+      upload = await completeResponse.json();
+    }
+    return upload.filePath;
+  };
+
   // File upload handling using react-dropzone
   const onDrop = useCallback((acceptedFiles: File[]) => {
     const file = acceptedFiles[0];
@@ -129,28 +216,16 @@ export function ModelInfoForm({ onInfoChange, trainingSettings, modelInfo }: Mod
 
     // Upload training data and start the training process
     try {
-      const formData = new FormData();
-      formData.append('file', zipFile);
-
       // First upload the training data
-      const uploadResponse = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/upload`, {
-        method: 'POST',
-        body: formData,
-      });
-
-      if (!uploadResponse.ok) {
-        throw new Error('Failed to upload file');
-      }
-
-      const { filePath } = await uploadResponse.json();
+      const filePath = await uploadArchive(zipFile);
 
       // Format characteristics for training
       const characteristicsString = Object.entries(modelInfo.characteristics)
         .map(([key, value]) => `${key}: ${value}`)
         .join(', ');
 
-      // Start the training process
-      const response = await startTraining({
+      // Queue the training job; the backend prepares the data in the background
+      const { jobId } = await startTraining({
         modelInfo: {
           ...(modelInfo as ModelInfo),
           characteristics: characteristicsString as unknown as ModelCharacteristics,
@@ -159,12 +234,17 @@ export function ModelInfoForm({ onInfoChange, trainingSettings, modelInfo }: Mod
         imageLocation: filePath,
       });
 
+      // Poll the job until the training has been submitted to Replicate
+      const job = await waitForJob(jobId);
+
       // Update training status and notify user
       setTrainingStatus({
         status: 'training',
-        trainingId: response.trainingId,
-        modelUrl: response.modelUrl,
-        replicateUrl: `https://replicate.com/p/${response.trainingId}`
+        jobId: job.id,
+        trainingId: job.trainingId,
+        trainingStatus: job.trainingStatus,
+        modelUrl: job.modelUrl,
+        replicateUrl: job.trainingUrl ?? `https://replicate.com/p/${job.trainingId}`
       });
 
       toast({
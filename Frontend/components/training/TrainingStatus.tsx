@@ -1,6 +1,7 @@
 'use client';
 
-import { TrainingStatus as Status } from '@/types';
+import { useEffect, useState } from 'react';
+import { JobStatus, TrainingStatus as Status } from '@/types';
 import { Card } from '@/components/ui/card';
 import { AlertCircle, ExternalLink, Activity, Hash, Link2 } from 'lucide-react';
 import { Alert, AlertDescription } from '@/components/ui/alert';
@@ -15,6 +16,29 @@ function truncateUrl(url: string) {
 }
 
 export function TrainingStatusPanel({ status }: TrainingStatusProps) {
+  // Live Replicate training status, streamed by the backend's training monitor
+  const [trainingStatus, setTrainingStatus] = useState(status.trainingStatus);
+  const [trainingError, setTrainingError] = useState<string | undefined>();
+
+  useEffect(() => {
+    setTrainingStatus(status.trainingStatus);
+    if (!status.jobId) return;
+
+    const events = new EventSource(
+      `${process.env.NEXT_PUBLIC_API_URL}/jobs/${status.jobId}/events`
+    );
+    events.addEventListener('job', (event) => {
+      const job: JobStatus = JSON.parse((event as MessageEvent).data);
+      setTrainingStatus(job.trainingStatus);
+      setTrainingError(job.trainingError);
+      if (['succeeded', 'failed', 'canceled'].includes(job.trainingStatus ?? '')) {
+        events.close();
+      }
+    });
+
+    return () => events.close();
+  }, [status.jobId]);
+
   if (status.status === 'idle') return null;
 
   return (
@@ -26,6 +50,27 @@ export function TrainingStatusPanel({ status }: TrainingStatusProps) {
           <span className="capitalize">{status.status}</span>
         </div>
 
+        {status.status === 'preparing' && status.stage && (
+          <div className="flex items-center gap-2">
+            <Activity className="h-4 w-4 text-muted-foreground" />
+            <span className="font-medium">Stage:</span>
+            <span className="capitalize">{status.stage}</span>
+            {status.total ? (
+              <span className="text-muted-foreground">
+                ({status.captioned ?? 0}/{status.total} captioned)
+              </span>
+            ) : null}
+          </div>
+        )}
+
+        {trainingStatus && (
+          <div className="flex items-center gap-2">
+            <Activity className="h-4 w-4 text-muted-foreground" />
+            <span className="font-medium">Training status:</span>
+            <span className="capitalize">{trainingStatus}</span>
+          </div>
+        )}
+
         {status.trainingId && (
           <div className="flex items-center gap-2">
             <Hash className="h-4 w-4 text-muted-foreground" />
@@ -77,10 +122,10 @@ export function TrainingStatusPanel({ status }: TrainingStatusProps) {
         )}
       </div>
 
-      {status.error && (
+      {(status.error || trainingError) && (
         <Alert variant="destructive" className="mt-4">
           <AlertCircle className="h-4 w-4" />
-          <AlertDescription>{status.error}</AlertDescription>
+          <AlertDescription>{status.error || trainingError}</AlertDescription>
         </Alert>
       )}
     </Card>
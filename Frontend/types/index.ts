@@ -50,9 +50,30 @@ export interface ModelInfo {
 }
 
 export interface TrainingStatus {
-  status: 'idle' | 'training' | 'failed';
+  status: 'idle' | 'preparing' | 'training' | 'failed';
+  stage?: string;
+  captioned?: number;
+  total?: number;
   error?: string;
   replicateUrl?: string;
+  jobId?: string;
   trainingId?: string;
+  trainingStatus?: string;
   modelUrl?: string;
-}
\ No newline at end of file
+}
+export interface JobStatus {
+  id: string;
+  name: string;
+  status: 'queued' | 'running' | 'succeeded' | 'failed';
+  stage: string;
+  captioned: number;
+  total?: number;
+  trainingId?: string;
+  trainingStatus?: string;
+  trainingError?: string;
+  modelUrl?: string;
+  trainingUrl?: string;
+  error?: string;
+  createdAt: number;
+  updatedAt: number;
+}
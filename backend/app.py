@@ -1,11 +1,27 @@
-from flask import Flask
+from flask import Flask, Response
 from src.api.routes import api
 from flask_cors import CORS
+from src.services.workspace import reap_orphaned_workspaces
+from src.services.metrics import render_metrics
+from src.services.uploads import reap_stale_uploads
+from src.services.jobs import get_job_queue
 
 app = Flask(__name__)
 CORS(app)
 
 app.register_blueprint(api, url_prefix='/api')
 
+@app.route('/metrics')
+def metrics():
+    # Prometheus scrape endpoint
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+# Clean up workspaces left behind by crashed workers and abandoned uploads
+reap_orphaned_workspaces()
+reap_stale_uploads()
+# Fail the jobs of crashed workers and keep following their trainings
+get_job_queue().resume_tracking()
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
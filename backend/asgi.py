@@ -0,0 +1,35 @@
+from quart import Quart, Response
+from quart_cors import cors
+from src.api.async_routes import api
+from src.services.workspace import reap_orphaned_workspaces
+from src.services.metrics import render_metrics
+from src.services.uploads import reap_stale_uploads
+from src.services.jobs import get_job_queue
+from src.config import UPLOAD_MAX_BYTES, ASGI_BODY_TIMEOUT
+
+# Asynchronous variant of app.py for an ASGI server, e.g.
+#   gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+# which keeps the settings of gunicorn.conf.py, or uvicorn asgi:app
+app = Quart(__name__)
+app = cors(app)
+
+# Quart caps request bodies at 16 MB and 60 seconds by default
+app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_BYTES
+app.config["BODY_TIMEOUT"] = ASGI_BODY_TIMEOUT
+
+app.register_blueprint(api, url_prefix='/api')
+
+@app.route('/metrics')
+async def metrics():
+    # Prometheus scrape endpoint
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+# Clean up workspaces left behind by crashed workers and abandoned uploads
+reap_orphaned_workspaces()
+reap_stale_uploads()
+# Fail the jobs of crashed workers and keep following their trainings
+get_job_queue().resume_tracking()
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5000)
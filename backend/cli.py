@@ -1,76 +1,525 @@
 import os
 import click
 import time
-from src.services.xai_integration import generate_description
-import src.services.replicate_integration as tr
-import src.services.file_processing as fp
-from src.config import REPLICATE_OWNER
+import shutil
+from functools import partial
+from src.services.caption_cache import get_caption_cache
+from src.config import REPLICATE_OWNER, CAPTION_CONCURRENCY, JOB_CONCURRENCY
+
+# Services are imported by the commands using them, so that --help and
+# light commands start without loading the X.AI and Replicate SDKs
 
 @click.group()
-def cli():
+@click.option('--profile', is_flag=True,
+              help='Print the time spent in each stage when done.')
+@click.pass_context
+def cli(ctx, profile):
     """FLUX LoRa Training CLI Tool"""
-    pass
+    if profile:
+        from src.services.metrics import enable_profiling
+        enable_profiling()
+        ctx.call_on_close(print_profile)
+
+def print_profile():
+    """Prints the stage timings recorded while the command ran."""
+    from src.services.metrics import profile_summary
+
+    summary = profile_summary()
+    if not summary:
+        click.echo("Profile: no stages recorded", err=True)
+        return
+    click.echo("Profile:", err=True)
+    for stage, timing in sorted(summary.items(), key=lambda item: -item[1]["total"]):
+        click.echo(
+            f"{stage:>20}: {timing['count']:5d} calls, "
+            f"total {timing['total']:8.3f} s, mean {timing['mean']:7.3f} s, "
+            f"p50 {timing['p50']:7.3f} s, p95 {timing['p95']:7.3f} s, "
+            f"max {timing['max']:7.3f} s",
+            err=True,
+        )
 
 @cli.command()
 @click.argument('zip_path')
 @click.argument('token')
 @click.argument('type')
-def prepare(zip_path, token, type):
+@click.option('--infos', default="",
+              help='Additional information about the subject of the images.')
+@click.option('--concurrency', default=CAPTION_CONCURRENCY, show_default=True,
+              help='Maximum number of concurrent captioning requests.')
+@click.option('--no-cache', is_flag=True,
+              help='Bypass the caption cache and request fresh captions.')
+@click.option('--output', default=None,
+              help='Path of the prepared ZIP file. Defaults to TOKEN.zip.')
+@click.option('--resolution', default="512,768,1024", show_default=True,
+              help='Training resolution buckets; images are downscaled to the largest.')
+@click.option('--no-preprocess', is_flag=True,
+              help='Keep the original images instead of resizing, re-encoding and deduplicating them.')
+@click.option('--resume', is_flag=True,
+              help='Keep progress if the run fails, and resume a failed run on the same archive and settings.')
+@click.option('--no-validate', is_flag=True,
+              help='Keep the captions as generated instead of checking them and requesting invalid ones again.')
+@click.option('--export', 'export_dir', default=None,
+              help='Also append the images and captions to this columnar export.')
+def prepare(zip_path, token, type, infos, concurrency, no_cache, output,
+            resolution, no_preprocess, resume, no_validate, export_dir):
     """Prepares image dataset by processing a ZIP file of images.
 
     This command performs the following operations:
-    1. Creates a temporary folder and extracts the input ZIP file
-    2. Renames all images using the specified token
-    3. Generates descriptions for each image and saves them as text files
-    4. Creates a new ZIP file containing the processed images and descriptions
-    5. Cleans up temporary files
+    1. Reads the images straight from the input ZIP file
+    2. Downscales, re-encodes and deduplicates the images
+    3. Generates a description for each image, and requests again the 
+       ones that are invalid (wrong prefix, missing token, too short or 
+       long, refusals)
+    4. Writes a new ZIP file containing the images, renamed using the 
+       specified token, and their descriptions
+    5. Optionally appends them to a columnar export (see the export 
+       commands)
 
     Args:
         zip_path (str): Path to the input ZIP file containing images.
         token (str): Identifier used for renaming the images and output ZIP file.
         type (str): Determines which prompt to use ("human", "pet", or "item").
+        infos (str): Additional information about the subject of the images.
+        concurrency (int): Maximum number of concurrent captioning requests.
+        no_cache (bool): Bypass the caption cache.
+        output (str): Path of the prepared ZIP file.
+        resolution (str): Training resolution buckets.
+        no_preprocess (bool): Keep the original images.
+        resume (bool): Checkpoint the run and resume a failed one.
+        no_validate (bool): Skip the caption validation.
+        export_dir (str): Path of the columnar export to append to.
 
     Example Usage:
         $ python3 cli.py prepare input_images.zip person_name human
     """
-    temp_folder = "./temp"
-    os.makedirs(temp_folder, exist_ok=True)
-
-    click.echo("Unzipping files...")
-    fp.unzip_file(zip_path, temp_folder)
-
-    click.echo("Renaming files...")
-    fp.rename_files(temp_folder, token)
-
-    click.echo("Generating descriptions...")
-    for file_name in os.listdir(temp_folder):
-        file_path = os.path.join(temp_folder, file_name)
-        description = generate_description(file_path, token, type)
-        desc_file = file_path.replace(".jpg", ".txt")
-        with open(desc_file, "w") as f:
-            f.write(description)
-
-    click.echo("Zipping prepared files...")
-    output_zip = f"{token}.zip"
-    fp.zip_files(temp_folder, output_zip)
-    fp.delete_temp_folder("./temp")
+    import src.services.file_processing as fp
+    from src.services.xai_integration import generate_descriptions
+    from src.services.preprocessing import parse_max_resolution, preprocess_images
+    from src.services.manifest import PrepManifest, checkpoint_key
+    from src.services.pipeline import build_dataset_with_checkpoint
+    from werkzeug.utils import secure_filename
+    from src.services.workspace import (
+        job_workspace,
+        resumable_workspace,
+        reap_orphaned_workspaces,
+    )
+
+    output_zip = output or f"{token}.zip"
+    reap_orphaned_workspaces()
+
+    def print_quality(stats):
+        click.echo(
+            f"Captions: {stats['checked']} checked, {stats['flagged']} flagged, "
+            f"{stats['fixed']} fixed in {stats['rounds']} re-request rounds, "
+            f"{stats['failed']} still invalid"
+        )
+        for issue, count in stats["issues"].items():
+            click.echo(f"  {issue}: {count}")
+
+    describe = partial(
+        generate_descriptions, token=token, type=type, infos=infos,
+        API_KEY=None, max_workers=concurrency, use_cache=not no_cache,
+        validate=not no_validate, on_validated=print_quality,
+    )
+    preprocess = None
+    if not no_preprocess:
+        preprocess = partial(
+            preprocess_images, max_side=parse_max_resolution(resolution),
+            on_skipped=lambda count: click.echo(
+                f"Skipped {count} images that could not be decoded"
+            ),
+        )
+
+    if resume:
+        # Reopen the workspace of a failed run on the same archive and
+        # settings, which is kept until it succeeds
+        params = {
+            "token": token,
+            "type": type,
+            "infos": infos,
+            "preprocess": not no_preprocess,
+            "resolution": resolution,
+        }
+        workspace_context = resumable_workspace(
+            checkpoint_key(zip_path, **params), prefix=secure_filename(token)
+        )
+    else:
+        # Build in a private workspace so concurrent runs don't collide and
+        # a failed run never leaves a partial archive behind
+        workspace_context = job_workspace(prefix=secure_filename(token))
+
+    with workspace_context as workspace:
+        click.echo("Building dataset and generating descriptions...")
+        if resume:
+            manifest = PrepManifest(workspace, params)
+            if manifest.captioned():
+                click.echo(f"Resuming: {manifest.captioned()} images already captioned")
+            workspace_zip, count = build_dataset_with_checkpoint(
+                zip_path, workspace, token, manifest, describe,
+                preprocess=preprocess,
+            )
+            dataset = manifest.dataset
+        else:
+            workspace_zip = os.path.join(workspace, f"{secure_filename(token)}.zip")
+            tables = []
+            count = fp.build_dataset_zip(
+                zip_path, workspace_zip, token, describe, preprocess=preprocess,
+                on_dataset=tables.append,
+            )
+            dataset = tables[0]
+        click.echo(f"Processed {count} images")
+        if export_dir:
+            from src.services.dataset_export import export_dataset
+            added = export_dataset(workspace_zip, export_dir, resolution, dataset=dataset)
+            click.echo(f"Exported {added} new images to {export_dir}")
+        if not no_cache:
+            usage = get_caption_cache().stats()
+            click.echo(f"Caption cache: {usage['hits']} hits, {usage['misses']} misses")
+
+        shutil.move(workspace_zip, output_zip)
+
     click.echo(f"Prepared files saved as {output_zip}")
 
 
 @cli.command()
 @click.argument('zip_path')
 @click.argument('token')
-def train(zip_path, token):
+@click.option('--force', is_flag=True,
+              help='Train again even if the same dataset and settings were trained before.')
+@click.option('--trainer', type=click.Choice(['replicate', 'fake']), default='replicate',
+              show_default=True, help='Trainer backend; fake simulates the training locally '
+                   'and needs ENABLE_FAKE_TRAINER.')
+def train(zip_path, token, force, trainer):
     """Train LoRa model using prepared image files.
 
-    Initiates training process, monitors status, and provides updates.
+    Initiates training process, monitors status, and provides updates. 
+    If the same dataset was already trained with the same settings, that 
+    training is followed instead, unless --force is given.
 
     Args:
         zip_path (str): Path to ZIP file with training data.
         token (str): Unique identifier for the model.
+        force (bool): Train again even for an identical earlier submission.
+        trainer (str): Name of the trainer backend.
     """
+    import src.services.replicate_integration as tr
+
     click.echo(f"Starting LoRa training model for {token}...")
-    tr.train_LoRa(zip_path, token)
+    tr.train_LoRa(zip_path, token, reuse=not force, trainer=trainer)
+
+
+@cli.command()
+@click.argument('training_id')
+def watch(training_id):
+    """Follows a Replicate training until it ends.
+
+    Args:
+        training_id (str): The Replicate training id.
+    """
+    from src.services.training_monitor import get_training_monitor
+    from src.services.trainers import get_trainer
+    monitor = get_training_monitor()
+    monitor.track(training_id, get_trainer("replicate"), status=None)
+    event = monitor.wait(
+        training_id,
+        on_event=lambda event: click.echo(f"Training status: {event['status']}"),
+    )
+    if event and event["error"]:
+        click.echo(f"Training error: {event['error']}")
+
+
+@cli.command()
+@click.argument('manifest_path')
+@click.option('--workers', default=JOB_CONCURRENCY, show_default=True,
+              help='Number of subjects prepared at the same time.')
+@click.option('--report', default=None,
+              help='Write the per-subject results and summary as JSON to this path.')
+def batch(manifest_path, workers, report):
+    """Prepares and submits the trainings of several subjects.
+
+    The manifest is a CSV file (columns zip_path, token, type,
+    characteristics, plus any setting to override) or a JSON file (see
+    batch.load_batch_manifest). Captioning requests of all subjects share
+    one concurrency budget and Replicate submissions are bounded, so large
+    batches don't flood either API.
+
+    Args:
+        manifest_path (str): Path to the batch manifest.
+        workers (int): Number of subjects prepared at the same time.
+        report (str, optional): Path of the JSON report.
+    """
+    import json
+    from src.api.schemas import TrainingRequest
+    from src.services.batch import (
+        load_batch_manifest, build_training_requests, run_batch, summarize_batch,
+    )
+
+    defaults, subjects = load_batch_manifest(manifest_path)
+    requests = [
+        TrainingRequest(**body)
+        for body in build_training_requests(defaults, subjects)
+    ]
+    click.echo(f"Training {len(requests)} subjects with {workers} workers...")
+
+    def on_result(result):
+        if result["status"] == "submitted":
+            click.echo(f"{result['token']}: submitted {result['trainingId']} "
+                       f"({result['images']} images, {result['seconds']:.1f}s)")
+        else:
+            click.echo(f"{result['token']}: failed: {result['error']}")
+
+    start = time.perf_counter()
+    results = run_batch(requests, max_workers=workers, on_result=on_result)
+    summary = summarize_batch(results, time.perf_counter() - start)
+    click.echo(
+        f"{summary['submitted']}/{summary['subjects']} submitted, "
+        f"{summary['failed']} failed, {summary['images']} images in "
+        f"{summary['seconds']:.1f}s ({summary['imagesPerSecond']:.2f} images/s)"
+    )
+
+    if report:
+        with open(report, "w") as f:
+            json.dump({"summary": summary, "subjects": results}, f, indent=2)
+        click.echo(f"Report saved as {report}")
+    if summary["failed"]:
+        raise SystemExit(1)
+
+
+def parse_rows(rows):
+    """Parses a selection of rows such as "0-99,150,200-249".
+
+    Args:
+        rows (str): Comma separated positions and inclusive ranges.
+
+    Returns:
+        list: The positions, in the given order.
+    """
+    indices = []
+    for part in rows.split(","):
+        first, _, last = part.strip().partition("-")
+        indices.extend(range(int(first), int(last or first) + 1))
+    return indices
+
+
+@cli.group()
+def export():
+    """Reuse columnar dataset exports."""
+
+
+@export.command('info')
+@click.argument('export_dir')
+def export_info(export_dir):
+    """Shows the images of an export.
+
+    Args:
+        export_dir (str): Path of the export.
+    """
+    from src.services.dataset_export import read_rows
+
+    columns = ["index", "name", "width", "height", "bucket_width", "bucket_height", "text"]
+    rows = read_rows(export_dir, columns=columns)
+    for row in rows:
+        click.echo(
+            f"{row['index']:>5} {row['name']} {row['width']}x{row['height']} "
+            f"(bucket {row['bucket_width']}x{row['bucket_height']})"
+            f"{'' if row['text'] else ', no caption'}"
+        )
+    click.echo(f"{len(rows)} images")
+
+
+@export.command('slice')
+@click.argument('export_dir')
+@click.argument('output_dir')
+@click.option('--rows', default=None,
+              help='Rows to keep, e.g. "0-99,150". Defaults to all of them.')
+@click.option('--max-side', default=None, type=int,
+              help='Downscale the images so their longest side fits.')
+@click.option('--resolution', default=None,
+              help='Training resolution buckets to compute the buckets for.')
+def export_slice(export_dir, output_dir, rows, max_side, resolution):
+    """Writes a subset of an export, optionally at a lower resolution.
+
+    Args:
+        export_dir (str): Path of the source export.
+        output_dir (str): Path of the new export.
+        rows (str): Rows to keep.
+        max_side (int): Maximum width or height of the images.
+        resolution (str): Training resolution buckets.
+    """
+    from src.services.dataset_export import slice_export
+
+    count = slice_export(
+        export_dir, output_dir, parse_rows(rows) if rows else None,
+        max_side=max_side, resolution=resolution,
+    )
+    click.echo(f"Wrote {count} images to {output_dir}")
+
+
+@export.command('zip')
+@click.argument('export_dir')
+@click.argument('output_zip')
+@click.option('--rows', default=None,
+              help='Rows to include, e.g. "0-99,150". Defaults to all of them.')
+def export_zip(export_dir, output_zip, rows):
+    """Writes a training ZIP file from an export.
+
+    Args:
+        export_dir (str): Path of the export.
+        output_zip (str): Path of the training ZIP file.
+        rows (str): Rows to include.
+    """
+    from src.services.dataset_export import export_to_zip
+
+    count = export_to_zip(export_dir, output_zip, parse_rows(rows) if rows else None)
+    click.echo(f"Wrote {count} images to {output_zip}")
+
+
+@cli.group()
+def cache():
+    """Manage the caption cache."""
+    pass
+
+@cache.command()
+def stats():
+    """Shows the number and total size of cached captions."""
+    usage = get_caption_cache().stats()
+    click.echo(f"Entries: {usage['entries']}")
+    click.echo(f"Size: {usage['bytes']} bytes")
+
+@cache.command()
+def clear():
+    """Removes every cached caption."""
+    removed = get_caption_cache().clear()
+    click.echo(f"Removed {removed} cached captions")
+
+
+@cli.group()
+def bench():
+    """Run performance benchmarks."""
+    pass
+
+@bench.command()
+@click.option('--image-mb', default=16, show_default=True,
+              help='Size of the synthetic image in megabytes.')
+@click.option('--in-flight', default=8, show_default=True,
+              help='Number of concurrent requests to emulate.')
+def payload(image_mb, in_flight):
+    """Measures the peak memory per in-flight captioning request payload.
+
+    Args:
+        image_mb (int): Size of the synthetic image in megabytes.
+        in_flight (int): Number of concurrent requests to emulate.
+    """
+    from src.bench.payload_memory import run_payload_memory_benchmark
+
+    for result in run_payload_memory_benchmark(image_mb, in_flight):
+        click.echo(
+            f"{result['method']:>10}: peak RSS per request "
+            f"{result['peak_rss_bytes'] / 1024 / 1024:.1f} MB "
+            f"({result['peak_rss_per_image']:.2f}x image size)"
+        )
+
+@bench.command()
+@click.option('--images', default=20, show_default=True,
+              help='Number of images in the synthetic dataset.')
+@click.option('--image-size', default=1024, show_default=True,
+              help='Width of the synthetic images in pixels.')
+@click.option('--concurrency', default=CAPTION_CONCURRENCY, show_default=True,
+              help='Maximum number of concurrent caption requests.')
+@click.option('--xai-latency', default=0.5, show_default=True,
+              help='Latency of the fake X.AI API in seconds.')
+@click.option('--replicate-latency', default=0.1, show_default=True,
+              help='Latency of the fake Replicate API in seconds.')
+@click.option('--xai-error-rate', default=0.0, show_default=True,
+              help='Share of caption requests failing with a 429 or 503.')
+@click.option('--replicate-error-rate', default=0.0, show_default=True,
+              help='Share of Replicate creations failing with a 429 or 503.')
+@click.option('--stage', 'stages', multiple=True,
+              help='Stage to run (repeatable). Defaults to all of them.')
+def pipeline(images, image_size, concurrency, xai_latency, replicate_latency,
+             xai_error_rate, replicate_error_rate, stages):
+    """Benchmarks the dataset preparation stages against a local fake X.AI 
+    and Replicate server.
+
+    Args:
+        images (int): Number of images in the synthetic dataset.
+        image_size (int): Width of the synthetic images in pixels.
+        concurrency (int): Maximum number of concurrent caption requests.
+        xai_latency (float): Latency of the fake X.AI API in seconds.
+        replicate_latency (float): Latency of the fake Replicate API in 
+            seconds.
+        xai_error_rate (float): Share of failing caption requests.
+        replicate_error_rate (float): Share of failing Replicate creations.
+        stages (tuple): Stages to run.
+    """
+    from src.bench.pipeline import STAGES, run_pipeline_benchmark
+
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise click.BadParameter(
+            f"unknown stages {', '.join(sorted(unknown))}; "
+            f"choose from {', '.join(STAGES)}"
+        )
+
+    report = run_pipeline_benchmark(
+        images, image_size, concurrency, xai_latency, replicate_latency,
+        xai_error_rate, replicate_error_rate, list(stages) or None,
+    )
+    click.echo(
+        f"Dataset: {images} images, {report['zip_bytes'] / 1024 / 1024:.1f} MB"
+    )
+    for result in report["stages"]:
+        if result["error"]:
+            click.echo(f"{result['stage']:>10}: failed: {result['error']}")
+            continue
+        click.echo(
+            f"{result['stage']:>10}: {result['seconds']:7.2f} s, "
+            f"{result['images_per_second']:7.1f} images/s, "
+            f"peak RSS {result['peak_rss_bytes'] / 1024 / 1024:.1f} MB, "
+            f"written {result['bytes_written'] / 1024 / 1024:.1f} MB"
+        )
+    requests = ", ".join(f"{name}={count}" for name, count in sorted(report["requests"].items()))
+    click.echo(f"Fake server requests: {requests}")
+
+@bench.command()
+@click.option('--runs', default=5, show_default=True,
+              help='Number of measurements per module.')
+@click.option('--cli-budget', default=None, type=float,
+              help='Import budget of the CLI in seconds.')
+@click.option('--app-budget', default=None, type=float,
+              help='Import budget of the Flask app in seconds.')
+def startup(runs, cli_budget, app_budget):
+    """Checks that the CLI and the app start within their import budgets 
+    without loading the X.AI and Replicate SDKs.
+
+    Exits with a non-zero status if a budget is exceeded.
+
+    Args:
+        runs (int): Number of measurements per module.
+        cli_budget (float): Import budget of the CLI in seconds.
+        app_budget (float): Import budget of the Flask app in seconds.
+    """
+    from src.bench.startup import IMPORT_BUDGETS, run_startup_benchmark
+
+    budgets = dict(IMPORT_BUDGETS)
+    if cli_budget is not None:
+        budgets["cli"] = cli_budget
+    if app_budget is not None:
+        budgets["app"] = app_budget
+
+    failed = False
+    for result in run_startup_benchmark(runs, budgets):
+        status = "ok" if result["ok"] else "FAILED"
+        click.echo(
+            f"{result['module']:>5}: {result['seconds'] * 1000:6.0f} ms "
+            f"(budget {result['budget'] * 1000:.0f} ms) {status}"
+        )
+        if result["heavy_modules"]:
+            click.echo(f"       imported {', '.join(result['heavy_modules'])} at startup")
+        failed = failed or not result["ok"]
+
+    if failed:
+        raise SystemExit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,25 @@
+import os
+import shutil
+
+# Gunicorn settings, overridable through the environment. Each request runs
+# in its own job workspace, so several workers and threads can serve
+# training requests side by side.
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+# Training jobs run in the background, so requests return quickly
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+def on_starting(server):
+    # Metrics of all workers are aggregated through this folder, which must
+    # start out empty
+    folder = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if folder:
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder)
+
+def child_exit(server, worker):
+    # Drop the live gauges of exited workers from the aggregated metrics
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,276 @@
+from quart import Blueprint, Response, request, jsonify
+from .schemas import (
+    TrainingRequest,
+    JobResponse,
+    JobStatus,
+    UploadInit,
+    UploadSession,
+)
+from src.services.jobs import get_job_queue, is_job_finished
+from src.services.pipeline import run_training_pipeline
+from src.services import uploads
+from src.config import (
+    UPLOAD_FOLDER,
+    UPLOAD_CHUNK_MAX_BYTES,
+    EVENTS_POLL_INTERVAL,
+    EVENTS_MAX_SECONDS,
+)
+from werkzeug.utils import secure_filename
+import src.services.file_processing as fp
+import os
+import json
+import time
+import uuid
+import asyncio
+import tempfile
+
+# Asynchronous variant of the routes of routes.py, served by asgi.py. The
+# responses are the same; waits (request bodies, job store reads, event
+# streams) suspend a coroutine instead of holding a thread, so one process
+# serves many concurrent uploads and event streams. Training jobs still run
+# on the bounded job queue.
+api = Blueprint('api', __name__)
+
+@api.route('/upload', methods=['POST'])
+async def upload_file():
+    try:
+        files = await request.files
+        if 'file' not in files:
+            return jsonify({
+                "status": "error",
+                "message": "No file part"
+            }), 400
+
+        file = files['file']
+        if file.filename == '':
+            return jsonify({
+                "status": "error",
+                "message": "No selected file"
+            }), 400
+
+        if file and file.filename.endswith('.zip'):
+            os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+            filename = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
+            filepath = os.path.join(UPLOAD_FOLDER, filename)
+            await file.save(filepath)
+
+            # Reject zip bombs and unsafe archives before anyone reads them
+            try:
+                fp.validate_archive(filepath)
+            except fp.ArchiveError as e:
+                os.remove(filepath)
+                return jsonify({
+                    "status": "error",
+                    "message": str(e)
+                }), 400
+
+            return jsonify({
+                "status": "success",
+                "filePath": filepath
+            })
+        else:
+            return jsonify({
+                "status": "error",
+                "message": "Invalid file type. Please upload a ZIP file."
+            }), 400
+
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+def _upload_response(session):
+    return jsonify(UploadSession(status="success", **session).model_dump())
+
+def _upload_error(e):
+    return jsonify({
+        "status": "error",
+        "message": str(e)
+    }), e.status_code
+
+@api.route('/uploads', methods=['POST'])
+async def init_upload():
+    # Starts a chunked upload; chunks are then PUT in order and the upload
+    # completed, see services/uploads.py
+    try:
+        req_data = UploadInit(**(await request.get_json()))
+        session = await asyncio.to_thread(
+            uploads.init_upload, req_data.filename, req_data.size, req_data.sha256
+        )
+        return _upload_response(session), 200 if session["complete"] else 201
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@api.route('/uploads/<upload_id>', methods=['GET'])
+async def get_upload(upload_id):
+    # Lets a client find the offset to resume from after a disconnect
+    try:
+        return _upload_response(
+            await asyncio.to_thread(uploads.get_upload, upload_id)
+        )
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+async def _spool_body(length):
+    # write_chunk reads a blocking stream, so the body is received on the
+    # event loop into a file that only spills to disk past one read
+    spool = tempfile.SpooledTemporaryFile(max_size=uploads.STREAM_CHUNK_SIZE)
+    received = 0
+    async for data in request.body:
+        data = data[:length - received]
+        spool.write(data)
+        received += len(data)
+        if received >= length:
+            break
+    spool.seek(0)
+    return spool
+
+@api.route('/uploads/<upload_id>', methods=['PUT'])
+async def put_upload_chunk(upload_id):
+    try:
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            return jsonify({
+                "status": "error",
+                "message": "Missing offset"
+            }), 400
+
+        # Bodies write_chunk rejects by their length are not read
+        length = request.content_length
+        if length is not None and 0 < length <= UPLOAD_CHUNK_MAX_BYTES:
+            stream = await _spool_body(length)
+        else:
+            stream = tempfile.SpooledTemporaryFile()
+        with stream:
+            session = await asyncio.to_thread(
+                uploads.write_chunk,
+                upload_id,
+                offset,
+                stream,
+                length,
+                request.headers.get('X-Chunk-SHA256'),
+            )
+        return _upload_response(session)
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@api.route('/uploads/<upload_id>/complete', methods=['POST'])
+async def complete_upload(upload_id):
+    try:
+        return _upload_response(
+            await asyncio.to_thread(uploads.complete_upload, upload_id)
+        )
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@api.route('/training/start', methods=['POST'])
+async def start_training():
+    try:
+        req_data = TrainingRequest(**(await request.get_json()))
+
+        # The job store is SQLite, so it is written off the event loop
+        job = await asyncio.to_thread(
+            get_job_queue().submit,
+            req_data.modelInfo.name, run_training_pipeline, req_data,
+        )
+
+        response = JobResponse(status=job["status"], jobId=job["id"])
+
+        return jsonify(response.model_dump()), 202
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@api.route('/jobs/<job_id>', methods=['GET'])
+async def get_job(job_id):
+    try:
+        job = await asyncio.to_thread(get_job_queue().store.get, job_id)
+        if job is None:
+            return jsonify({
+                "status": "error",
+                "message": "Job not found"
+            }), 404
+
+        return jsonify(JobStatus(**job).model_dump())
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@api.route('/jobs', methods=['GET'])
+async def list_jobs():
+    try:
+        limit = request.args.get('limit', default=50, type=int)
+        status = request.args.get('status')
+        jobs = await asyncio.to_thread(
+            get_job_queue().store.list, limit=limit, status=status
+        )
+
+        return jsonify({
+            "status": "success",
+            "jobs": [JobStatus(**job).model_dump() for job in jobs]
+        })
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@api.route('/jobs/<job_id>/events', methods=['GET'])
+async def job_events(job_id):
+    store = get_job_queue().store
+    if await asyncio.to_thread(store.get, job_id) is None:
+        return jsonify({
+            "status": "error",
+            "message": "Job not found"
+        }), 404
+
+    async def stream():
+        last_update = None
+        deadline = time.monotonic() + EVENTS_MAX_SECONDS
+        while time.monotonic() < deadline:
+            job = await asyncio.to_thread(store.get, job_id)
+            if job["updatedAt"] != last_update:
+                last_update = job["updatedAt"]
+                payload = json.dumps(JobStatus(**job).model_dump())
+                yield f"event: job\ndata: {payload}\n\n"
+                if is_job_finished(job):
+                    return
+            else:
+                # Comment line keeping proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(EVENTS_POLL_INTERVAL)
+
+    response = Response(
+        stream(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+    # The stream ends after EVENTS_MAX_SECONDS, past the response timeout
+    response.timeout = None
+    return response
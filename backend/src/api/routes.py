@@ -1,9 +1,24 @@
-from flask import Blueprint, request, jsonify
-from .schemas import TrainingRequest, TrainingResponse
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from .schemas import (
+    TrainingRequest,
+    BatchRequest,
+    BatchResponse,
+    JobResponse,
+    JobStatus,
+    UploadInit,
+    UploadSession,
+)
+from src.services.jobs import get_job_queue, is_job_finished
+from src.services.pipeline import run_training_pipeline
+from src.services.batch import summarize_batch
+from src.services import uploads
+from src.config import UPLOAD_FOLDER, EVENTS_POLL_INTERVAL, EVENTS_MAX_SECONDS
+from werkzeug.utils import secure_filename
 import src.services.file_processing as fp
-from src.services.replicate_integration import train_LoRa_with_api
-from src.services.xai_integration import generate_description
 import os
+import json
+import time
+import uuid
 
 api = Blueprint('api', __name__)
 
@@ -24,12 +39,23 @@ def upload_file():
             }), 400
             
         if file and file.filename.endswith('.zip'):
-            # Save the file to a temporary location
-            upload_folder = "./uploads"
-            os.makedirs(upload_folder, exist_ok=True)
+            # Save the file under a unique name so concurrent uploads of
+            # files with the same name don't overwrite each other
+            os.makedirs(UPLOAD_FOLDER, exist_ok=True)
             
-            filepath = os.path.join(upload_folder, file.filename)
+            filename = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
+            filepath = os.path.join(UPLOAD_FOLDER, filename)
             file.save(filepath)
+
+            # Reject zip bombs and unsafe archives before anyone reads them
+            try:
+                fp.validate_archive(filepath)
+            except fp.ArchiveError as e:
+                os.remove(filepath)
+                return jsonify({
+                    "status": "error",
+                    "message": str(e)
+                }), 400
             
             return jsonify({
                 "status": "success",
@@ -47,58 +73,234 @@ def upload_file():
             "message": str(e)
         }), 500
 
+def _upload_response(session):
+    return jsonify(UploadSession(status="success", **session).model_dump())
+
+def _upload_error(e):
+    return jsonify({
+        "status": "error",
+        "message": str(e)
+    }), e.status_code
+
+@api.route('/uploads', methods=['POST'])
+def init_upload():
+    # Starts a chunked upload; chunks are then PUT in order and the upload
+    # completed, see services/uploads.py
+    try:
+        req_data = UploadInit(**request.json)
+        session = uploads.init_upload(
+            req_data.filename, req_data.size, req_data.sha256
+        )
+        return _upload_response(session), 200 if session["complete"] else 201
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@api.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    # Lets a client find the offset to resume from after a disconnect
+    try:
+        return _upload_response(uploads.get_upload(upload_id))
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@api.route('/uploads/<upload_id>', methods=['PUT'])
+def put_upload_chunk(upload_id):
+    try:
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            return jsonify({
+                "status": "error",
+                "message": "Missing offset"
+            }), 400
+
+        # The raw body is streamed to disk, never buffered in memory
+        session = uploads.write_chunk(
+            upload_id,
+            offset,
+            request.stream,
+            request.content_length,
+            request.headers.get('X-Chunk-SHA256'),
+        )
+        return _upload_response(session)
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@api.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    try:
+        return _upload_response(uploads.complete_upload(upload_id))
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
 @api.route('/training/start', methods=['POST'])
 def start_training():
     try:
         # Validate request
         req_data = TrainingRequest(**request.json)
 
-        # prepare the data
-        temp_folder = "./temp"
-        os.makedirs(temp_folder, exist_ok=True)
+        # Prepare the data and start training in the background
+        job = get_job_queue().submit(
+            req_data.modelInfo.name, run_training_pipeline, req_data
+        )
 
-        fp.unzip_file(req_data.imageLocation, temp_folder)
+        response = JobResponse(status=job["status"], jobId=job["id"])
 
-        fp.rename_files(temp_folder, req_data.modelInfo.name)
+        return jsonify(response.model_dump()), 202
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
 
-        # Get API key if exists
-        xai_api_key = None
-        if hasattr(req_data, 'settings') and hasattr(req_data.settings, 'xaiApiKey'):
-            xai_api_key = req_data.settings.xaiApiKey
-        
-        # generate descriptions for each image if autoCaptioning is off
-        if not req_data.settings.autoCaptioning:
-            for file_name in os.listdir(temp_folder):
-                if file_name.endswith('.jpg'):  # Only process image files
-                    file_path = os.path.join(temp_folder, file_name)
-                    description = generate_description(
-                        image_path=file_path,
-                        token=req_data.modelInfo.name,
-                        type=req_data.modelInfo.type,
-                        infos=req_data.modelInfo.characteristics,
-                        API_KEY=xai_api_key
-                    )
-                    desc_file = file_path.replace(".jpg", ".txt")
-                    with open(desc_file, "w") as f:
-                        f.write(description)
-
-        output_zip = f"{req_data.modelInfo.name}.zip"
-        fp.zip_files(temp_folder, output_zip)
-        fp.delete_temp_folder("./temp")
-
-        # Start training process
-        train_info = train_LoRa_with_api(output_zip, req_data.settings, req_data.modelInfo.name)
-        
-        response = TrainingResponse(
-            status=train_info["status"],
-            trainingId=train_info["id"],
-            modelUrl=train_info["modelUrl"],
-            trainingUrl=train_info["trainingUrl"]
+@api.route('/training/batch', methods=['POST'])
+def start_batch_training():
+    try:
+        req_data = BatchRequest(**request.json)
+        if not req_data.subjects:
+            return jsonify({
+                "status": "error",
+                "message": "No subjects to train"
+            }), 400
+
+        # Validate every subject before queueing any of them
+        requests = [
+            TrainingRequest(
+                modelInfo=subject.modelInfo,
+                settings={**req_data.settings.model_dump(), **subject.settings},
+                imageLocation=subject.imageLocation,
+            )
+            for subject in req_data.subjects
+        ]
+
+        # One job per subject; they share the captioning and submission
+        # budgets of the pipeline
+        batch_id = str(uuid.uuid4())
+        queue = get_job_queue()
+        jobs = [
+            queue.submit(
+                subject.modelInfo.name, run_training_pipeline, subject,
+                batch_id=batch_id,
+            )
+            for subject in requests
+        ]
+
+        response = BatchResponse(
+            status="queued", batchId=batch_id, jobIds=[job["id"] for job in jobs]
         )
-        
-        return jsonify(response.model_dump())
+        return jsonify(response.model_dump()), 202
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@api.route('/training/batch/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    try:
+        jobs = get_job_queue().store.list(limit=1000, batch_id=batch_id)
+        if not jobs:
+            return jsonify({
+                "status": "error",
+                "message": "Batch not found"
+            }), 404
+
+        return jsonify({
+            "status": "success",
+            "batchId": batch_id,
+            "summary": summarize_batch(jobs),
+            "jobs": [JobStatus(**job).model_dump() for job in jobs]
+        })
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@api.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    try:
+        job = get_job_queue().store.get(job_id)
+        if job is None:
+            return jsonify({
+                "status": "error",
+                "message": "Job not found"
+            }), 404
+
+        return jsonify(JobStatus(**job).model_dump())
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@api.route('/jobs', methods=['GET'])
+def list_jobs():
+    try:
+        limit = request.args.get('limit', default=50, type=int)
+        status = request.args.get('status')
+        jobs = get_job_queue().store.list(limit=limit, status=status)
+
+        return jsonify({
+            "status": "success",
+            "jobs": [JobStatus(**job).model_dump() for job in jobs]
+        })
     except Exception as e:
         return jsonify({
             "status": "error",
             "message": str(e)
-        }), 500
\ No newline at end of file
+        }), 500
+
+@api.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    store = get_job_queue().store
+    if store.get(job_id) is None:
+        return jsonify({
+            "status": "error",
+            "message": "Job not found"
+        }), 404
+
+    def stream():
+        # The job store is shared by every worker, so the stream works
+        # whichever worker runs the job and monitors its training. It ends
+        # after EVENTS_MAX_SECONDS and the client reconnects, getting the
+        # current state of the job first
+        last_update = None
+        deadline = time.monotonic() + EVENTS_MAX_SECONDS
+        while time.monotonic() < deadline:
+            job = store.get(job_id)
+            if job["updatedAt"] != last_update:
+                last_update = job["updatedAt"]
+                payload = json.dumps(JobStatus(**job).model_dump())
+                yield f"event: job\ndata: {payload}\n\n"
+                if is_job_finished(job):
+                    return
+            else:
+                # Comment line keeping proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+            time.sleep(EVENTS_POLL_INTERVAL)
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
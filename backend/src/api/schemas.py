@@ -21,13 +21,91 @@ class TrainingSettings(BaseModel):
     hfRepoId: Optional[str] = None
     hfToken: Optional[str] = None
     captionDropoutRate: float
+    # Set to False to bypass the caption cache and request fresh captions
+    useCaptionCache: bool = True
+    # Downscale, re-encode and dedupe the images before captioning and upload
+    preprocessImages: bool = True
+    # Check the captions and request the invalid ones again
+    validateCaptions: bool = True
+    # Return the training of an identical earlier submission (same dataset,
+    # model and settings) instead of training again
+    reuseTrainings: bool = True
+    # Trainer backend to submit to, e.g. "replicate" or "fake"; by default
+    # the configured backend expected to end the training first
+    trainerBackend: Optional[str] = None
+    # Also append the prepared images and captions to the columnar export
+    # of the model (see services/dataset_export.py)
+    exportDataset: bool = False
 
 class TrainingRequest(BaseModel):
     modelInfo: ModelInfo
     settings: TrainingSettings
     imageLocation: str
 
-class TrainingResponse(BaseModel):
+class BatchSubject(BaseModel):
+    modelInfo: ModelInfo
+    imageLocation: str
+    # Overrides of the batch settings for this subject, e.g. {"steps": 1500}
+    settings: Dict[str, Any] = {}
+
+class BatchRequest(BaseModel):
+    # Settings shared by every subject
+    settings: TrainingSettings
+    subjects: List[BatchSubject]
+
+class BatchResponse(BaseModel):
+    status: str
+    batchId: str
+    jobIds: List[str]
+
+class JobResponse(BaseModel):
+    status: str
+    jobId: str
+
+class JobStatus(BaseModel):
+    id: str
+    name: str
+    batchId: Optional[str] = None
+    # queued, running, succeeded or failed
+    status: str
+    # queued, unzipped, captioning, validated, zipped, exported, uploading,
+    # submitted or failed
+    stage: str
+    captioned: int = 0
+    total: Optional[int] = None
+    # Images left out because they could not be decoded
+    skipped: int = 0
+    # Caption validation statistics (see caption_quality.validation_stats)
+    captionQuality: Optional[Dict[str, Any]] = None
+    # Path of the columnar export of the dataset
+    exportPath: Optional[str] = None
+    trainingId: Optional[str] = None
+    # Trainer backend the training was submitted to
+    trainer: Optional[str] = None
+    trainingStatus: Optional[str] = None
+    trainingError: Optional[str] = None
+    modelUrl: Optional[str] = None
+    trainingUrl: Optional[str] = None
+    # True when an identical earlier training was returned
+    reused: bool = False
+    error: Optional[str] = None
+    createdAt: float
+    updatedAt: float
+
+class UploadInit(BaseModel):
+    filename: str
+    # Size in bytes and hex SHA-256 of the whole archive
+    size: int
+    sha256: str
+
+class UploadSession(BaseModel):
     status: str
-    trainingId: str
-    modelUrl: Optional[str]
\ No newline at end of file
+    uploadId: str
+    filename: str
+    size: int
+    sha256: str
+    # Number of bytes received so far, where the next chunk starts
+    offset: int
+    chunkSize: int
+    complete: bool
+    filePath: Optional[str] = None
@@ -0,0 +1,259 @@
+import re
+import json
+import time
+import uuid
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Token of the caption prompt, see xai_integration.build_prompt
+PROMPT_TOKEN = re.compile(r'A photo of ([^,"]+)')
+
+class FakeUpstreamServer(ThreadingHTTPServer):
+    """Local stand-in for the X.AI and Replicate HTTP APIs.
+
+    Emulates streamed chat completions ("/v1/chat/completions") and the
+    Replicate models and trainings endpoints, with configurable latency and
+    error rates, so the preparation pipeline can be benchmarked offline.
+    Trainings go from "starting" to "processing" to "succeeded" as time
+    passes.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, xai_latency=0.5, xai_chunks=8, xai_error_rate=0.0,
+                 replicate_latency=0.1, replicate_error_rate=0.0,
+                 training_duration=5.0, port=0):
+        """
+        Args:
+            xai_latency (float): Seconds before the first caption chunk.
+            xai_chunks (int): Number of chunks the caption is streamed in.
+            xai_error_rate (float): Share of caption requests failing with a
+                429 or 503.
+            replicate_latency (float): Seconds added to Replicate calls.
+            replicate_error_rate (float): Share of model and training
+                creations failing with a 429 or 503.
+            training_duration (float): Seconds a training takes to succeed.
+            port (int): Port to listen on; 0 picks a free one.
+        """
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.xai_latency = xai_latency
+        self.xai_chunks = xai_chunks
+        self.xai_error_rate = xai_error_rate
+        self.replicate_latency = replicate_latency
+        self.replicate_error_rate = replicate_error_rate
+        self.training_duration = training_duration
+        self.models = {}
+        self.trainings = {}
+        self.request_counts = {}
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f"http://{host}:{port}"
+
+    def count(self, name):
+        with self.lock:
+            self.request_counts[name] = self.request_counts.get(name, 0) + 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        return json.loads(body) if body else {}
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _maybe_fail(self, error_rate):
+        if random.random() >= error_rate:
+            return False
+        self.server.count("errors")
+        if random.random() < 0.5:
+            self._send_json(429, {"detail": "Rate limit exceeded"}, {"Retry-After": "1"})
+        else:
+            self._send_json(503, {"detail": "Service unavailable"})
+        return True
+
+    def do_POST(self):
+        if self.path.endswith("/chat/completions"):
+            self._chat_completions()
+        elif self.path == "/v1/models":
+            self._create_model()
+        elif re.fullmatch(r"/v1/models/[^/]+/[^/]+/versions/[^/]+/trainings", self.path):
+            self._create_training()
+        else:
+            self._send_json(404, {"detail": "Not found"})
+
+    def do_GET(self):
+        if match := re.fullmatch(r"/v1/trainings/([^/]+)", self.path):
+            self._get_training(match.group(1))
+        elif match := re.fullmatch(r"/v1/models/([^/]+/[^/]+)", self.path):
+            self._get_model(match.group(1))
+        else:
+            self._send_json(404, {"detail": "Not found"})
+
+    def _chat_completions(self):
+        request = self._read_json()
+        self.server.count("xai")
+        if self._maybe_fail(self.server.xai_error_rate):
+            return
+
+        prompt = " ".join(
+            part.get("text", "")
+            for message in request.get("messages", [])
+            for part in message.get("content", [])
+            if isinstance(part, dict)
+        )
+        match = PROMPT_TOKEN.search(prompt)
+        token = match.group(1).strip() if match else "subject"
+        caption = (
+            f"A photo of {token}, a synthetic benchmark image with smooth "
+            f"gradients and soft lighting."
+        )
+
+        time.sleep(self.server.xai_latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        size = max(1, len(caption) // self.server.xai_chunks)
+        pieces = [caption[i:i + size] for i in range(0, len(caption), size)]
+        for piece in pieces + [None]:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model"),
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": piece} if piece else {},
+                    "finish_reason": None if piece else "stop",
+                }],
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+        self._write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+
+    def _model_json(self, owner, name):
+        return {
+            "url": f"https://replicate.com/{owner}/{name}",
+            "owner": owner,
+            "name": name,
+            "description": None,
+            "visibility": "private",
+            "github_url": None,
+            "paper_url": None,
+            "license_url": None,
+            "run_count": 0,
+            "cover_image_url": None,
+            "default_example": None,
+            "latest_version": None,
+        }
+
+    def _create_model(self):
+        request = self._read_json()
+        self.server.count("replicate")
+        time.sleep(self.server.replicate_latency)
+        if self._maybe_fail(self.server.replicate_error_rate):
+            return
+
+        key = f"{request['owner']}/{request['name']}"
+        with self.server.lock:
+            if key in self.server.models:
+                self._send_json(409, {"detail": "A model with that name already exists"})
+                return
+            self.server.models[key] = self._model_json(request["owner"], request["name"])
+        self._send_json(201, self.server.models[key])
+
+    def _get_model(self, key):
+        self.server.count("replicate")
+        time.sleep(self.server.replicate_latency)
+        model = self.server.models.get(key)
+        if model is None:
+            self._send_json(404, {"detail": "Not found"})
+        else:
+            self._send_json(200, model)
+
+    def _create_training(self):
+        request = self._read_json()
+        self.server.count("replicate")
+        time.sleep(self.server.replicate_latency)
+        if self._maybe_fail(self.server.replicate_error_rate):
+            return
+
+        training_id = uuid.uuid4().hex
+        images = request.get("input", {}).get("input_images")
+        if not (isinstance(images, str) and images.startswith("https://")):
+            # Like Replicate, keep uploaded files and expose them by URL
+            images = f"https://replicate.delivery/fake/{training_id}/input_images.zip"
+        with self.server.lock:
+            self.server.trainings[training_id] = {
+                "created": time.time(),
+                "destination": request.get("destination"),
+                "input_bytes": len(json.dumps(request.get("input", {}))),
+                "input_images": images,
+            }
+        self._send_json(201, self._training_json(training_id))
+
+    def _training_json(self, training_id):
+        training = self.server.trainings[training_id]
+        elapsed = time.time() - training["created"]
+        if elapsed >= self.server.training_duration:
+            status = "succeeded"
+        elif elapsed >= self.server.training_duration / 5:
+            status = "processing"
+        else:
+            status = "starting"
+        return {
+            "id": training_id,
+            "model": "ostris/flux-dev-lora-trainer",
+            "version": "fake",
+            "destination": training["destination"],
+            "status": status,
+            "input": {"input_images": training["input_images"]},
+            "output": None,
+            "logs": None,
+            "error": None,
+            "created_at": None,
+            "started_at": None,
+            "completed_at": None,
+            "urls": None,
+        }
+
+    def _get_training(self, training_id):
+        self.server.count("replicate")
+        time.sleep(self.server.replicate_latency)
+        if training_id not in self.server.trainings:
+            self._send_json(404, {"detail": "Not found"})
+        else:
+            self._send_json(200, self._training_json(training_id))
@@ -0,0 +1,89 @@
+import os
+import base64
+import resource
+import tempfile
+import multiprocessing
+from src.services.xai_integration import build_image_url
+
+def _legacy_payload(image_path):
+    # The payload construction used before build_image_url: read, encode,
+    # decode and format into an f-string. Both the base64 string and the URL
+    # stayed referenced for the whole request.
+    with open(image_path, "rb") as image_file:
+        base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+    return base64_image, f"data:image/jpeg;base64,{base64_image}"
+
+def _streamed_payload(image_path):
+    return (build_image_url(image_path),)
+
+METHODS = {
+    "legacy": _legacy_payload,
+    "streamed": _streamed_payload,
+}
+
+def _peak_rss_kb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _measure(method, image_path, in_flight, results):
+    baseline = _peak_rss_kb()
+    # Keep every payload alive, as concurrent in-flight requests would
+    payloads = [METHODS[method](image_path) for _ in range(in_flight)]
+    results.put((len(payloads[0][-1]), _peak_rss_kb() - baseline))
+
+def measure_payload_memory(method, image_path, in_flight=1):
+    """Measures the peak memory needed to hold in-flight request payloads.
+
+    Each measurement runs in a freshly spawned process, so peak RSS readings
+    of different methods don't interfere.
+
+    Args:
+        method (str): "legacy" or "streamed".
+        image_path (str): Path to the image to encode.
+        in_flight (int): Number of payloads held at the same time.
+
+    Returns:
+        tuple: The payload length in characters and the peak RSS growth in
+            bytes.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(
+        target=_measure, args=(method, image_path, in_flight, results)
+    )
+    process.start()
+    payload_size, peak_kb = results.get()
+    process.join()
+    return payload_size, peak_kb * 1024
+
+def run_payload_memory_benchmark(image_mb=16, in_flight=8):
+    """Compares the peak RSS per request of the payload builders.
+
+    Args:
+        image_mb (int): Size of the synthetic image in megabytes.
+        in_flight (int): Number of concurrent requests to emulate.
+
+    Returns:
+        list: One dict per method with the image size, the payload size, the
+            peak RSS growth per request and its ratio to the image size.
+    """
+    image_size = image_mb * 1024 * 1024
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_path = os.path.join(tmp_dir, "image.jpg")
+        with open(image_path, "wb") as image_file:
+            image_file.write(os.urandom(image_size))
+
+        report = []
+        for method in METHODS:
+            payload_size, peak_rss = measure_payload_memory(
+                method, image_path, in_flight
+            )
+            per_request = peak_rss / in_flight
+            report.append({
+                "method": method,
+                "image_bytes": image_size,
+                "payload_bytes": payload_size,
+                "peak_rss_bytes": per_request,
+                "peak_rss_per_image": per_request / image_size,
+            })
+    return report
@@ -0,0 +1,282 @@
+import os
+import sys
+import time
+import random
+import zipfile
+import resource
+import tempfile
+import traceback
+import multiprocessing
+from types import SimpleNamespace
+from functools import partial
+from PIL import Image
+from src.bench.fake_server import FakeUpstreamServer
+
+BENCH_TOKEN = "benchtoken"
+
+def make_synthetic_zip(zip_path, images=20, image_size=1024, seed=0):
+    """Writes an archive of synthetic JPEG photos.
+
+    Each image is a random low-resolution pattern upscaled to image_size, so
+    images compress like photos and don't get dropped as near-duplicates.
+
+    Args:
+        zip_path (str): Path of the archive to write.
+        images (int): Number of images.
+        image_size (int): Width of the images in pixels; the height is 3/4
+            of it.
+        seed (int): Seed of the random patterns.
+
+    Returns:
+        int: The size of the archive in bytes.
+    """
+    rng = random.Random(seed)
+    size = (image_size, image_size * 3 // 4)
+    with zipfile.ZipFile(zip_path, 'w') as zip_ref:
+        for i in range(images):
+            pattern = Image.frombytes(
+                "RGB", (16, 12), bytes(rng.randrange(256) for _ in range(16 * 12 * 3))
+            )
+            image = pattern.resize(size, Image.BICUBIC)
+            with zip_ref.open(f"dataset/IMG_{i:04d}.jpg", 'w') as member:
+                image.save(member, format="JPEG", quality=90)
+    return os.path.getsize(zip_path)
+
+def _bench_settings():
+    # Same fields as the TrainingSettings schema used by the API
+    return SimpleNamespace(
+        replicateApiKey="bench-token",
+        replicateUsername="bench",
+        xaiApiKey="bench-key",
+        steps=1000,
+        loraRank=16,
+        optimizer="adamw8bit",
+        batchSize=1,
+        resolution="512,768,1024",
+        autoCaptioning=False,
+        learningRate=0.0004,
+        captionDropoutRate=0.05,
+        useCaptionCache=False,
+        preprocessImages=True,
+        validateCaptions=True,
+        # Always measure a full submission
+        reuseTrainings=False,
+        # Submit to the fake Replicate server
+        trainerBackend="replicate",
+    )
+
+def _dataset_loaders(zip_ref):
+    import src.services.file_processing as fp
+    return [partial(zip_ref.read, entry["member"]) for entry in fp.scan_dataset(zip_ref)]
+
+def _stage_unzip(zip_path, work_dir, options):
+    import src.services.file_processing as fp
+    fp.unzip_file(zip_path, os.path.join(work_dir, "unzipped"))
+    return len(os.listdir(os.path.join(work_dir, "unzipped", "dataset")))
+
+def _stage_rename(zip_path, work_dir, options):
+    import src.services.file_processing as fp
+    folder = os.path.join(work_dir, "unzipped", "dataset")
+    return len(fp.rename_files(folder, BENCH_TOKEN))
+
+def _stage_zip(zip_path, work_dir, options):
+    import src.services.file_processing as fp
+    folder = os.path.join(work_dir, "unzipped", "dataset")
+    fp.zip_files(folder, os.path.join(work_dir, "legacy.zip"))
+    return len(os.listdir(folder))
+
+def _stage_preprocess(zip_path, work_dir, options):
+    from src.services.preprocessing import parse_max_resolution, preprocess_images
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        return sum(1 for _ in preprocess_images(
+            _dataset_loaders(zip_ref), parse_max_resolution("512,768,1024")
+        ))
+
+def _stage_caption(zip_path, work_dir, options):
+    from src.services.xai_integration import generate_descriptions
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        descriptions = generate_descriptions(
+            _dataset_loaders(zip_ref), BENCH_TOKEN, "item", "",
+            "bench-key", max_workers=options["concurrency"], use_cache=False,
+        )
+    return len(descriptions)
+
+def _stage_build(zip_path, work_dir, options):
+    import src.services.file_processing as fp
+    from src.services.xai_integration import generate_descriptions
+    from src.services.preprocessing import parse_max_resolution, preprocess_images
+    describe = partial(
+        generate_descriptions, token=BENCH_TOKEN, type="item", infos="",
+        API_KEY="bench-key", max_workers=options["concurrency"], use_cache=False,
+    )
+    preprocess = partial(
+        preprocess_images, max_side=parse_max_resolution("512,768,1024")
+    )
+    return fp.build_dataset_zip(
+        zip_path, os.path.join(work_dir, "dataset.zip"), BENCH_TOKEN,
+        describe, preprocess=preprocess,
+    )
+
+def _stage_submit(zip_path, work_dir, options):
+    from src.services.replicate_integration import train_LoRa_with_api
+    dataset_zip = os.path.join(work_dir, "dataset.zip")
+    with zipfile.ZipFile(dataset_zip, 'r') as zip_ref:
+        images = sum(1 for name in zip_ref.namelist() if name.endswith(".jpg"))
+    train_LoRa_with_api(
+        dataset_zip, _bench_settings(),
+        f"{BENCH_TOKEN}{int(time.time() * 1000)}",
+    )
+    return images
+
+# Stages in running order
+STAGES = {
+    "unzip": _stage_unzip,
+    "rename": _stage_rename,
+    "zip": _stage_zip,
+    "preprocess": _stage_preprocess,
+    "caption": _stage_caption,
+    "build": _stage_build,
+    "submit": _stage_submit,
+}
+
+# Stages using the files written by an earlier stage
+STAGE_DEPENDENCIES = {
+    "rename": "unzip",
+    "zip": "rename",
+    "submit": "build",
+}
+
+def _with_dependencies(stages):
+    selected = set()
+    for stage in stages:
+        while stage is not None and stage not in selected:
+            selected.add(stage)
+            stage = STAGE_DEPENDENCIES.get(stage)
+    return [stage for stage in STAGES if stage in selected]
+
+def _dir_size(path):
+    # Stages write their outputs to the work folder, so its growth is the
+    # number of bytes a stage wrote
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(path)
+        for name in files
+    )
+
+def _run_stage(stage, zip_path, work_dir, options, results):
+    try:
+        size_before = _dir_size(work_dir)
+        start = time.perf_counter()
+        images = STAGES[stage](zip_path, work_dir, options)
+        elapsed = time.perf_counter() - start
+        written = max(_dir_size(work_dir) - size_before, 0)
+        results.put({
+            "stage": stage,
+            "images": images,
+            "seconds": elapsed,
+            "images_per_second": images / elapsed if elapsed else 0.0,
+            # ru_maxrss is reported in kilobytes on Linux
+            "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "bytes_written": written,
+            "error": None,
+        })
+    except Exception as e:
+        traceback.print_exc()
+        results.put({"stage": stage, "error": str(e)})
+    finally:
+        if "src.services.preprocessing" in sys.modules:
+            sys.modules["src.services.preprocessing"].close_preprocess_pool()
+
+def run_stage(stage, zip_path, work_dir, options):
+    """Runs one pipeline stage in a freshly spawned process and measures it.
+
+    The process inherits the environment of the caller, so the X.AI and
+    Replicate base URLs set by run_pipeline_benchmark point it at the fake
+    server.
+
+    Args:
+        stage (str): Name of the stage (see STAGES).
+        zip_path (str): Path to the synthetic dataset archive.
+        work_dir (str): Folder shared by the stages of a run.
+        options (dict): Benchmark options ("concurrency").
+
+    Returns:
+        dict: The stage name, the number of images, the wall time, the
+            throughput, the peak RSS of the stage process (preprocessing
+            workers excluded), the bytes written to the work folder and the
+            error message, if the stage failed.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(
+        target=_run_stage, args=(stage, zip_path, work_dir, options, results)
+    )
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def run_pipeline_benchmark(images=20, image_size=1024, concurrency=8,
+                           xai_latency=0.5, replicate_latency=0.1,
+                           xai_error_rate=0.0, replicate_error_rate=0.0,
+                           stages=None):
+    """Benchmarks the dataset preparation pipeline against a fake upstream.
+
+    Generates a synthetic dataset, starts a FakeUpstreamServer and runs the
+    legacy file processing functions, preprocessing, captioning, the
+    streamed dataset build and the training submission one after the other.
+
+    Args:
+        images (int): Number of images in the synthetic dataset.
+        image_size (int): Width of the synthetic images in pixels.
+        concurrency (int): Maximum number of concurrent caption requests.
+        xai_latency (float): Latency of the fake caption API in seconds.
+        replicate_latency (float): Latency of the fake Replicate API in
+            seconds.
+        xai_error_rate (float): Share of failing caption requests.
+        replicate_error_rate (float): Share of failing Replicate creations.
+        stages (list, optional): Stages to run, along with the stages they
+            depend on. Defaults to all of them.
+
+    Returns:
+        dict: The archive size ("zip_bytes"), the stage results ("stages",
+            see run_stage) and the requests served by the fake server
+            ("requests").
+    """
+    stages = _with_dependencies(stages or STAGES)
+    server = FakeUpstreamServer(
+        xai_latency=xai_latency,
+        xai_error_rate=xai_error_rate,
+        replicate_latency=replicate_latency,
+        replicate_error_rate=replicate_error_rate,
+    ).start()
+
+    environ = dict(os.environ)
+    os.environ["XAI_BASE_URL"] = f"{server.url}/v1"
+    os.environ["REPLICATE_BASE_URL"] = server.url
+    # Measure the pipeline itself, not the pacing of the rate limiter
+    os.environ["XAI_REQUESTS_PER_MINUTE"] = "0"
+    os.environ["XAI_TOKENS_PER_MINUTE"] = "0"
+    os.environ["REPLICATE_REQUESTS_PER_MINUTE"] = "0"
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            zip_path = os.path.join(tmp_dir, "input.zip")
+            os.environ["REGISTRY_DB_PATH"] = os.path.join(tmp_dir, "registry.db")
+            zip_bytes = make_synthetic_zip(zip_path, images, image_size)
+            work_dir = os.path.join(tmp_dir, "work")
+            os.makedirs(work_dir)
+
+            options = {"concurrency": concurrency}
+            results = [
+                run_stage(stage, zip_path, work_dir, options) for stage in stages
+            ]
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        server.stop()
+
+    return {
+        "zip_bytes": zip_bytes,
+        "stages": results,
+        "requests": dict(server.request_counts),
+    }
@@ -0,0 +1,78 @@
+import os
+import sys
+import json
+import subprocess
+
+# Modules that must only be imported once they are actually used
+HEAVY_MODULES = ("openai", "replicate", "httpx", "PIL")
+
+# Import budgets in seconds, generous enough for a cold container
+IMPORT_BUDGETS = {
+    "cli": 0.25,
+    "app": 0.75,
+}
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_MEASURE = """
+import sys, json, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": seconds,
+    "heavy_modules": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+def measure_import(module, runs=5):
+    """Measures how long importing a module takes in a fresh interpreter.
+
+    Args:
+        module (str): The module to import, e.g. "cli" or "app".
+        runs (int): Number of interpreters to start; the median is kept.
+
+    Returns:
+        dict: The median import time in seconds ("seconds") and the heavy
+            modules loaded by the import ("heavy_modules").
+    """
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", _MEASURE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=BACKEND_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    results.sort(key=lambda result: result["seconds"])
+    return results[len(results) // 2]
+
+def run_startup_benchmark(runs=5, budgets=None):
+    """Checks the import time of the CLI and the Flask app against budgets.
+
+    Args:
+        runs (int): Number of measurements per module.
+        budgets (dict, optional): Budget in seconds per module. Defaults to
+            IMPORT_BUDGETS.
+
+    Returns:
+        list: One dict per module with its name ("module"), median import
+            time, budget, heavy modules loaded and whether it passed
+            ("ok"), i.e. stayed within budget without loading a heavy
+            module.
+    """
+    budgets = budgets or IMPORT_BUDGETS
+    report = []
+    for module, budget in budgets.items():
+        result = measure_import(module, runs)
+        report.append({
+            "module": module,
+            "seconds": result["seconds"],
+            "budget": budget,
+            "heavy_modules": result["heavy_modules"],
+            "ok": result["seconds"] <= budget and not result["heavy_modules"],
+        })
+    return report
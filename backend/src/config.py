@@ -1,11 +1,163 @@
 import os
-from dotenv import load_dotenv
+from functools import lru_cache
+
+# .env file at the root of the project, next to docker-compose.yml
+DEFAULT_ENV_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", ".env"
+)
+
+@lru_cache(maxsize=None)
+def load_environment(env_file=None):
+    """Loads the .env file into the environment, once per file.
+
+    Variables already set in the environment take precedence over the
+    file. The file location can be overridden with FLUX_ENV_FILE.
+
+    Args:
+        env_file (str, optional): Path of the .env file. Defaults to
+            FLUX_ENV_FILE, or the .env file at the root of the project.
+
+    Returns:
+        str: The path of the loaded file, or None if it doesn't exist.
+    """
+    env_file = env_file or os.getenv("FLUX_ENV_FILE") or DEFAULT_ENV_FILE
+    if not os.path.isfile(env_file):
+        return None
+
+    from dotenv import load_dotenv
+    load_dotenv(env_file)
+    return env_file
 
 # Load environment variables from .env file
-load_dotenv("/home/emma/Desktop/FLUX LoRa Training Tool/.env")
+load_environment()
 
 # Configuration settings
 XAI_API_KEY = os.getenv("XAI_API_KEY")
 REPLICATE_API_TOKEN = os.getenv("REPLICATE_API_TOKEN")
 REPLICATE_OWNER = os.getenv("REPLICATE_OWNER")
-TEMP_FOLDER = os.getenv("TEMP_FOLDER", "./temp")
\ No newline at end of file
+TEMP_FOLDER = os.getenv("TEMP_FOLDER", "./temp")
+UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", "./uploads")
+
+# Chunked upload settings
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+UPLOAD_CHUNK_MAX_BYTES = int(os.getenv("UPLOAD_CHUNK_MAX_BYTES", str(16 * 1024 * 1024)))
+UPLOAD_SESSION_MAX_AGE = float(os.getenv("UPLOAD_SESSION_MAX_AGE", str(24 * 3600)))
+# Seconds the ASGI app (asgi.py) waits for a request body, e.g. an upload
+ASGI_BODY_TIMEOUT = float(os.getenv("ASGI_BODY_TIMEOUT", "600"))
+
+# Limits of the uploaded archives, against zip bombs and archives too large
+# for a shared worker. Images hardly compress, so a high compression ratio
+# gives a bomb away
+ARCHIVE_MAX_MEMBERS = int(os.getenv("ARCHIVE_MAX_MEMBERS", "10000"))
+ARCHIVE_MAX_MEMBER_BYTES = int(os.getenv("ARCHIVE_MAX_MEMBER_BYTES", str(200 * 1024 * 1024)))
+ARCHIVE_MAX_TOTAL_BYTES = int(os.getenv("ARCHIVE_MAX_TOTAL_BYTES", str(4 * 1024 * 1024 * 1024)))
+ARCHIVE_MAX_RATIO = float(os.getenv("ARCHIVE_MAX_RATIO", "100"))
+
+# Job workspace settings
+WORKSPACE_ROOT = os.getenv("WORKSPACE_ROOT", "./workspaces")
+WORKSPACE_MAX_AGE = float(os.getenv("WORKSPACE_MAX_AGE", str(24 * 3600)))
+
+# X.AI client settings
+XAI_BASE_URL = os.getenv("XAI_BASE_URL", "https://api.x.ai/v1")
+XAI_POOL_SIZE = int(os.getenv("XAI_POOL_SIZE", "20"))
+XAI_KEEPALIVE_EXPIRY = float(os.getenv("XAI_KEEPALIVE_EXPIRY", "30"))
+
+# Replicate client settings
+REPLICATE_POOL_SIZE = int(os.getenv("REPLICATE_POOL_SIZE", "10"))
+
+# Captioning settings
+CAPTION_CONCURRENCY = int(os.getenv("CAPTION_CONCURRENCY", "8"))
+CAPTION_TIMEOUT = float(os.getenv("CAPTION_TIMEOUT", "60"))
+CAPTION_MAX_RETRIES = int(os.getenv("CAPTION_MAX_RETRIES", "3"))
+CAPTION_BACKOFF = float(os.getenv("CAPTION_BACKOFF", "1.0"))
+
+# Caption validation settings. The maximum length stays well within the 512
+# T5 tokens the FLUX trainer reads from a caption
+CAPTION_MIN_CHARS = int(os.getenv("CAPTION_MIN_CHARS", "40"))
+CAPTION_MAX_CHARS = int(os.getenv("CAPTION_MAX_CHARS", "1500"))
+# Rounds of re-requests for the captions failing validation
+CAPTION_QUALITY_RETRIES = int(os.getenv("CAPTION_QUALITY_RETRIES", "2"))
+# Re-requests are sampled more freely, so they don't repeat the bad caption
+CAPTION_RETRY_TEMPERATURE = float(os.getenv("CAPTION_RETRY_TEMPERATURE", "0.5"))
+
+# Rate limits shared by every job, per API key; 0 disables a limit. Use the
+# sqlite backend to share them between the gunicorn workers
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH", "./data/rate_limits.db")
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "5"))
+XAI_REQUESTS_PER_MINUTE = float(os.getenv("XAI_REQUESTS_PER_MINUTE", "60"))
+XAI_TOKENS_PER_MINUTE = float(os.getenv("XAI_TOKENS_PER_MINUTE", "100000"))
+# Estimated tokens used by a caption request: image, prompt and answer
+XAI_CAPTION_TOKENS = int(os.getenv("XAI_CAPTION_TOKENS", "1500"))
+REPLICATE_REQUESTS_PER_MINUTE = float(os.getenv("REPLICATE_REQUESTS_PER_MINUTE", "600"))
+
+# Caption cache settings
+CAPTION_CACHE_DIR = os.getenv("CAPTION_CACHE_DIR", "./cache/captions")
+CAPTION_CACHE_MAX_BYTES = int(os.getenv("CAPTION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CAPTION_CACHE_MAX_AGE = float(os.getenv("CAPTION_CACHE_MAX_AGE", str(30 * 24 * 3600)))
+
+# Background job settings
+JOB_STORE = os.getenv("JOB_STORE", "sqlite")
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "./data/jobs.db")
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "4"))
+# Maximum number of training submissions uploading to Replicate at once
+SUBMIT_CONCURRENCY = int(os.getenv("SUBMIT_CONCURRENCY", "2"))
+
+# Registry of the models, datasets and trainings submitted to Replicate
+REGISTRY_DB_PATH = os.getenv("REGISTRY_DB_PATH", "./data/registry.db")
+# Seconds Replicate keeps an uploaded dataset; older URLs are not reused
+REPLICATE_FILE_RETENTION = float(os.getenv("REPLICATE_FILE_RETENTION", "3600"))
+
+# Trainer backends jobs are routed across, comma separated: "replicate",
+# and "fake" which simulates trainings in process (see services/trainers.py)
+TRAINER_BACKENDS = os.getenv("TRAINER_BACKENDS", "replicate")
+# The fake backend trains nothing; it is only available, to requests and to
+# TRAINER_BACKENDS alike, when explicitly enabled (benchmarks, local testing)
+ENABLE_FAKE_TRAINER = os.getenv("ENABLE_FAKE_TRAINER", "false").lower() in ("1", "true", "yes")
+# Trainings running at once per Replicate account; 0 disables the limit
+REPLICATE_TRAINING_CONCURRENCY = int(os.getenv("REPLICATE_TRAINING_CONCURRENCY", "0"))
+# Trainings in flight per account, shared by every worker process. A
+# submission waiting longer than TRAINER_SLOT_TIMEOUT seconds for a free
+# slot fails; slots older than TRAINER_SLOT_MAX_AGE are assumed lost
+TRAINER_DB_PATH = os.getenv("TRAINER_DB_PATH", "./data/trainers.db")
+TRAINER_SLOT_TIMEOUT = float(os.getenv("TRAINER_SLOT_TIMEOUT", "3600"))
+TRAINER_SLOT_MAX_AGE = float(os.getenv("TRAINER_SLOT_MAX_AGE", "86400"))
+# Estimates of a FLUX LoRA training on Replicate: boot time, time per step
+# and price per second of the H100 it runs on
+REPLICATE_STARTUP_SECONDS = float(os.getenv("REPLICATE_STARTUP_SECONDS", "120"))
+REPLICATE_SECONDS_PER_STEP = float(os.getenv("REPLICATE_SECONDS_PER_STEP", "1.2"))
+REPLICATE_COST_PER_SECOND = float(os.getenv("REPLICATE_COST_PER_SECOND", "0.001528"))
+# Fake trainer settings: trainings its simulated provider runs at once, and
+# share of them failing at random
+FAKE_TRAINER_GPUS = int(os.getenv("FAKE_TRAINER_GPUS", "2"))
+FAKE_TRAINER_STARTUP_SECONDS = float(os.getenv("FAKE_TRAINER_STARTUP_SECONDS", "0.5"))
+FAKE_TRAINER_SECONDS_PER_STEP = float(os.getenv("FAKE_TRAINER_SECONDS_PER_STEP", "0.001"))
+FAKE_TRAINER_FAILURE_RATE = float(os.getenv("FAKE_TRAINER_FAILURE_RATE", "0"))
+
+# Columnar exports of the prepared datasets (see services/dataset_export.py).
+# Rows are stored in groups of EXPORT_ROW_GROUP_ROWS, the unit of random access
+EXPORT_FOLDER = os.getenv("EXPORT_FOLDER", "./exports")
+EXPORT_ROW_GROUP_ROWS = int(os.getenv("EXPORT_ROW_GROUP_ROWS", "64"))
+
+# Training monitor settings
+MONITOR_MIN_INTERVAL = float(os.getenv("MONITOR_MIN_INTERVAL", "5"))
+MONITOR_MAX_INTERVAL = float(os.getenv("MONITOR_MAX_INTERVAL", "60"))
+MONITOR_BACKOFF = float(os.getenv("MONITOR_BACKOFF", "1.5"))
+MONITOR_WORKERS = int(os.getenv("MONITOR_WORKERS", "4"))
+# Consecutive failed polls after which a training is no longer tracked
+MONITOR_MAX_FAILURES = int(os.getenv("MONITOR_MAX_FAILURES", "5"))
+# How often the job event stream checks the job store for changes
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "1"))
+# Longest a job event stream stays open; the client then reconnects, so a
+# stream never holds a worker thread for the whole training
+EVENTS_MAX_SECONDS = float(os.getenv("EVENTS_MAX_SECONDS", "300"))
+
+# Image preprocessing settings
+PREPROCESS_QUALITY = int(os.getenv("PREPROCESS_QUALITY", "90"))
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", str(os.cpu_count() or 1)))
+CAPTION_IMAGE_SIZE = int(os.getenv("CAPTION_IMAGE_SIZE", "768"))
+DEDUPE_THRESHOLD = int(os.getenv("DEDUPE_THRESHOLD", "4"))
+
+# Metrics settings. Set PROMETHEUS_MULTIPROC_DIR to aggregate the metrics of
+# all gunicorn workers (the folder must be empty when the server starts)
+METRICS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
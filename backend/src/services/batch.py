@@ -0,0 +1,201 @@
+import os
+import csv
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from src.services.pipeline import run_training_pipeline
+from src.services.replicate_integration import (
+    DEFAULT_TRAINING_INPUT,
+    TRAINING_INPUT_SETTINGS,
+)
+from src.config import (
+    XAI_API_KEY,
+    REPLICATE_API_TOKEN,
+    REPLICATE_OWNER,
+    JOB_CONCURRENCY,
+)
+
+# Trainer settings used when neither the manifest nor the subject sets them,
+# the same as train_LoRa
+DEFAULT_SETTINGS = {
+    "replicateUsername": REPLICATE_OWNER,
+    "replicateApiKey": REPLICATE_API_TOKEN,
+    "xaiApiKey": XAI_API_KEY,
+    **{
+        setting: DEFAULT_TRAINING_INPUT[name]
+        for setting, name in TRAINING_INPUT_SETTINGS.items()
+    },
+}
+
+# CSV columns describing a subject; any other column overrides a setting
+CSV_COLUMNS = {
+    "zip_path": "zipPath",
+    "token": "token",
+    "type": "type",
+    "characteristics": "characteristics",
+}
+
+def load_batch_manifest(path):
+    """Reads the subjects of a batch from a CSV or JSON manifest.
+
+    A JSON manifest is either a list of subjects or an object with shared
+    settings ("defaults") and the subjects ("subjects"). Each subject has a
+    "zipPath", a "token", a "type", "characteristics" and optionally
+    "settings" overriding the defaults.
+
+    A CSV manifest has the columns zip_path, token, type and
+    characteristics; every other non-empty column overrides the setting of
+    the same name (e.g. steps or loraRank) for that subject.
+
+    Relative archive paths are resolved against the manifest's folder.
+
+    Args:
+        path (str): Path of the manifest (.csv or .json).
+
+    Returns:
+        tuple: The shared settings (dict) and the subjects (list of dict).
+
+    Raises:
+        ValueError: If the manifest is malformed.
+    """
+    defaults = {}
+    if path.lower().endswith(".csv"):
+        with open(path, "r", newline="") as f:
+            reader = csv.DictReader(f)
+            missing = set(CSV_COLUMNS) - set(reader.fieldnames or [])
+            if missing:
+                raise ValueError(
+                    f"Missing manifest columns: {', '.join(sorted(missing))}"
+                )
+            subjects = []
+            for row in reader:
+                subject = {key: row[column] for column, key in CSV_COLUMNS.items()}
+                subject["settings"] = {
+                    column: value for column, value in row.items()
+                    if column not in CSV_COLUMNS and value not in (None, "")
+                }
+                subjects.append(subject)
+    else:
+        with open(path, "r") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            defaults = data.get("defaults", {})
+            subjects = data.get("subjects", [])
+        else:
+            subjects = data
+
+    if not subjects:
+        raise ValueError("The manifest lists no subjects")
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for i, subject in enumerate(subjects):
+        for key in ("zipPath", "token", "type"):
+            if not subject.get(key):
+                raise ValueError(f"Subject {i + 1} has no {key}")
+        subject["zipPath"] = os.path.join(base_dir, subject["zipPath"])
+        subject.setdefault("characteristics", "")
+        subject.setdefault("settings", {})
+    return defaults, subjects
+
+def build_training_requests(defaults, subjects):
+    """Builds the training request of every subject.
+
+    Args:
+        defaults (dict): Settings shared by every subject, on top of
+            DEFAULT_SETTINGS.
+        subjects (list): Subjects as returned by load_batch_manifest.
+
+    Returns:
+        list: One training request body per subject, to validate as a
+            TrainingRequest.
+    """
+    return [
+        {
+            "modelInfo": {
+                "name": subject["token"],
+                "type": subject["type"],
+                "characteristics": subject["characteristics"],
+            },
+            "settings": {**DEFAULT_SETTINGS, **defaults, **subject["settings"]},
+            "imageLocation": subject["zipPath"],
+        }
+        for subject in subjects
+    ]
+
+def _run_subject(req_data):
+    fields = {}
+    start = time.perf_counter()
+    try:
+        train_info = run_training_pipeline(req_data, progress=lambda **f: fields.update(f))
+        error = None
+    except Exception as e:
+        train_info = {}
+        error = str(e)
+    return {
+        "token": req_data.modelInfo.name,
+        "status": "failed" if error else "submitted",
+        "images": fields.get("total"),
+        "trainingId": train_info.get("id"),
+        "trainer": train_info.get("trainer"),
+        "modelUrl": train_info.get("modelUrl"),
+        "trainingUrl": train_info.get("trainingUrl"),
+        "reused": train_info.get("reused", False),
+        "error": error,
+        "seconds": time.perf_counter() - start,
+    }
+
+def run_batch(requests, max_workers=JOB_CONCURRENCY, on_result=None):
+    """Prepares the datasets of several subjects concurrently and submits
+    their trainings.
+
+    Every subject runs the training pipeline; captioning requests of all
+    subjects share one concurrency budget and submissions to Replicate are
+    bounded (see pipeline.run_training_pipeline). A failing subject doesn't
+    stop the others.
+
+    Args:
+        requests (list): The TrainingRequest of every subject.
+        max_workers (int): Maximum number of subjects prepared at once.
+        on_result (callable, optional): Called with the result of each
+            subject as soon as it is done.
+
+    Returns:
+        list: One result dict per subject, in input order, with the token,
+            the status ("submitted" or "failed"), the number of images, the
+            training id and URLs, the error and the duration in seconds.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch") as executor:
+        futures = [executor.submit(_run_subject, req_data) for req_data in requests]
+        if on_result is not None:
+            for future in futures:
+                future.add_done_callback(lambda future: on_result(future.result()))
+        return [future.result() for future in futures]
+
+def summarize_batch(results, seconds=None):
+    """Summarizes the results of a batch.
+
+    Args:
+        results (list): Subject results, as returned by run_batch, or job
+            records of the batch.
+        seconds (float, optional): Wall time of the whole batch.
+
+    Returns:
+        dict: The number of subjects, of submitted and failed ones, the
+            total number of images and, given seconds, the throughput.
+    """
+    submitted = sum(1 for result in results if result.get("trainingId"))
+    failed = sum(1 for result in results if result.get("status") == "failed")
+    images = sum(
+        result.get("images") or result.get("total") or 0 for result in results
+    )
+    summary = {
+        "subjects": len(results),
+        "submitted": submitted,
+        "failed": failed,
+        "pending": len(results) - submitted - failed,
+        "images": images,
+    }
+    if seconds is not None:
+        summary["seconds"] = seconds
+        summary["imagesPerSecond"] = images / seconds if seconds else 0.0
+    return summary
@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from src.config import (
+    CAPTION_CACHE_DIR,
+    CAPTION_CACHE_MAX_BYTES,
+    CAPTION_CACHE_MAX_AGE,
+)
+
+def hash_image(image_path, chunk_size=1024 * 1024):
+    """Computes the SHA-256 hash of an image's content.
+
+    Args:
+        image_path (str | bytes): Path to the image file, or its raw bytes.
+        chunk_size (int): Number of bytes read at a time.
+
+    Returns:
+        str: Hex digest of the image content.
+    """
+    if isinstance(image_path, (bytes, bytearray)):
+        return hashlib.sha256(image_path).hexdigest()
+
+    digest = hashlib.sha256()
+    with open(image_path, "rb") as image_file:
+        for chunk in iter(lambda: image_file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class CaptionCache:
+    """Persistent on-disk cache of generated captions.
+
+    Entries are keyed by the image content hash together with everything
+    else that influences the caption (prompt type, infos, token and model
+    name), so a retrain on an unchanged dataset makes no captioning calls.
+    Each entry is stored as a small JSON file written atomically, which
+    keeps the cache safe to share between processes.
+
+    Entries older than max_age are dropped on read and on eviction. When
+    the cache grows beyond max_bytes, the least recently used entries are
+    evicted first.
+    """
+
+    def __init__(self, cache_dir=CAPTION_CACHE_DIR,
+                 max_bytes=CAPTION_CACHE_MAX_BYTES,
+                 max_age=CAPTION_CACHE_MAX_AGE):
+        """
+        Args:
+            cache_dir (str): Directory where the entries are stored.
+            max_bytes (int): Maximum total size of the entries in bytes.
+            max_age (float): Maximum age of an entry in seconds.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(image_hash, token, type, infos, model):
+        """Builds the cache key for a caption.
+
+        Args:
+            image_hash (str): Content hash of the image (see hash_image).
+            token (str): Token included in the description.
+            type (str): Prompt type ("human", "pet", or "item").
+            infos (str): Additional informations about the subject.
+            model (str): Name of the captioning model.
+
+        Returns:
+            str: Hex digest identifying the caption.
+        """
+        payload = json.dumps([image_hash, token, type, infos, model])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        """Looks up a caption.
+
+        Args:
+            key (str): Cache key (see make_key).
+
+        Returns:
+            str: The cached caption, or None on a miss.
+        """
+        path = self._entry_path(key)
+        try:
+            # Entries expire by their modification time, which is when
+            # they were written, as in evict
+            created = os.stat(path).st_mtime
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._count(hit=False)
+            return None
+
+        if time.time() - created > self.max_age:
+            self.invalidate(key)
+            self._count(hit=False)
+            return None
+
+        # Refresh only the access time, so eviction drops the least
+        # recently used entries without postponing their expiry
+        try:
+            os.utime(path, (time.time(), created))
+        except OSError:
+            pass
+        self._count(hit=True)
+        return entry["caption"]
+
+    def set(self, key, caption):
+        """Stores a caption.
+
+        Args:
+            key (str): Cache key (see make_key).
+            caption (str): The caption to store.
+
+        Returns:
+            None
+        """
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"caption": caption, "created": time.time()}, f)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def invalidate(self, key):
+        """Removes a single entry if it exists.
+
+        Args:
+            key (str): Cache key (see make_key).
+
+        Returns:
+            None
+        """
+        try:
+            os.remove(self._entry_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _entries(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for file_name in files:
+                if not file_name.endswith(".json"):
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_atime, stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def clear(self):
+        """Removes every entry from the cache.
+
+        Returns:
+            int: Number of entries removed.
+        """
+        removed = 0
+        for _, _, _, path in self._entries():
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def evict(self):
+        """Drops expired entries, then the least recently used ones until
+        the cache fits in max_bytes.
+
+        Returns:
+            int: Number of entries removed.
+        """
+        now = time.time()
+        # Expired entries first, then by last access
+        entries = sorted(
+            self._entries(),
+            key=lambda entry: (now - entry[1] <= self.max_age, entry[0]),
+        )
+        total_bytes = sum(size for _, _, size, _ in entries)
+        removed = 0
+        for _, mtime, size, path in entries:
+            if now - mtime <= self.max_age and total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+        return removed
+
+    def stats(self):
+        """Returns usage statistics of the cache.
+
+        Returns:
+            dict: Hit and miss counters of this instance, plus the number
+                and total size of the entries on disk.
+        """
+        entries = self._entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(entries),
+            "bytes": sum(size for _, _, size, _ in entries),
+        }
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_caption_cache():
+    """Returns the process-wide caption cache, creating it on first use.
+
+    Returns:
+        CaptionCache: The shared cache instance.
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = CaptionCache()
+        return _default_cache
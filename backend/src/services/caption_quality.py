@@ -0,0 +1,131 @@
+import re
+from collections import Counter
+from src.config import CAPTION_MIN_CHARS, CAPTION_MAX_CHARS
+
+# Answers of a model declining to describe the image
+REFUSAL_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE) for pattern in (
+        r"\bI(?:'m| am) (?:sorry|unable|not able)\b",
+        r"\bI (?:cannot|can't|can not|won't|will not)\b",
+        r"\bI apologi[sz]e\b",
+        r"\bas an AI\b",
+        r"\b(?:unable|not able) to (?:identify|describe|assist|help|provide)\b",
+    )
+]
+
+# Issues a caption can have
+EMPTY = "empty"
+PREFIX = "prefix"
+TOKEN = "token"
+TOO_SHORT = "too_short"
+TOO_LONG = "too_long"
+REFUSAL = "refusal"
+
+class CaptionQualityError(ValueError):
+    """Captions still failing validation once the re-requests are used up.
+
+    Attributes:
+        stats (dict): The validation statistics (see validation_stats).
+    """
+
+    def __init__(self, message, stats):
+        super().__init__(message)
+        self.stats = stats
+
+def caption_prefix(token):
+    """Returns the text every caption must start with, as asked by the
+    captioning prompts (see xai_integration.build_prompt).
+
+    Args:
+        token (str): Token of the model.
+
+    Returns:
+        str: The prefix.
+    """
+    return f"A photo of {token}"
+
+def check_caption(caption, token, min_chars=None, max_chars=None):
+    """Checks that a caption is usable for training.
+
+    Args:
+        caption (str): The generated caption.
+        token (str): Token of the model.
+        min_chars (int, optional): Minimum length. Defaults to
+            CAPTION_MIN_CHARS.
+        max_chars (int, optional): Maximum length. Defaults to
+            CAPTION_MAX_CHARS.
+
+    Returns:
+        list: The issues found (EMPTY, PREFIX, TOKEN, TOO_SHORT, TOO_LONG,
+            REFUSAL), empty if the caption is valid.
+    """
+    min_chars = CAPTION_MIN_CHARS if min_chars is None else min_chars
+    max_chars = CAPTION_MAX_CHARS if max_chars is None else max_chars
+
+    caption = (caption or "").strip()
+    if not caption:
+        return [EMPTY]
+
+    issues = []
+    # Models sometimes quote the sentence they were told to start with
+    prefix = re.escape(caption_prefix(token))
+    if not re.match(rf"{prefix}(?!\w)", caption.lstrip("\"'"), re.IGNORECASE):
+        issues.append(PREFIX)
+    if not re.search(rf"(?<!\w){re.escape(token)}(?!\w)", caption):
+        issues.append(TOKEN)
+    if len(caption) < min_chars:
+        issues.append(TOO_SHORT)
+    if len(caption) > max_chars:
+        issues.append(TOO_LONG)
+    if any(pattern.search(caption) for pattern in REFUSAL_PATTERNS):
+        issues.append(REFUSAL)
+    return issues
+
+def validate_captions(captions, token, min_chars=None, max_chars=None):
+    """Checks every caption of a dataset.
+
+    Args:
+        captions (list): The captions, in dataset order.
+        token (str): Token of the model.
+        min_chars (int, optional): See check_caption.
+        max_chars (int, optional): See check_caption.
+
+    Returns:
+        dict: The issues of each failing caption, by index.
+    """
+    failures = {}
+    for i, caption in enumerate(captions):
+        issues = check_caption(caption, token, min_chars, max_chars)
+        if issues:
+            failures[i] = issues
+    return failures
+
+def validation_stats(total, first_failures, last_failures, rounds):
+    """Summarizes the validation of a dataset.
+
+    Args:
+        total (int): Number of captions.
+        first_failures (dict): Failures of the first validation, before any
+            re-request (see validate_captions).
+        last_failures (dict): Failures of the last validation.
+        rounds (int): Number of re-request rounds made.
+
+    Returns:
+        dict: The number of captions checked, of captions which failed at
+            first ("flagged"), were fixed by re-requesting them ("fixed")
+            and still fail ("failed"), the re-request rounds and the count
+            of every issue at first and in the end.
+    """
+    return {
+        "checked": total,
+        "flagged": len(first_failures),
+        "fixed": len(first_failures) - len(last_failures),
+        "failed": len(last_failures),
+        "rounds": rounds,
+        "issues": dict(Counter(
+            issue for issues in first_failures.values() for issue in issues
+        )),
+        "remainingIssues": dict(Counter(
+            issue for issues in last_failures.values() for issue in issues
+        )),
+    }
@@ -0,0 +1,170 @@
+import atexit
+import asyncio
+import threading
+from src.config import (
+    XAI_API_KEY,
+    XAI_BASE_URL,
+    XAI_POOL_SIZE,
+    XAI_KEEPALIVE_EXPIRY,
+    REPLICATE_API_TOKEN,
+    REPLICATE_POOL_SIZE,
+)
+from src.services.rate_limit import RateLimitedTransport, get_rate_limiter
+
+# The SDKs are imported on first use, so commands and requests that never
+# talk to X.AI or Replicate don't pay for importing them
+
+# Pooled clients keyed by API key, shared across calls and Flask requests
+_xai_clients = {}
+_async_xai_clients = {}
+_replicate_clients = {}
+_lock = threading.Lock()
+
+def _pool_limits():
+    import httpx
+    return httpx.Limits(
+        max_connections=XAI_POOL_SIZE,
+        max_keepalive_connections=XAI_POOL_SIZE,
+        keepalive_expiry=XAI_KEEPALIVE_EXPIRY,
+    )
+
+def get_xai_client(api_key=None):
+    """Returns the connection-pooled X.AI client for an API key.
+
+    The client is created on first use and kept alive afterwards, so
+    successive calls reuse open connections instead of paying a new TLS
+    handshake per image. Retries are disabled on the client because callers
+    handle them (see xai_integration.generate_description_with_retries).
+
+    Args:
+        api_key (str, optional): The X.AI API key. Defaults to XAI_API_KEY.
+
+    Returns:
+        OpenAI: The shared client.
+    """
+    import httpx
+    from openai import OpenAI
+
+    api_key = api_key or XAI_API_KEY
+    with _lock:
+        client = _xai_clients.get(api_key)
+        if client is None:
+            client = OpenAI(
+                api_key=api_key,
+                base_url=XAI_BASE_URL,
+                max_retries=0,
+                http_client=httpx.Client(limits=_pool_limits()),
+            )
+            _xai_clients[api_key] = client
+        return client
+
+def get_async_xai_client(api_key=None):
+    """Returns the connection-pooled asynchronous X.AI client for an API key.
+
+    Args:
+        api_key (str, optional): The X.AI API key. Defaults to XAI_API_KEY.
+
+    Returns:
+        AsyncOpenAI: The shared client.
+    """
+    import httpx
+    from openai import AsyncOpenAI
+
+    api_key = api_key or XAI_API_KEY
+    with _lock:
+        client = _async_xai_clients.get(api_key)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=XAI_BASE_URL,
+                max_retries=0,
+                http_client=httpx.AsyncClient(limits=_pool_limits()),
+            )
+            _async_xai_clients[api_key] = client
+        return client
+
+def get_replicate_client(api_token=None):
+    """Returns the connection-pooled Replicate client for an API token.
+
+    Using a dedicated client per token, rather than setting 
+    REPLICATE_API_TOKEN in the environment, keeps concurrent jobs of 
+    different users from overwriting each other's credentials. Requests 
+    are paced under REPLICATE_REQUESTS_PER_MINUTE, and rate limited ones 
+    are retried after their Retry-After (see rate_limit.RateLimitedTransport).
+    The SDK's own retries are disabled.
+
+    Args:
+        api_token (str, optional): The Replicate API token. Defaults to 
+            REPLICATE_API_TOKEN.
+
+    Returns:
+        replicate.Client: The shared client.
+    """
+    import httpx
+    import replicate
+
+    api_token = api_token or REPLICATE_API_TOKEN
+    with _lock:
+        entry = _replicate_clients.get(api_token)
+        if entry is None:
+            transport = httpx.HTTPTransport(limits=httpx.Limits(
+                max_connections=REPLICATE_POOL_SIZE,
+                max_keepalive_connections=REPLICATE_POOL_SIZE,
+                keepalive_expiry=XAI_KEEPALIVE_EXPIRY,
+            ))
+            # Requests of every job using this token share its rate limit
+            transport = RateLimitedTransport(
+                transport, get_rate_limiter("replicate"), api_token
+            )
+            client = replicate.Client(api_token=api_token, transport=transport)
+            # The SDK always wraps the transport in its own RetryTransport,
+            # which would retry rate limited requests on top of ours and
+            # multiply the attempts, and takes no prebuilt httpx client.
+            # Keep RateLimitedTransport the only retry layer by turning its
+            # retries off; this relies on replicate 0.22 internals, hence
+            # the pin in requirements.txt
+            retry_transport = getattr(client._client, "_transport", None)
+            if hasattr(retry_transport, "max_attempts"):
+                retry_transport.max_attempts = 1
+            else:
+                print("Warning: could not disable the retries of the Replicate "
+                      "SDK; rate limited requests may be retried twice")
+            entry = (client, transport)
+            _replicate_clients[api_token] = entry
+        return entry[0]
+
+def close_clients():
+    """Closes every pooled client and empties the registry.
+
+    Registered with atexit, so connections are released on shutdown.
+
+    Returns:
+        None
+    """
+    with _lock:
+        clients = list(_xai_clients.values())
+        async_clients = list(_async_xai_clients.values())
+        replicate_transports = [transport for _, transport in _replicate_clients.values()]
+        _xai_clients.clear()
+        _async_xai_clients.clear()
+        _replicate_clients.clear()
+
+    for client in clients:
+        try:
+            client.close()
+        except Exception as e:
+            print(f"Error while closing X.AI client: {e}")
+
+    for client in async_clients:
+        try:
+            asyncio.run(client.close())
+        except Exception as e:
+            print(f"Error while closing async X.AI client: {e}")
+
+    for transport in replicate_transports:
+        try:
+            transport.close()
+        except Exception as e:
+            print(f"Error while closing Replicate client: {e}")
+
+atexit.register(close_clients)
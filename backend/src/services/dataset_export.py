@@ -0,0 +1,357 @@
+import io
+import os
+import json
+import glob
+import fcntl
+import zipfile
+import tempfile
+import src.services.file_processing as fp
+from src.services.preprocessing import downscale_image, parse_max_resolution
+from src.config import EXPORT_ROW_GROUP_ROWS
+
+# pyarrow is imported on first use, so the app and the commands that don't
+# export datasets don't pay for importing it
+
+# Columns of an export, with the type of each. "image" and "text" follow the
+# layout of Hugging Face image datasets, so trainers built on the datasets
+# library load an export as is
+EXPORT_COLUMNS = {
+    "index": "int64",
+    "name": "string",
+    "source": "string",
+    "hash": "string",
+    "format": "string",
+    "width": "int32",
+    "height": "int32",
+    "bucket_width": "int32",
+    "bucket_height": "int32",
+    "text": "string",
+    "image": "image",
+}
+
+# File locked by the writer of an export, in the export folder
+LOCK_FILE = ".lock"
+
+# Image sides of the trainer buckets are multiples of this
+BUCKET_STEP = 64
+
+def bucket_resolution(width, height, resolution):
+    """Returns the aspect ratio bucket an image is trained at.
+
+    The image is scaled down to the pixel area of the largest resolution of
+    the setting, keeping its aspect ratio, and both sides are rounded down
+    to a multiple of BUCKET_STEP, as the trainer does.
+
+    Args:
+        width (int): Width of the image.
+        height (int): Height of the image.
+        resolution (str): Training resolution buckets, e.g. "512,768,1024".
+
+    Returns:
+        tuple: Width and height of the bucket.
+    """
+    side = parse_max_resolution(resolution)
+    scale = min(1.0, side / (width * height) ** 0.5)
+    return (
+        max(BUCKET_STEP, int(width * scale) // BUCKET_STEP * BUCKET_STEP),
+        max(BUCKET_STEP, int(height * scale) // BUCKET_STEP * BUCKET_STEP),
+    )
+
+def _schema():
+    import pyarrow as pa
+
+    types = {
+        "int64": pa.int64(),
+        "int32": pa.int32(),
+        "string": pa.string(),
+        "image": pa.struct([("bytes", pa.binary()), ("path", pa.string())]),
+    }
+    features = {
+        name: {"_type": "Image"} if kind == "image" else {"dtype": kind, "_type": "Value"}
+        for name, kind in EXPORT_COLUMNS.items()
+    }
+    return pa.schema(
+        [(name, types[kind]) for name, kind in EXPORT_COLUMNS.items()],
+        metadata={"huggingface": json.dumps({"info": {"features": features}})},
+    )
+
+def _parts(export_dir):
+    return sorted(glob.glob(os.path.join(os.path.abspath(export_dir), "part-*.parquet")))
+
+def _open_dataset(export_dir):
+    import pyarrow.dataset as ds
+    from pyarrow.fs import LocalFileSystem
+
+    # Memory-mapped, so random reads only touch the row groups they need
+    return ds.dataset(
+        _parts(export_dir),
+        format="parquet",
+        filesystem=LocalFileSystem(use_mmap=True),
+    )
+
+def count_rows(export_dir):
+    """Returns the number of images of an export.
+
+    Args:
+        export_dir (str): Path of the export.
+
+    Returns:
+        int: The number of rows, 0 if the export doesn't exist.
+    """
+    if not _parts(export_dir):
+        return 0
+    return _open_dataset(export_dir).count_rows()
+
+def read_rows(export_dir, indices=None, columns=None):
+    """Reads rows of an export by position, without reading the others.
+
+    Args:
+        export_dir (str): Path of the export.
+        indices (list, optional): Positions of the rows. Defaults to every
+            row.
+        columns (list, optional): Columns to read. Defaults to all of them.
+
+    Returns:
+        list: One dict per row, in the order of indices. The image is a
+            dict with its bytes ("bytes") and file name ("path").
+    """
+    if not _parts(export_dir):
+        return []
+    dataset = _open_dataset(export_dir)
+    if indices is None:
+        return dataset.to_table(columns=columns).to_pylist()
+    return dataset.take(list(indices), columns=columns).to_pylist()
+
+class ExportWriter:
+    """Appends rows to an export as a new Parquet part.
+
+    Rows are numbered after those already exported and written in row
+    groups of EXPORT_ROW_GROUP_ROWS, so memory stays bounded whatever the
+    size of the dataset. The part only appears in the export once the
+    writer closes without error. An export has a single writer at a time:
+    the writer holds a lock on the export, which other writers, in any
+    process, wait for.
+
+    Usage:
+        with ExportWriter(export_dir) as writer:
+            writer.write(row)
+    """
+
+    def __init__(self, export_dir, row_group_rows=EXPORT_ROW_GROUP_ROWS):
+        """
+        Args:
+            export_dir (str): Path of the export, created if needed.
+            row_group_rows (int): Rows per row group.
+        """
+        self.export_dir = export_dir
+        self.row_group_rows = row_group_rows
+        self.written = 0
+        self._rows = []
+        self._writer = None
+        self._tmp_path = None
+        self._lock = None
+
+    def __enter__(self):
+        import pyarrow.parquet as pq
+
+        os.makedirs(self.export_dir, exist_ok=True)
+        # Rows are numbered and parts named from what is exported, so
+        # writers go one at a time
+        self._lock = open(os.path.join(self.export_dir, LOCK_FILE), "a")
+        try:
+            fcntl.flock(self._lock, fcntl.LOCK_EX)
+            self._next_index = count_rows(self.export_dir)
+            self._part = len(_parts(self.export_dir))
+            fd, self._tmp_path = tempfile.mkstemp(dir=self.export_dir, suffix=".tmp")
+            os.close(fd)
+            self._writer = pq.ParquetWriter(self._tmp_path, _schema())
+        except BaseException:
+            self._release()
+            raise
+        return self
+
+    def _release(self):
+        if self._tmp_path is not None and os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+        # Closing the file releases the lock
+        self._lock.close()
+        self._lock = None
+
+    def write(self, row):
+        """Adds a row; its "index" is assigned by the writer.
+
+        Args:
+            row (dict): The values of the other columns (see
+                EXPORT_COLUMNS).
+
+        Returns:
+            int: The index of the row in the export.
+        """
+        index = self._next_index + self.written
+        self._rows.append(dict(row, index=index))
+        self.written += 1
+        if len(self._rows) >= self.row_group_rows:
+            self._flush()
+        return index
+
+    def _flush(self):
+        import pyarrow as pa
+
+        if self._rows:
+            self._writer.write_table(
+                pa.Table.from_pylist(self._rows, schema=_schema())
+            )
+            self._rows = []
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self._flush()
+            self._writer.close()
+            if exc_type is None and self.written:
+                os.replace(
+                    self._tmp_path,
+                    os.path.join(self.export_dir, f"part-{self._part:05d}.parquet"),
+                )
+        finally:
+            self._release()
+        return False
+
+def export_dataset(zip_path, export_dir, resolution, dataset=None):
+    """Appends the images and captions of a training archive to an export.
+
+    Images already in the export (same content hash) are skipped, so
+    exporting successive versions of a dataset only adds the new images.
+
+    Args:
+        zip_path (str): Path to the training archive (see
+            file_processing.build_dataset_zip).
+        export_dir (str): Path of the export.
+        resolution (str): Training resolution buckets, e.g. "512,768,1024".
+        dataset (list, optional): The dataset table of the archive, to
+            record the source member of each image.
+
+    Returns:
+        int: Number of images added to the export.
+    """
+    from PIL import Image
+
+    sources = {row["image"]: row["member"] for row in dataset or []}
+
+    with zipfile.ZipFile(zip_path, 'r') as source, ExportWriter(export_dir) as writer:
+        # Read under the lock of the writer, so concurrent exports of the
+        # same images don't both add them
+        exported = {row["hash"] for row in read_rows(export_dir, columns=["hash"])}
+        names = set(source.namelist())
+        for entry in fp.scan_dataset(source):
+            if entry["hash"] in exported:
+                continue
+            exported.add(entry["hash"])
+
+            data = source.read(entry["member"])
+            with Image.open(io.BytesIO(data)) as image:
+                width, height = image.size
+            bucket_width, bucket_height = bucket_resolution(width, height, resolution)
+            name = os.path.splitext(os.path.basename(entry["member"]))[0]
+            caption = f"{os.path.splitext(entry['member'])[0]}.txt"
+            writer.write({
+                "name": name,
+                "source": sources.get(entry["member"], entry["member"]),
+                "hash": entry["hash"],
+                "format": entry["format"],
+                "width": width,
+                "height": height,
+                "bucket_width": bucket_width,
+                "bucket_height": bucket_height,
+                "text": source.read(caption).decode("utf-8") if caption in names else None,
+                "image": {"bytes": data, "path": os.path.basename(entry["member"])},
+            })
+    return writer.written
+
+def slice_export(export_dir, output_dir, indices=None, max_side=None,
+                 resolution=None):
+    """Writes a subset of an export, optionally at a lower resolution, as a
+    new export.
+
+    Only the selected rows are read, a row group at a time.
+
+    Args:
+        export_dir (str): Path of the source export.
+        output_dir (str): Path of the new export.
+        indices (list, optional): Positions of the rows to keep. Defaults to
+            every row.
+        max_side (int, optional): Maximum width or height of the images;
+            larger ones are downscaled.
+        resolution (str, optional): Training resolution buckets to compute
+            the buckets for. Defaults to max_side, or else keeps the
+            buckets.
+
+    Returns:
+        int: Number of images written.
+    """
+    if indices is None:
+        indices = range(count_rows(export_dir))
+    indices = list(indices)
+    if resolution is None and max_side is not None:
+        resolution = str(max_side)
+
+    with ExportWriter(output_dir) as writer:
+        for start in range(0, len(indices), EXPORT_ROW_GROUP_ROWS):
+            for row in read_rows(export_dir, indices[start:start + EXPORT_ROW_GROUP_ROWS]):
+                row.pop("index")
+                if max_side is not None:
+                    data, (width, height) = downscale_image(row["image"]["bytes"], max_side)
+                    if data is not row["image"]["bytes"]:
+                        row["format"] = "jpeg"
+                        row["image"] = {
+                            "bytes": data,
+                            "path": f"{row['name']}.jpg",
+                        }
+                    row["width"], row["height"] = width, height
+                if resolution is not None:
+                    row["bucket_width"], row["bucket_height"] = bucket_resolution(
+                        row["width"], row["height"], resolution
+                    )
+                writer.write(row)
+    return writer.written
+
+def export_to_zip(export_dir, output_zip, indices=None):
+    """Writes a training archive from an export, for trainers taking the
+    images and captions as files.
+
+    Args:
+        export_dir (str): Path of the export.
+        output_zip (str): Path where the training archive will be created.
+        indices (list, optional): Positions of the rows to include.
+            Defaults to every row.
+
+    Returns:
+        int: Number of images written.
+    """
+    if indices is None:
+        indices = range(count_rows(export_dir))
+    indices = list(indices)
+
+    names = set()
+    with zipfile.ZipFile(output_zip, 'w') as target:
+        for start in range(0, len(indices), EXPORT_ROW_GROUP_ROWS):
+            for row in read_rows(export_dir, indices[start:start + EXPORT_ROW_GROUP_ROWS]):
+                # Successive versions of a dataset reuse the same names
+                name = row["name"]
+                if name in names:
+                    name = f"{name}_{row['index']}"
+                names.add(name)
+
+                # Images don't shrink, captions do
+                target.writestr(
+                    name + os.path.splitext(row["image"]["path"])[1],
+                    row["image"]["bytes"],
+                    compress_type=zipfile.ZIP_STORED,
+                )
+                if row["text"] is not None:
+                    target.writestr(
+                        f"{name}.txt",
+                        row["text"],
+                        compress_type=zipfile.ZIP_DEFLATED,
+                    )
+    return len(indices)
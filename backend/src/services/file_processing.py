@@ -1,54 +1,487 @@
 import os
 import zipfile
 import shutil
+import hashlib
+import tempfile
+from functools import partial
+from src.services.metrics import timed
+from src.config import (
+    ARCHIVE_MAX_MEMBERS,
+    ARCHIVE_MAX_MEMBER_BYTES,
+    ARCHIVE_MAX_TOTAL_BYTES,
+    ARCHIVE_MAX_RATIO,
+)
 
-def unzip_file(zip_path, output_folder):
-    """Extracts contents of a ZIP file to specified output folder.
+# Buffer size used when streaming archive members
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Leading bytes of the image formats the trainer accepts, with the format
+# name and the extension images of that format are stored under. WebP,
+# whose signature has a gap, is checked separately
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png", ".png"),
+)
+
+# Members below this size are not checked for their compression ratio, as
+# small text files legitimately compress well
+RATIO_CHECK_MIN_BYTES = 1024 * 1024
+
+class ArchiveError(ValueError):
+    """An archive which is invalid, unsafe or over the ARCHIVE_* limits."""
+
+def is_safe_member(member_name):
+    """Checks that an archive member extracts inside the target folder.
+
+    Args:
+        member_name (str): Name of the member inside the archive.
+
+    Returns:
+        bool: False for absolute paths, drive letters and '..' components.
+    """
+    name = member_name.replace("\\", "/")
+    if name.startswith("/") or (len(name) > 1 and name[1] == ":"):
+        return False
+    return ".." not in name.split("/")
+
+def check_archive(zip_ref, max_members=ARCHIVE_MAX_MEMBERS,
+                  max_member_bytes=ARCHIVE_MAX_MEMBER_BYTES,
+                  max_total_bytes=ARCHIVE_MAX_TOTAL_BYTES,
+                  max_ratio=ARCHIVE_MAX_RATIO):
+    """Checks an opened archive against the limits before reading any 
+    member.
+
+    Only the central directory is read. Its sizes can be trusted, since 
+    zipfile never returns more bytes for a member than declared there.
+
+    Args:
+        zip_ref (zipfile.ZipFile): The opened archive.
+        max_members (int): Maximum number of files.
+        max_member_bytes (int): Maximum uncompressed size of a file.
+        max_total_bytes (int): Maximum uncompressed size of all files.
+        max_ratio (float): Maximum compression ratio of a file.
+
+    Returns:
+        None
+
+    Raises:
+        ArchiveError: If the archive is over a limit or has a member 
+            extracting outside of the target folder.
+    """
+    members = [info for info in zip_ref.infolist() if not info.is_dir()]
+    if len(members) > max_members:
+        raise ArchiveError(
+            f"Archive has {len(members)} files, more than the {max_members} allowed"
+        )
+
+    total = 0
+    for info in members:
+        if not is_safe_member(info.filename):
+            raise ArchiveError(f"Unsafe file path in archive: {info.filename}")
+        if info.file_size > max_member_bytes:
+            raise ArchiveError(
+                f"{info.filename} is {info.file_size} bytes, more than the "
+                f"{max_member_bytes} allowed"
+            )
+        if (info.file_size >= RATIO_CHECK_MIN_BYTES
+                and info.file_size > max_ratio * max(info.compress_size, 1)):
+            raise ArchiveError(f"{info.filename} is compressed suspiciously well")
+        total += info.file_size
+    if total > max_total_bytes:
+        raise ArchiveError(
+            f"Archive expands to {total} bytes, more than the {max_total_bytes} allowed"
+        )
+
+def validate_archive(zip_path):
+    """Checks an uploaded archive before it is accepted (see check_archive).
+
+    Args:
+        zip_path (str): Path to the archive.
+
+    Returns:
+        None
+
+    Raises:
+        ArchiveError: If the file is not a ZIP archive or the archive is 
+            rejected.
+    """
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            check_archive(zip_ref)
+    except zipfile.BadZipFile:
+        raise ArchiveError("Invalid ZIP file")
+
+def unzip_file(zip_path, output_folder, on_progress=None):
+    """Extracts the images of a ZIP file to specified output folder.
+
+    The archive is checked against the limits first (see check_archive). 
+    Members are then streamed to disk one at a time in fixed-size chunks, 
+    so memory use doesn't depend on the archive. Only images, recognized by 
+    their content rather than their extension, are extracted; OS metadata 
+    and other files are skipped. A member is written under a temporary name 
+    and renamed once complete.
 
     Args:
         zip_path (str): Path to the ZIP file that needs to be extracted.
         output_folder (str): Destination folder path for extracted contents.
+        on_progress (callable, optional): Called after every member as 
+            on_progress(done=..., members=..., extracted=..., bytes=..., 
+            total_bytes=...), counting the members processed and extracted 
+            and the uncompressed bytes read.
 
     Returns:
-        None
+        list: Paths of the extracted images.
+
+    Raises:
+        ArchiveError: If the archive is rejected.
     """
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(output_folder)
+    root = os.path.realpath(output_folder)
+    extracted = []
+    with timed("unzip"), zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        check_archive(zip_ref)
+        members = list_dataset_members(zip_ref)
+        total_bytes = sum(info.file_size for info in members)
+        read = 0
+        for done, info in enumerate(members, start=1):
+            target = os.path.realpath(os.path.join(root, info.filename))
+            if not target.startswith(root + os.sep):
+                raise ArchiveError(f"Unsafe file path in archive: {info.filename}")
+
+            with zip_ref.open(info) as src:
+                header = src.read(16)
+                if detect_image_format(header) is not None:
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    partial_path = f"{target}.part"
+                    try:
+                        with open(partial_path, 'wb') as dst:
+                            dst.write(header)
+                            shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+                        os.replace(partial_path, target)
+                    finally:
+                        if os.path.exists(partial_path):
+                            os.remove(partial_path)
+                    extracted.append(target)
+
+            read += info.file_size
+            if on_progress is not None:
+                on_progress(
+                    done=done,
+                    members=len(members),
+                    extracted=len(extracted),
+                    bytes=read,
+                    total_bytes=total_bytes,
+                )
+    return extracted
 
 def rename_files(folder_path, token):
-    """Renames all files in a folder using a specified token and sequential 
+    """Renames the images of a folder using a specified token and sequential 
     numbering.
 
-    Iterates through files in the specified folder and renames them to the 
-    format: 'photo_of_[token]_[index].jpg'
+    Images are numbered in name order and renamed to the format 
+    'photo_of_[token]_[index]' followed by the extension of their actual 
+    format. Files that are not images, such as OS metadata, are left 
+    untouched. Files are first moved to temporary names, so an image never 
+    overwrites another one already bearing its target name.
 
     Args:
         folder_path (str): Path to the folder containing files to be renamed.
         token (str): Token to be used in the new file names.
 
     Returns:
-        None
+        list: The dataset table of the renamed images (see name_dataset), 
+            with the new file name of each image in "image".
     """
-    for i, file_name in enumerate(os.listdir(folder_path)):
-        old_path = os.path.join(folder_path, file_name)
-        new_path = os.path.join(folder_path, f"photo_of_{token}_{i}.jpg")
-        os.rename(old_path, new_path)
+    with timed("rename"):
+        dataset = name_dataset(scan_folder(folder_path), token, captions=False)
+        staged = []
+        for row in dataset:
+            staged_path = os.path.join(folder_path, f".rename-{row['index']}{row['extension']}")
+            os.rename(os.path.join(folder_path, row["member"]), staged_path)
+            staged.append(staged_path)
+        for row, staged_path in zip(dataset, staged):
+            os.rename(staged_path, os.path.join(folder_path, row["image"]))
+    return dataset
 
-def zip_files(folder_path, output_zip):
+def zip_files(folder_path, output_zip, dataset=None):
     """Creates a ZIP archive containing all files from specified folder.
 
     Args:
         folder_path (str): Path to the folder containing files to be zipped.
         output_zip (str): Path where the output ZIP file will be created.
+        dataset (list, optional): Dataset table of the folder (see 
+            rename_files). If given, only its images and their captions are 
+            archived, without listing the folder.
 
     Returns:
         None
     """
-    with zipfile.ZipFile(output_zip, 'w') as zip_ref:
+    with timed("zip"), zipfile.ZipFile(output_zip, 'w') as zip_ref:
+        if dataset is not None:
+            for row in dataset:
+                for name in (row["image"], row.get("caption")):
+                    if name and os.path.exists(os.path.join(folder_path, name)):
+                        zip_ref.write(os.path.join(folder_path, name), name)
+            return
         for root, _, files in os.walk(folder_path):
             for file in files:
                 zip_ref.write(os.path.join(root, file), file)
 
+def is_junk_member(member_name):
+    """Checks whether an archive member is OS metadata rather than a dataset 
+    file (e.g. '__MACOSX/' resource forks or hidden '.DS_Store' files).
+
+    Args:
+        member_name (str): Name of the member inside the archive.
+
+    Returns:
+        bool: True if the member should be skipped.
+    """
+    parts = member_name.replace("\\", "/").split("/")
+    return "__MACOSX" in parts or any(part.startswith(".") for part in parts if part)
+
+def list_dataset_members(zip_ref):
+    """Lists the dataset files of an opened ZIP archive in a stable order.
+
+    Directories and OS metadata entries are skipped. Members are sorted by 
+    name so the resulting numbering does not depend on the archive layout.
+
+    Args:
+        zip_ref (zipfile.ZipFile): The opened source archive.
+
+    Returns:
+        list: The zipfile.ZipInfo of each dataset file.
+    """
+    members = [
+        info for info in zip_ref.infolist()
+        if not info.is_dir() and not is_junk_member(info.filename)
+    ]
+    return sorted(members, key=lambda info: info.filename)
+
+def detect_image_format(header):
+    """Identifies an image format the trainer accepts from its first bytes.
+
+    Args:
+        header (bytes): The first bytes of the file (at least 12).
+
+    Returns:
+        tuple: The format name and the extension to store it under, or 
+            None if the file is not a supported image.
+    """
+    for signature, image_format, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_format, extension
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp", ".webp"
+    return None
+
+def _scan_file(file):
+    # Reads a file once, keeping its header and hashing its content
+    digest = hashlib.sha256()
+    header = b""
+    for chunk in iter(lambda: file.read(COPY_CHUNK_SIZE), b""):
+        if not header:
+            header = chunk[:16]
+        digest.update(chunk)
+    return header, digest.hexdigest()
+
+def _table_entry(index, member, header, content_hash, size):
+    detected = detect_image_format(header)
+    if detected is None:
+        return None
+    return {
+        "index": index,
+        "member": member,
+        "hash": content_hash,
+        "format": detected[0],
+        "extension": detected[1],
+        "size": size,
+    }
+
+def scan_dataset(zip_ref):
+    """Indexes the images of an opened ZIP archive in a single pass.
+
+    The archive is checked against the limits first (see check_archive). 
+    Members are taken in name order, OS metadata is skipped and so is every 
+    file whose content is not a supported image, whatever its extension.
+
+    Args:
+        zip_ref (zipfile.ZipFile): The opened source archive.
+
+    Returns:
+        list: One entry per image, with its position in the table 
+            ("index"), member name ("member"), content hash ("hash", see 
+            caption_cache.hash_image), format ("format": jpeg, png or webp), 
+            file extension ("extension") and size in bytes ("size").
+
+    Raises:
+        ArchiveError: If the archive is rejected.
+    """
+    check_archive(zip_ref)
+    table = []
+    for info in list_dataset_members(zip_ref):
+        with zip_ref.open(info) as member:
+            header, content_hash = _scan_file(member)
+        entry = _table_entry(len(table), info.filename, header, content_hash, info.file_size)
+        if entry is not None:
+            table.append(entry)
+    return table
+
+def scan_folder(folder_path):
+    """Indexes the images of a folder, like scan_dataset does for an archive.
+
+    Args:
+        folder_path (str): Path to the folder.
+
+    Returns:
+        list: One entry per image (see scan_dataset), the member name being 
+            the file name.
+    """
+    table = []
+    for file_name in sorted(os.listdir(folder_path)):
+        path = os.path.join(folder_path, file_name)
+        if is_junk_member(file_name) or not os.path.isfile(path):
+            continue
+        with open(path, "rb") as file:
+            header, content_hash = _scan_file(file)
+        entry = _table_entry(len(table), file_name, header, content_hash, os.path.getsize(path))
+        if entry is not None:
+            table.append(entry)
+    return table
+
+def name_dataset(entries, token, captions=True, start=0):
+    """Assigns the training file names of the images of a dataset.
+
+    Args:
+        entries (list): Entries of scan_dataset, in training order.
+        token (str): Token to be used in the new file names.
+        captions (bool): Whether the images get a caption file.
+        start (int): Position of the first entry, when naming a dataset a
+            part at a time.
+
+    Returns:
+        list: The dataset table: the entries with their base name ("name", 
+            'photo_of_[token]_[position]'), image file name ("image") and 
+            caption file name ("caption", None without captions).
+    """
+    return [
+        dict(
+            entry,
+            name=f"photo_of_{token}_{i}",
+            image=f"photo_of_{token}_{i}{entry['extension']}",
+            caption=f"photo_of_{token}_{i}.txt" if captions else None,
+        )
+        for i, entry in enumerate(entries, start)
+    ]
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def build_dataset_zip(zip_path, output_zip, token, describe=None,
+                      on_members=None, preprocess=None, on_dataset=None,
+                      spool_dir=None):
+    """Builds the training archive straight from the uploaded archive.
+
+    The archive is scanned once into a dataset table (see scan_dataset and 
+    name_dataset), from which every later stage reads. Images are streamed 
+    from the source archive into the output archive under the name 
+    'photo_of_[token]_[index]' with the extension of their format, without 
+    extracting them to a temporary folder first. Images are stored rather 
+    than recompressed, since they don't shrink, and the generated captions 
+    are written next to them as 'photo_of_[token]_[index].txt'.
+
+    Args:
+        zip_path (str): Path to the uploaded ZIP file containing the images.
+        output_zip (str): Path where the training ZIP file will be created.
+        token (str): Token to be used in the new file names.
+        describe (callable, optional): Called once with the list of images, 
+            each a callable returning the image bytes or the bytes 
+            themselves, and returning the descriptions in the same order 
+            (e.g. a partial of xai_integration.generate_descriptions). If 
+            None, no captions are written.
+        on_members (callable, optional): Called with the number of images 
+            going into the training archive, before captioning starts.
+        preprocess (callable, optional): Called once with the list of 
+            images, each a callable returning the image bytes, and returning 
+            or yielding the records of the images to keep (e.g. a partial of 
+            preprocessing.preprocess_images). Each re-encoded JPEG image is 
+            written to the output archive as its record arrives, in place of 
+            the original, and its caption derivative is spooled to disk to 
+            be described, so memory doesn't grow with the dataset.
+        on_dataset (callable, optional): Called with the dataset table of 
+            the training archive once it is written.
+        spool_dir (str, optional): Folder the caption derivatives are 
+            spooled to, e.g. in the job workspace. Defaults to a temporary 
+            folder next to output_zip. Emptied once the archive is written.
+
+    Returns:
+        int: Number of images written to the output archive.
+    """
+    captions = describe is not None
+    if spool_dir is None:
+        spool_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output_zip)))
+    else:
+        os.makedirs(spool_dir, exist_ok=True)
+
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as source, \
+                zipfile.ZipFile(output_zip, 'w') as target:
+            with timed("scan"):
+                table = scan_dataset(source)
+            images = [partial(source.read, entry["member"]) for entry in table]
+
+            if preprocess is not None:
+                dataset = []
+                with timed("preprocess"):
+                    for record in preprocess(images):
+                        entry = dict(table[record["index"]], format="jpeg", extension=".jpg")
+                        row = name_dataset([entry], token, captions, start=len(dataset))[0]
+                        target.writestr(
+                            row["image"], record["image"], compress_type=zipfile.ZIP_STORED
+                        )
+                        if captions:
+                            path = os.path.join(spool_dir, f"{row['name']}.jpg")
+                            with open(path, "wb") as f:
+                                f.write(record["caption_image"])
+                        dataset.append(row)
+                images = [
+                    partial(_read_file, os.path.join(spool_dir, f"{row['name']}.jpg"))
+                    for row in dataset
+                ]
+            else:
+                dataset = name_dataset(table, token, captions)
+
+            if on_members is not None:
+                on_members(len(dataset))
+
+            descriptions = None
+            if captions:
+                with timed("caption"):
+                    descriptions = describe(images)
+
+            with timed("zip"):
+                for i, row in enumerate(dataset):
+                    if preprocess is None:
+                        info = source.getinfo(row["member"])
+                        image_info = zipfile.ZipInfo(row["image"], date_time=info.date_time)
+                        image_info.compress_type = zipfile.ZIP_STORED
+                        image_info.file_size = info.file_size
+                        with source.open(info) as src, target.open(image_info, 'w') as dst:
+                            shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+
+                    if descriptions is not None:
+                        target.writestr(
+                            row["caption"],
+                            descriptions[i],
+                            compress_type=zipfile.ZIP_DEFLATED,
+                        )
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+    if on_dataset is not None:
+        on_dataset(dataset)
+    return len(dataset)
+
 def delete_temp_folder(folder_path):
     """Deletes a folder and all its contents if it exists.
 
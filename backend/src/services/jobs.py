@@ -0,0 +1,375 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from functools import partial
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from src.config import JOB_STORE, JOB_DB_PATH, JOB_CONCURRENCY
+from src.services.metrics import JOBS_IN_FLIGHT
+from src.services.training_monitor import TERMINAL_STATUSES, get_training_monitor
+from src.services.trainers import get_trainer
+from src.services.workspace import is_owner_alive
+
+# Job lifecycle
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# Training error of the jobs whose training can't be followed after a restart
+UNTRACKED_ERROR = "Training status unavailable after restart"
+
+# Export the in-flight gauges before the first job arrives
+for state in (QUEUED, RUNNING):
+    JOBS_IN_FLIGHT.labels(state=state)
+
+def new_job(name, batch_id=None):
+    """Builds the initial record of a job.
+
+    Args:
+        name (str): Human readable name of the job (e.g. the model token).
+        batch_id (str, optional): Id of the batch the job belongs to.
+
+    The record names the process running the job ("owner"), so a job left
+    queued or running by a worker that died can be told apart (see
+    JobQueue.fail_orphaned_jobs).
+
+    Returns:
+        dict: The job record.
+    """
+    now = time.time()
+    return {
+        "id": uuid.uuid4().hex,
+        "name": name,
+        "batchId": batch_id,
+        "status": QUEUED,
+        "stage": QUEUED,
+        "captioned": 0,
+        "total": None,
+        "error": None,
+        "owner": _process_owner(),
+        "createdAt": now,
+        "updatedAt": now,
+    }
+
+def _process_owner():
+    return {"pid": os.getpid(), "host": socket.gethostname()}
+
+def _is_orphaned(job):
+    # Only the processes of this host can be checked
+    owner = job.get("owner")
+    return (owner is not None and owner.get("host") == socket.gethostname()
+            and owner.get("pid") != os.getpid() and not is_owner_alive(owner))
+
+def is_job_finished(job):
+    """Checks whether a job record will change no more.
+
+    Args:
+        job (dict): The job record.
+
+    Returns:
+        bool: True once the job failed, its training reached a terminal 
+            status, or its training can no longer be followed (an error is 
+            recorded before the training ended).
+    """
+    return (job["status"] == FAILED or job.get("trainingStatus") in TERMINAL_STATUSES
+            or job.get("trainingError") is not None)
+
+class MemoryJobStore:
+    """Keeps job records in memory. Only suitable for a single process."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+        return job
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields, updatedAt=time.time())
+            return dict(job)
+
+    def update_if(self, job_id, expected, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            if any(job.get(key) != value for key, value in expected.items()):
+                return None
+            job.update(fields, updatedAt=time.time())
+            return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self, limit=50, status=None, batch_id=None):
+        with self._lock:
+            jobs = [dict(job) for job in self._jobs.values()
+                    if (status is None or job["status"] == status)
+                    and (batch_id is None or job.get("batchId") == batch_id)]
+        jobs.sort(key=lambda job: job["createdAt"], reverse=True)
+        return jobs if limit is None else jobs[:limit]
+
+class SQLiteJobStore:
+    """Keeps job records in a SQLite database, so every worker process of
+    the backend sees the same jobs."""
+
+    def __init__(self, db_path=JOB_DB_PATH):
+        self.db_path = db_path
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT, created REAL, data TEXT)"
+            )
+
+    def _connect(self):
+        # One short-lived connection per operation keeps the store safe to
+        # use from any thread
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def create(self, job):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, created, data) VALUES (?, ?, ?, ?)",
+                (job["id"], job["status"], job["createdAt"], json.dumps(job)),
+            )
+        return job
+
+    def update(self, job_id, **fields):
+        return self.update_if(job_id, {}, **fields)
+
+    def update_if(self, job_id, expected, **fields):
+        """Updates a job only if its current values match expected.
+
+        Args:
+            job_id (str): The job id.
+            expected (dict): Values the job must have, by field.
+            **fields: The fields to update.
+
+        Returns:
+            dict: The updated job, or None if it didn't match.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT data FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                raise KeyError(job_id)
+            job = json.loads(row[0])
+            if any(job.get(key) != value for key, value in expected.items()):
+                conn.execute("ROLLBACK")
+                return None
+            job.update(fields, updatedAt=time.time())
+            conn.execute(
+                "UPDATE jobs SET status = ?, data = ? WHERE id = ?",
+                (job["status"], json.dumps(job), job_id),
+            )
+            conn.execute("COMMIT")
+            return job
+
+    def get(self, job_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT data FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list(self, limit=50, status=None, batch_id=None):
+        query = "SELECT data FROM jobs"
+        conditions = []
+        params = []
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(status)
+        if batch_id is not None:
+            conditions.append("json_extract(data, '$.batchId') = ?")
+            params.append(batch_id)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY created DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        with closing(self._connect()) as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+def create_job_store(kind=JOB_STORE):
+    """Creates the job store selected by configuration.
+
+    Args:
+        kind (str): "sqlite" or "memory".
+
+    Returns:
+        MemoryJobStore | SQLiteJobStore: The store.
+    """
+    if kind == "memory":
+        return MemoryJobStore()
+    if kind == "sqlite":
+        return SQLiteJobStore()
+    raise ValueError("Invalid job store. Choose 'sqlite' or 'memory'.")
+
+class JobQueue:
+    """Runs jobs in the background on a bounded thread pool.
+
+    Every job gets a record in the store, created as queued and then updated
+    with the progress reported by the job function and its final outcome.
+    """
+
+    def __init__(self, store, max_workers=JOB_CONCURRENCY):
+        """
+        Args:
+            store: The job store (see create_job_store).
+            max_workers (int): Maximum number of jobs running at once.
+        """
+        self.store = store
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="job"
+        )
+        self.fail_orphaned_jobs()
+
+    def fail_orphaned_jobs(self):
+        """Marks as failed the queued and running jobs whose worker process
+        on this host is gone, as they will never finish.
+
+        Jobs of other hosts are left alone, their processes can't be
+        checked from here.
+
+        Returns:
+            int: Number of jobs marked as failed.
+        """
+        failed = 0
+        for status in (QUEUED, RUNNING):
+            for job in self.store.list(limit=None, status=status):
+                if not _is_orphaned(job):
+                    continue
+                self.store.update(
+                    job["id"],
+                    status=FAILED,
+                    stage=FAILED,
+                    error="The worker running the job stopped before it finished",
+                )
+                failed += 1
+        return failed
+
+    def resume_tracking(self):
+        """Tracks again the trainings submitted by jobs whose worker process
+        on this host is gone, so their status keeps being recorded after a
+        restart.
+
+        Each job is first claimed by this process, so only one of the
+        workers starting together tracks it. The job store doesn't keep API
+        tokens, so only the trainings submitted under the configured
+        account of their backend are tracked again. Those of other
+        accounts, and of backends without an account such as the fake
+        trainer, can't be polled from here: UNTRACKED_ERROR is recorded on
+        their jobs, as it is once the monitor gives up on a training.
+
+        Returns:
+            int: Number of trainings tracked again.
+        """
+        monitor = get_training_monitor()
+        resumed = 0
+        for job in self.store.list(limit=None, status=SUCCEEDED):
+            if (not job.get("trainingId") or job.get("trainingStatus") in TERMINAL_STATUSES
+                    or not _is_orphaned(job)):
+                continue
+            try:
+                trainer = get_trainer(job.get("trainer") or "replicate")
+            except ValueError:
+                # A backend no longer available
+                trainer = None
+            pollable = (trainer is not None and trainer.account is not None
+                        and job.get("trainerAccount") == trainer.account)
+
+            if self.store.update_if(job["id"], {"owner": job["owner"]},
+                                    owner=_process_owner()) is None:
+                # Claimed by another worker
+                continue
+            if not pollable:
+                # Nobody will report its status anymore
+                self.store.update(job["id"], trainingError=UNTRACKED_ERROR)
+                continue
+            monitor.track(
+                job["trainingId"],
+                trainer,
+                status=job.get("trainingStatus") or "starting",
+                on_update=partial(self._record_training, job["id"]),
+            )
+            resumed += 1
+        return resumed
+
+    def _record_training(self, job_id, event):
+        error = event["error"]
+        if event.get("untracked"):
+            error = UNTRACKED_ERROR
+        self.store.update(job_id, trainingStatus=event["status"], trainingError=error)
+
+    def submit(self, name, fn, *args, batch_id=None, **kwargs):
+        """Enqueues a job.
+
+        The job function is called as fn(*args, progress=..., **kwargs),
+        where progress(**fields) records stage-level progress on the job.
+
+        Args:
+            name (str): Human readable name of the job.
+            fn (callable): The job function.
+            batch_id (str, optional): Id of the batch the job belongs to.
+
+        Returns:
+            dict: The job record, as queued.
+        """
+        job = self.store.create(new_job(name, batch_id))
+        JOBS_IN_FLIGHT.labels(state=QUEUED).inc()
+        self._executor.submit(self._run, job["id"], fn, args, kwargs)
+        return job
+
+    def _run(self, job_id, fn, args, kwargs):
+        def progress(**fields):
+            self.store.update(job_id, **fields)
+
+        JOBS_IN_FLIGHT.labels(state=QUEUED).dec()
+        JOBS_IN_FLIGHT.labels(state=RUNNING).inc()
+        try:
+            self.store.update(job_id, status=RUNNING)
+            try:
+                result = fn(*args, progress=progress, **kwargs)
+            except Exception as e:
+                self.store.update(job_id, status=FAILED, stage=FAILED, error=str(e))
+                return
+            self.store.update(job_id, status=SUCCEEDED)
+            return result
+        finally:
+            JOBS_IN_FLIGHT.labels(state=RUNNING).dec()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_job_queue():
+    """Returns the process-wide job queue, creating it on first use.
+
+    Returns:
+        JobQueue: The shared queue.
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(create_job_store())
+        return _queue
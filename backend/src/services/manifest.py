@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from src.services.caption_cache import hash_image
+
+# Name of the manifest file inside a job workspace
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+
+# Preparation stages recorded in the manifest
+CAPTIONED = "captioned"
+ZIPPED = "zipped"
+
+def checkpoint_key(zip_path, **params):
+    """Fingerprints a dataset preparation run.
+
+    Runs on the same archive content with the same parameters get the same
+    key, so a retry finds the workspace of the failed attempt.
+
+    Args:
+        zip_path (str): Path to the uploaded ZIP file.
+        **params: Everything else that influences the prepared dataset,
+            e.g. token, type, infos and resolution.
+
+    Returns:
+        str: The key, safe to use in a file name.
+    """
+    fingerprint = json.dumps([hash_image(zip_path), params], sort_keys=True)
+    return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:32]
+
+class PrepManifest:
+    """Per-image progress of a dataset preparation, stored in its workspace.
+
+    Every caption is recorded under the content hash of the image as soon
+    as it is generated, so a retry after a failure only requests captions
+    for the images that were not captioned yet. The manifest is rewritten
+    atomically after every change and can be passed as the checkpoint of
+    xai_integration.generate_descriptions.
+    """
+
+    def __init__(self, workspace, params=None):
+        """
+        Args:
+            workspace (str): Path of the job workspace.
+            params (dict, optional): Parameters of the run. A manifest
+                recorded with different parameters is discarded.
+        """
+        self.path = os.path.join(workspace, MANIFEST_FILE)
+        self.resumed = 0
+        self._lock = threading.Lock()
+        self._data = self._load(params)
+
+    def _load(self, params):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+
+        # Round-trip the parameters so tuples and lists compare equal
+        params = json.loads(json.dumps(params))
+        if (not isinstance(data, dict)
+                or data.get("version") != MANIFEST_VERSION
+                or data.get("params") != params):
+            data = {
+                "version": MANIFEST_VERSION,
+                "params": params,
+                "stage": None,
+                "images": {},
+            }
+        return data
+
+    def _save(self):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._data, f)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @property
+    def stage(self):
+        with self._lock:
+            return self._data["stage"]
+
+    def set_stage(self, stage):
+        """Records the last completed preparation stage.
+
+        Args:
+            stage (str): CAPTIONED or ZIPPED.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._data["stage"] = stage
+            self._save()
+
+    def get_caption(self, image_hash):
+        """Returns the recorded caption of an image.
+
+        Args:
+            image_hash (str): Content hash of the image (see hash_image).
+
+        Returns:
+            str: The caption, or None if the image was not captioned yet.
+        """
+        with self._lock:
+            entry = self._data["images"].get(image_hash)
+            if entry is None or not entry["captioned"]:
+                return None
+            self.resumed += 1
+            return entry["caption"]
+
+    def set_caption(self, image_hash, caption):
+        """Records the caption of an image.
+
+        Args:
+            image_hash (str): Content hash of the image.
+            caption (str): The generated caption.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._data["images"][image_hash] = {
+                "captioned": True,
+                "caption": caption,
+                "updated": time.time(),
+            }
+            self._save()
+
+    @property
+    def quality(self):
+        """The caption validation statistics, or None if not validated."""
+        with self._lock:
+            return self._data.get("quality")
+
+    def set_quality(self, stats):
+        """Records the caption validation statistics of the dataset.
+
+        Args:
+            stats (dict): See caption_quality.validation_stats.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._data["quality"] = stats
+            self._save()
+
+    @property
+    def dataset(self):
+        """The dataset table of the training archive, or None if not built
+        yet (see file_processing.build_dataset_zip)."""
+        with self._lock:
+            return self._data.get("dataset")
+
+    def set_dataset(self, dataset):
+        """Records the dataset table of the training archive.
+
+        Args:
+            dataset (list): See file_processing.name_dataset.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._data["dataset"] = dataset
+            self._save()
+
+    def captioned(self):
+        """Returns the number of images captioned so far."""
+        with self._lock:
+            return sum(1 for entry in self._data["images"].values() if entry["captioned"])
@@ -0,0 +1,224 @@
+import time
+import threading
+from contextlib import contextmanager
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from src.config import METRICS_MULTIPROC_DIR
+
+# Buckets from fast file operations up to slow uploads, in seconds
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "flux_stage_duration_seconds",
+    "Duration of the dataset preparation and training submission stages.",
+    ["stage"],
+    buckets=DURATION_BUCKETS,
+)
+CAPTION_FIRST_TOKEN_SECONDS = Histogram(
+    "flux_caption_first_token_seconds",
+    "Time from sending a caption request to its first streamed token.",
+    buckets=DURATION_BUCKETS,
+)
+CAPTION_SECONDS = Histogram(
+    "flux_caption_duration_seconds",
+    "Total duration of a caption request.",
+    buckets=DURATION_BUCKETS,
+)
+EXTERNAL_REQUESTS = Counter(
+    "flux_external_requests_total",
+    "Requests to the X.AI and Replicate APIs, by outcome.",
+    ["api", "operation", "outcome"],
+)
+JOBS_IN_FLIGHT = Gauge(
+    "flux_jobs_in_flight",
+    "Background jobs currently queued or running.",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+RATE_LIMIT_WAIT_SECONDS = Histogram(
+    "flux_rate_limit_wait_seconds",
+    "Time requests waited for the rate limiter before being sent.",
+    ["api"],
+    buckets=DURATION_BUCKETS,
+)
+TRAININGS_TRACKED = Gauge(
+    "flux_trainings_tracked",
+    "Replicate trainings followed by the training monitor.",
+    multiprocess_mode="livesum",
+)
+
+# Durations recorded for --profile, by stage
+_profile = None
+_profile_lock = threading.Lock()
+
+def enable_profiling():
+    """Starts recording every stage duration in memory for profile_summary.
+
+    Returns:
+        None
+    """
+    global _profile
+    with _profile_lock:
+        _profile = {}
+
+def _record_profile(stage, seconds):
+    with _profile_lock:
+        if _profile is not None:
+            _profile.setdefault(stage, []).append(seconds)
+
+def _percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def profile_summary():
+    """Summarizes the durations recorded since enable_profiling.
+
+    Returns:
+        dict: Per stage, the number of calls ("count") and the total, mean,
+            median ("p50"), 95th percentile ("p95") and maximum durations in
+            seconds.
+    """
+    with _profile_lock:
+        profile = dict(_profile or {})
+
+    summary = {}
+    for stage, durations in profile.items():
+        durations = sorted(durations)
+        summary[stage] = {
+            "count": len(durations),
+            "total": sum(durations),
+            "mean": sum(durations) / len(durations),
+            "p50": _percentile(durations, 0.5),
+            "p95": _percentile(durations, 0.95),
+            "max": durations[-1],
+        }
+    return summary
+
+def observe_stage(stage, seconds):
+    """Records the duration of a stage.
+
+    Args:
+        stage (str): The stage name, e.g. "unzip" or "submit".
+        seconds (float): The duration in seconds.
+
+    Returns:
+        None
+    """
+    STAGE_SECONDS.labels(stage=stage).observe(seconds)
+    _record_profile(stage, seconds)
+
+@contextmanager
+def timed(stage):
+    """Times the enclosed block as a stage, whether it succeeds or not.
+
+    Args:
+        stage (str): The stage name.
+
+    Yields:
+        None
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+def observe_caption(first_token_seconds, total_seconds):
+    """Records the latencies of one caption request.
+
+    Args:
+        first_token_seconds (float): Time to the first streamed token, or
+            None if no token was received.
+        total_seconds (float): Total duration of the request.
+
+    Returns:
+        None
+    """
+    if first_token_seconds is not None:
+        CAPTION_FIRST_TOKEN_SECONDS.observe(first_token_seconds)
+        _record_profile("caption_first_token", first_token_seconds)
+    CAPTION_SECONDS.observe(total_seconds)
+    _record_profile("caption_request", total_seconds)
+
+def observe_rate_limit_wait(api, seconds):
+    """Records the time a request waited for the rate limiter.
+
+    Args:
+        api (str): "xai" or "replicate".
+        seconds (float): The wait in seconds, 0 if none.
+
+    Returns:
+        None
+    """
+    RATE_LIMIT_WAIT_SECONDS.labels(api=api).observe(seconds)
+    if seconds > 0:
+        _record_profile(f"rate_limit_wait_{api}", seconds)
+
+def _error_outcome(error):
+    # The openai SDK exposes status_code, httpx responses status_code too
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        response = getattr(error, "response", None)
+        status_code = getattr(response, "status_code", None)
+    if status_code == 429:
+        return "rate_limited"
+    if status_code is not None and status_code >= 500:
+        return "server_error"
+    if status_code is not None:
+        return "client_error"
+    return "error"
+
+def record_request(api, operation, error=None):
+    """Counts a request to an external API.
+
+    Args:
+        api (str): "xai" or "replicate".
+        operation (str): The API operation, e.g. "caption" or
+            "create_training".
+        error (Exception, optional): The error the request failed with.
+
+    Returns:
+        None
+    """
+    outcome = "success" if error is None else _error_outcome(error)
+    EXTERNAL_REQUESTS.labels(api=api, operation=operation, outcome=outcome).inc()
+
+@contextmanager
+def external_request(api, operation):
+    """Counts the enclosed request to an external API, failed or not.
+
+    Args:
+        api (str): "xai" or "replicate".
+        operation (str): The API operation.
+
+    Yields:
+        None
+    """
+    try:
+        yield
+    except Exception as e:
+        record_request(api, operation, e)
+        raise
+    record_request(api, operation)
+
+def render_metrics():
+    """Renders the metrics in the Prometheus text format.
+
+    When PROMETHEUS_MULTIPROC_DIR is set, as under gunicorn, the metrics of
+    all worker processes are aggregated.
+
+    Returns:
+        tuple: The response body and its content type.
+    """
+    registry = REGISTRY
+    if METRICS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,166 @@
+import os
+import threading
+from functools import partial
+from werkzeug.utils import secure_filename
+import src.services.file_processing as fp
+from src.services.replicate_integration import train_LoRa_with_api
+from src.services.xai_integration import generate_descriptions, get_caption_executor
+from src.services.workspace import resumable_workspace
+from src.services.manifest import PrepManifest, checkpoint_key, ZIPPED
+from src.services.preprocessing import parse_max_resolution, preprocess_images
+from src.services.dataset_export import export_dataset
+from src.config import SUBMIT_CONCURRENCY, EXPORT_FOLDER
+
+# Bounds the training submissions (model creation and dataset upload) in
+# flight, however many jobs are preparing datasets
+_submit_slots = threading.BoundedSemaphore(SUBMIT_CONCURRENCY)
+
+def _ignore_progress(**fields):
+    pass
+
+def build_dataset_with_checkpoint(zip_path, workspace, token, manifest,
+                                  describe=None, preprocess=None,
+                                  on_members=None):
+    """Builds the training archive in a workspace, resuming earlier attempts.
+
+    Captions are recorded in the manifest as they are generated, and so is 
+    the dataset table of the archive once written. An archive completed by 
+    an earlier attempt is reused as is.
+
+    Args:
+        zip_path (str): Path to the uploaded ZIP file containing the images.
+        workspace (str): Path of the (resumable) workspace.
+        token (str): Token of the model.
+        manifest (PrepManifest): The manifest of the workspace.
+        describe (callable, optional): Partial of generate_descriptions; the
+            manifest is passed to it as checkpoint.
+        preprocess (callable, optional): See file_processing.build_dataset_zip.
+        on_members (callable, optional): See file_processing.build_dataset_zip.
+
+    Returns:
+        tuple: Path of the training archive and number of images in it.
+    """
+    output_zip = os.path.join(workspace, f"{secure_filename(token)}.zip")
+    if (manifest.stage == ZIPPED and manifest.dataset is not None
+            and os.path.exists(output_zip)):
+        return output_zip, len(manifest.dataset)
+
+    if describe is not None:
+        describe = partial(describe, checkpoint=manifest)
+    count = fp.build_dataset_zip(
+        zip_path, output_zip, token, describe,
+        on_members=on_members, preprocess=preprocess,
+        on_dataset=manifest.set_dataset,
+        spool_dir=os.path.join(workspace, "caption_images"),
+    )
+    manifest.set_stage(ZIPPED)
+    return output_zip, count
+
+def run_training_pipeline(req_data, progress=None):
+    """Prepares the dataset of a training request and submits the training.
+
+    Runs every stage of a training submission inside a resumable workspace:
+    reading the uploaded archive, preprocessing the images, captioning them
+    (unless Replicate's auto-captioning is enabled), writing the training
+    archive and uploading it to Replicate. Once submitted, the training monitor keeps reporting
+    the status of the training through progress. When a previous attempt
+    with the same upload and settings failed, captions it generated are
+    reused rather than requested again.
+
+    Args:
+        req_data (TrainingRequest): The validated training request.
+        progress (callable, optional): Called with keyword arguments
+            describing each stage as it is reached, e.g.
+            progress(stage="captioning", captioned=3, total=20).
+
+    Returns:
+        dict: The training information returned by train_LoRa_with_api.
+    """
+    progress = progress or _ignore_progress
+    token = req_data.modelInfo.name
+
+    # generate descriptions for each image if autoCaptioning is off
+    describe = None
+    if not req_data.settings.autoCaptioning:
+        describe = partial(
+            generate_descriptions,
+            token=token,
+            type=req_data.modelInfo.type,
+            infos=req_data.modelInfo.characteristics,
+            API_KEY=req_data.settings.xaiApiKey,
+            use_cache=req_data.settings.useCaptionCache,
+            # Every job shares the same captioning budget
+            executor=get_caption_executor(),
+            progress=lambda done, total: progress(
+                stage="captioning", captioned=done, total=total
+            ),
+            validate=req_data.settings.validateCaptions,
+            on_validated=lambda stats: progress(
+                stage="validated", captionQuality=stats
+            ),
+        )
+
+    # resize, re-encode and dedupe the images before captioning and upload
+    preprocess = None
+    if req_data.settings.preprocessImages:
+        preprocess = partial(
+            preprocess_images,
+            max_side=parse_max_resolution(req_data.settings.resolution),
+            on_skipped=lambda count: progress(skipped=count),
+        )
+
+    # The workspace is keyed by the upload and everything shaping the
+    # dataset. It is removed once training is submitted, and kept when the
+    # job fails, so retrying the same request resumes where it stopped
+    params = {
+        "token": token,
+        "type": req_data.modelInfo.type,
+        "infos": req_data.modelInfo.characteristics,
+        "autoCaptioning": req_data.settings.autoCaptioning,
+        "preprocessImages": req_data.settings.preprocessImages,
+        "resolution": req_data.settings.resolution,
+    }
+    key = checkpoint_key(req_data.imageLocation, **params)
+    with resumable_workspace(key, prefix=secure_filename(token)) as workspace:
+        manifest = PrepManifest(workspace, params)
+        if manifest.captioned():
+            progress(stage="resuming", captioned=manifest.captioned())
+
+        # prepare the data, streaming it from the uploaded archive
+        output_zip, _ = build_dataset_with_checkpoint(
+            req_data.imageLocation, workspace, token, manifest, describe,
+            preprocess=preprocess,
+            on_members=lambda total: progress(stage="unzipped", total=total),
+        )
+        progress(stage="zipped")
+
+        # Keep the prepared dataset for reuse, next to earlier versions
+        if req_data.settings.exportDataset:
+            export_dir = os.path.join(EXPORT_FOLDER, secure_filename(token))
+            export_dataset(
+                output_zip, export_dir, req_data.settings.resolution,
+                dataset=manifest.dataset,
+            )
+            progress(stage="exported", exportPath=export_dir)
+
+        # Start training process
+        with _submit_slots:
+            progress(stage="uploading")
+            train_info = train_LoRa_with_api(
+                output_zip, req_data.settings, token,
+                on_update=lambda event: progress(
+                    trainingStatus=event["status"], trainingError=event["error"]
+                ),
+            )
+
+    progress(
+        stage="submitted",
+        trainingId=train_info["id"],
+        trainer=train_info["trainer"],
+        trainerAccount=train_info["trainerAccount"],
+        trainingStatus=train_info["status"],
+        modelUrl=train_info["modelUrl"],
+        trainingUrl=train_info["trainingUrl"],
+        reused=train_info["reused"],
+    )
+    return train_info
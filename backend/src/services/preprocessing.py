@@ -0,0 +1,277 @@
+import io
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from src.config import (
+    PREPROCESS_QUALITY,
+    PREPROCESS_WORKERS,
+    CAPTION_IMAGE_SIZE,
+    DEDUPE_THRESHOLD,
+)
+
+def parse_max_resolution(resolution):
+    """Returns the largest bucket of a trainer resolution setting.
+
+    Args:
+        resolution (str): Comma separated buckets, e.g. "512,768,1024".
+
+    Returns:
+        int: The largest bucket, e.g. 1024.
+    """
+    return max(int(bucket) for bucket in str(resolution).split(",") if bucket.strip())
+
+def _encode_jpeg(image, max_side, quality):
+    from PIL import Image
+
+    image = image.copy()
+    # Only ever downscale; thumbnail keeps the aspect ratio
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue(), image.size
+
+def difference_hash(image, hash_size=8):
+    """Computes the perceptual difference hash (dHash) of an image.
+
+    Visually similar images, e.g. the same photo re-encoded or resized, get
+    hashes with a small Hamming distance.
+
+    Args:
+        image (PIL.Image.Image): The image.
+        hash_size (int): Width and height of the hash grid.
+
+    Returns:
+        int: The hash, as a hash_size * hash_size bit integer.
+    """
+    from PIL import Image
+
+    pixels = list(
+        image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS).getdata()
+    )
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+def preprocess_image(data, max_side, quality=PREPROCESS_QUALITY,
+                     caption_side=CAPTION_IMAGE_SIZE):
+    """Normalizes one image for training and captioning.
+
+    Applies the EXIF orientation, converts to RGB, downscales so the
+    longest side fits max_side and re-encodes as JPEG. A smaller derivative
+    is produced for captioning, since the vision API doesn't need the full
+    training resolution.
+
+    Args:
+        data (bytes): The original image bytes.
+        max_side (int): Maximum width or height of the training image.
+        quality (int): JPEG quality of the re-encoded images.
+        caption_side (int): Maximum width or height of the caption image.
+
+    Returns:
+        dict: The training image ("image"), the caption image
+            ("caption_image"), the hash of the original bytes ("sha256"),
+            the perceptual hash ("dhash") and the training image size
+            ("width", "height").
+    """
+    # Pillow is only needed by the workers, not at import time
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original).convert("RGB")
+
+    training_image, (width, height) = _encode_jpeg(image, max_side, quality)
+    caption_image, _ = _encode_jpeg(image, min(caption_side, max_side), quality)
+
+    return {
+        "image": training_image,
+        "caption_image": caption_image,
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "dhash": difference_hash(image),
+        "width": width,
+        "height": height,
+    }
+
+def downscale_image(data, max_side, quality=PREPROCESS_QUALITY):
+    """Downscales an image so its longest side fits max_side.
+
+    Images that already fit are returned as they are, without re-encoding.
+
+    Args:
+        data (bytes): The image bytes.
+        max_side (int): Maximum width or height.
+        quality (int): JPEG quality of a re-encoded image.
+
+    Returns:
+        tuple: The image bytes and its (width, height).
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as original:
+        if max(original.size) <= max_side:
+            return data, original.size
+        image = ImageOps.exif_transpose(original).convert("RGB")
+    return _encode_jpeg(image, max_side, quality)
+
+class DuplicateFilter:
+    """Tells exact and near-duplicate images apart as they come.
+
+    The first occurrence of an image is kept; later images with the same
+    content hash, or a perceptual hash within threshold bits of a kept
+    image, are duplicates. Only the hashes of the kept images are
+    remembered, not the images.
+    """
+
+    def __init__(self, threshold=DEDUPE_THRESHOLD):
+        """
+        Args:
+            threshold (int): Maximum Hamming distance between the perceptual
+                hashes of near-duplicates. A negative value disables
+                near-duplicate detection.
+        """
+        self.threshold = threshold
+        self._hashes = set()
+        self._dhashes = []
+
+    def is_duplicate(self, record):
+        """Checks a record against the images kept so far, keeping it if it
+        is not a duplicate.
+
+        Args:
+            record (dict): A result of preprocess_image.
+
+        Returns:
+            bool: True if the image is a duplicate.
+        """
+        if record["sha256"] in self._hashes:
+            return True
+        if any(bin(record["dhash"] ^ dhash).count("1") <= self.threshold
+               for dhash in self._dhashes):
+            return True
+        self._hashes.add(record["sha256"])
+        self._dhashes.append(record["dhash"])
+        return False
+
+def find_duplicates(records, threshold=DEDUPE_THRESHOLD):
+    """Finds exact and near-duplicate images (see DuplicateFilter).
+
+    Args:
+        records (list): Results of preprocess_image.
+        threshold (int): See DuplicateFilter.
+
+    Returns:
+        set: Indexes of the duplicate records.
+    """
+    duplicates = DuplicateFilter(threshold)
+    return {i for i, record in enumerate(records) if duplicates.is_duplicate(record)}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_preprocess_pool():
+    """Returns the process pool shared by preprocessing calls.
+
+    Workers are spawned rather than forked, which is safe from the
+    multi-threaded backend.
+
+    Returns:
+        ProcessPoolExecutor: The shared pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=PREPROCESS_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+def close_preprocess_pool():
+    """Shuts down the shared process pool, if it was started.
+
+    Processes started by multiprocessing must call this before exiting,
+    since they join their children before the pool's own exit hook runs.
+
+    Returns:
+        None
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+def preprocess_images(images, max_side, quality=PREPROCESS_QUALITY,
+                      caption_side=CAPTION_IMAGE_SIZE,
+                      threshold=DEDUPE_THRESHOLD, executor=None,
+                      on_skipped=None):
+    """Preprocesses a batch of images across CPU cores and drops duplicates.
+
+    Images are loaded in the calling process and sent to the pool a few at
+    a time, and their records are yielded as soon as they are done, in
+    input order. Only a bounded number of images is in memory at once, as
+    long as the caller doesn't keep the records. Images Pillow can't decode
+    (corrupt, truncated or too large) are left out instead of failing the
+    batch.
+
+    Args:
+        images (list): Callables without arguments returning the original
+            image bytes (e.g. reading a member of a ZIP archive).
+        max_side (int): Maximum width or height of the training images.
+        quality (int): JPEG quality of the re-encoded images.
+        caption_side (int): Maximum width or height of the caption images.
+        threshold (int): Near-duplicate threshold (see DuplicateFilter).
+        executor (Executor, optional): Executor to run on. Defaults to the
+            shared process pool.
+        on_skipped (callable, optional): Called with the number of images
+            left out because they could not be decoded, if any, once every
+            image is processed.
+
+    Yields:
+        dict: The preprocess_image result of each unique image, with the
+            index of its source image ("index").
+    """
+    from PIL import Image
+
+    executor = executor or get_preprocess_pool()
+    window = PREPROCESS_WORKERS * 2
+    duplicates = DuplicateFilter(threshold)
+    skipped = 0
+    pending = {}
+
+    def collect(i):
+        nonlocal skipped
+        try:
+            record = pending.pop(i).result()
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            print(f"Skipping image {i} that could not be decoded: {e}")
+            skipped += 1
+            return None
+        if duplicates.is_duplicate(record):
+            return None
+        return dict(record, index=i)
+
+    try:
+        for i, load in enumerate(images):
+            pending[i] = executor.submit(
+                preprocess_image, load(), max_side, quality, caption_side
+            )
+            if len(pending) >= window:
+                record = collect(min(pending))
+                if record is not None:
+                    yield record
+        for i in sorted(pending):
+            record = collect(i)
+            if record is not None:
+                yield record
+    finally:
+        # Stop the images still queued when the caller gives up
+        for future in pending.values():
+            future.cancel()
+
+    if on_skipped is not None and skipped:
+        on_skipped(skipped)
@@ -0,0 +1,294 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import closing
+from email.utils import parsedate_to_datetime
+from src.config import (
+    RATE_LIMIT_BACKEND,
+    RATE_LIMIT_DB_PATH,
+    RATE_LIMIT_MAX_RETRIES,
+    XAI_REQUESTS_PER_MINUTE,
+    XAI_TOKENS_PER_MINUTE,
+    REPLICATE_REQUESTS_PER_MINUTE,
+)
+from src.services.metrics import observe_rate_limit_wait
+
+# Per-minute limits of each API; a limit of 0 is not enforced
+RATE_LIMITS = {
+    "xai": {
+        "requests": XAI_REQUESTS_PER_MINUTE,
+        "tokens": XAI_TOKENS_PER_MINUTE,
+    },
+    "replicate": {
+        "requests": REPLICATE_REQUESTS_PER_MINUTE,
+    },
+}
+
+def is_rate_limited(status_code, retry_after):
+    """Checks whether a response turned the request away for load.
+
+    Args:
+        status_code (int): The HTTP status code.
+        retry_after (float): The Retry-After delay, None if absent.
+
+    Returns:
+        bool: True for a 429, or a 503 asking to retry later. The request
+            was then not processed, so sending it again is safe.
+    """
+    return status_code == 429 or (status_code == 503 and retry_after is not None)
+
+def _reserve(tat, now, amount, rate, burst):
+    # Generic cell rate algorithm: tat is the time at which the bucket is
+    # full again. Reserving moves it forward by the cost of the call; the
+    # call may proceed once it is no more than a full bucket ahead of now
+    interval = 1.0 / rate
+    tat = max(tat or now, now) + amount * interval
+    return tat, max(0.0, tat - burst * interval - now)
+
+def _block(tat, now, retry_after, rate, burst):
+    # Empty the bucket at the end of the block, so that the calls queued
+    # behind it resume at the allowed rate instead of all at once
+    return max(tat or now, now + retry_after + burst / rate)
+
+class MemoryRateLimitBackend:
+    """Keeps the rate limit buckets in memory, for a single process."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, key, amount, rate, burst):
+        with self._lock:
+            tat, delay = _reserve(
+                self._buckets.get(key), time.time(), amount, rate, burst
+            )
+            self._buckets[key] = tat
+            return delay
+
+    def block(self, key, retry_after, rate, burst):
+        with self._lock:
+            self._buckets[key] = _block(
+                self._buckets.get(key), time.time(), retry_after, rate, burst
+            )
+
+class SQLiteRateLimitBackend:
+    """Keeps the rate limit buckets in a SQLite database, so every worker
+    process of the backend draws from the same budget."""
+
+    def __init__(self, db_path=RATE_LIMIT_DB_PATH):
+        self.db_path = db_path
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tat REAL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _update(self, key, compute):
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT tat FROM buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tat, result = compute(row[0] if row else None, time.time())
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tat) VALUES (?, ?)",
+                (key, tat),
+            )
+            conn.execute("COMMIT")
+            return result
+
+    def reserve(self, key, amount, rate, burst):
+        return self._update(
+            key, lambda tat, now: _reserve(tat, now, amount, rate, burst)
+        )
+
+    def block(self, key, retry_after, rate, burst):
+        self._update(
+            key, lambda tat, now: (_block(tat, now, retry_after, rate, burst), None)
+        )
+
+def create_rate_limit_backend(kind=RATE_LIMIT_BACKEND):
+    """Creates the rate limit backend selected by configuration.
+
+    Args:
+        kind (str): "memory" for a limit per process, or "sqlite" for a
+            limit shared by every process using RATE_LIMIT_DB_PATH, such as
+            the gunicorn workers.
+
+    Returns:
+        MemoryRateLimitBackend | SQLiteRateLimitBackend: The backend.
+    """
+    if kind == "memory":
+        return MemoryRateLimitBackend()
+    if kind == "sqlite":
+        return SQLiteRateLimitBackend()
+    raise ValueError("Invalid rate limit backend. Choose 'memory' or 'sqlite'.")
+
+class RateLimiter:
+    """Paces the calls to an API under its per-minute limits, per API key.
+
+    Every limit (requests, tokens) is a token bucket holding one minute of
+    allowance. Calls reserve their cost up front and are scheduled in the
+    order they reserved, whichever job or process they come from, so no
+    caller is starved and the API sees a steady rate close to its limit.
+    A rate limited response blocks the key for every caller until its
+    Retry-After has passed.
+    """
+
+    def __init__(self, api, limits, backend):
+        """
+        Args:
+            api (str): Name of the API, e.g. "xai".
+            limits (dict): Per-minute limit by dimension, e.g.
+                {"requests": 60, "tokens": 100000}.
+            backend: Where the buckets are kept (see
+                create_rate_limit_backend).
+        """
+        self.api = api
+        self.limits = {name: limit for name, limit in limits.items() if limit > 0}
+        self.backend = backend
+
+    def _key(self, api_key, dimension):
+        # Keys are stored hashed, never in clear
+        digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+        return f"{self.api}:{digest}:{dimension}"
+
+    def acquire(self, api_key, **costs):
+        """Waits until a call can be made without exceeding the limits.
+
+        Args:
+            api_key (str): The API key the call is made with.
+            **costs: Cost of the call per dimension other than requests,
+                e.g. tokens=1500. Every call costs one request.
+
+        Returns:
+            float: Seconds waited.
+        """
+        costs = dict(costs, requests=1)
+        delay = 0.0
+        for dimension, limit in self.limits.items():
+            rate = limit / 60.0
+            delay = max(delay, self.backend.reserve(
+                self._key(api_key, dimension), costs.get(dimension, 0), rate, limit
+            ))
+        if delay > 0:
+            time.sleep(delay)
+        observe_rate_limit_wait(self.api, delay)
+        return delay
+
+    def block(self, api_key, retry_after):
+        """Holds back every call with an API key after a rate limited
+        response.
+
+        Args:
+            api_key (str): The API key that was rate limited.
+            retry_after (float): Seconds to wait before the next call.
+
+        Returns:
+            None
+        """
+        if not self.limits:
+            # Nothing is shared without limits; the caller waits itself
+            time.sleep(retry_after)
+            return
+        for dimension, limit in self.limits.items():
+            self.backend.block(
+                self._key(api_key, dimension), retry_after, limit / 60.0, limit
+            )
+
+_backend = None
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(api):
+    """Returns the process-wide rate limiter of an API, creating it on
+    first use.
+
+    Args:
+        api (str): "xai" or "replicate".
+
+    Returns:
+        RateLimiter: The shared limiter.
+    """
+    global _backend
+    with _limiters_lock:
+        limiter = _limiters.get(api)
+        if limiter is None:
+            if _backend is None:
+                _backend = create_rate_limit_backend()
+            limiter = RateLimiter(api, RATE_LIMITS[api], _backend)
+            _limiters[api] = limiter
+        return limiter
+
+def parse_retry_after(headers):
+    """Reads the delay requested by a Retry-After header.
+
+    Args:
+        headers (Mapping): The response headers.
+
+    Returns:
+        float: The delay in seconds, or None if the header is missing or
+            malformed.
+    """
+    value = (headers.get("retry-after") or "").strip()
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class RateLimitedTransport:
+    """httpx transport pacing the requests it sends under a rate limiter.
+
+    Rate limited responses (see is_rate_limited) block the API key for
+    every caller and the request is sent again once allowed, up to
+    max_retries times. These responses mean the request was not processed,
+    so retrying is safe even for model and training creations.
+    """
+
+    def __init__(self, transport, limiter, api_key, max_retries=RATE_LIMIT_MAX_RETRIES,
+                 backoff=1.0):
+        """
+        Args:
+            transport (httpx.BaseTransport): The transport sending the
+                requests.
+            limiter (RateLimiter): The limiter of the API.
+            api_key (str): The API key of the requests.
+            max_retries (int): Retries of a rate limited request.
+            backoff (float): Block in seconds when a response has no
+                Retry-After header, doubled on every retry.
+        """
+        self._transport = transport
+        self.limiter = limiter
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def handle_request(self, request):
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(self.api_key)
+            response = self._transport.handle_request(request)
+            retry_after = parse_retry_after(response.headers)
+            if (not is_rate_limited(response.status_code, retry_after)
+                    or attempt == self.max_retries):
+                return response
+            response.close()
+            self.limiter.block(
+                self.api_key,
+                retry_after if retry_after is not None else self.backoff * (2 ** attempt),
+            )
+
+    def close(self):
+        self._transport.close()
@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import zipfile
+import threading
+from contextlib import closing
+from src.config import REGISTRY_DB_PATH, REPLICATE_FILE_RETENTION
+
+# Bytes of a dataset member hashed at a time
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def dataset_fingerprint(zip_path):
+    """Fingerprints the content of a training archive.
+
+    Only the names and contents of the members are hashed, not the
+    timestamps and compression of the archive, so rebuilding the same
+    dataset gives the same fingerprint.
+
+    Args:
+        zip_path (str): Path to the training archive.
+
+    Returns:
+        str: Hex SHA-256 fingerprint.
+    """
+    digest = hashlib.sha256()
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        for info in sorted(zip_ref.infolist(), key=lambda info: info.filename):
+            if info.is_dir():
+                continue
+            member = hashlib.sha256()
+            with zip_ref.open(info) as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                    member.update(chunk)
+            digest.update(f"{info.filename}\0{member.hexdigest()}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def training_fingerprint(dataset, destination, version, training_input):
+    """Fingerprints a training: what is trained, on what, and how.
+
+    Args:
+        dataset (str): Fingerprint of the training archive (see
+            dataset_fingerprint).
+        destination (str): The destination model, as "owner/name".
+        version (str): The trainer version.
+        training_input (dict): The trainer inputs, without the images.
+
+    Returns:
+        str: Hex SHA-256 fingerprint.
+    """
+    fingerprint = json.dumps(
+        [dataset, destination, version, training_input], sort_keys=True
+    )
+    return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+
+class TrainingRegistry:
+    """Remembers the models, uploaded datasets and trainings created on
+    Replicate, in a SQLite database shared by every worker process.
+
+    It lets a submission reuse the model repository created by an earlier
+    one, send the URL of a dataset Replicate already stores instead of the
+    archive, and return the training of an identical earlier submission
+    rather than training again.
+    """
+
+    def __init__(self, db_path=REGISTRY_DB_PATH):
+        self.db_path = db_path
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS models (name TEXT PRIMARY KEY, created REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS datasets ("
+                "fingerprint TEXT PRIMARY KEY, url TEXT, created REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS trainings ("
+                "fingerprint TEXT PRIMARY KEY, dataset TEXT, model TEXT, "
+                "training_id TEXT, created REAL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def has_model(self, name):
+        """Checks whether a model repository was created before.
+
+        Args:
+            name (str): The model, as "owner/name".
+
+        Returns:
+            bool: True if the model is known.
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT 1 FROM models WHERE name = ?", (name,)
+            ).fetchone()
+        return row is not None
+
+    def record_model(self, name):
+        """Records an existing model repository.
+
+        Args:
+            name (str): The model, as "owner/name".
+
+        Returns:
+            None
+        """
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO models (name, created) VALUES (?, ?)",
+                (name, time.time()),
+            )
+
+    def get_dataset_url(self, dataset, max_age=None):
+        """Returns where Replicate stores a dataset uploaded before.
+
+        Args:
+            dataset (str): Fingerprint of the training archive.
+            max_age (float, optional): Age in seconds after which Replicate
+                has deleted the file. Defaults to REPLICATE_FILE_RETENTION.
+
+        Returns:
+            str: The URL, or None if the dataset is not known or expired.
+        """
+        max_age = REPLICATE_FILE_RETENTION if max_age is None else max_age
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT url FROM datasets WHERE fingerprint = ? AND created > ?",
+                (dataset, time.time() - max_age),
+            ).fetchone()
+        return row[0] if row else None
+
+    def record_dataset_url(self, dataset, url):
+        """Records where Replicate stores an uploaded dataset.
+
+        Args:
+            dataset (str): Fingerprint of the training archive.
+            url (str): The URL of the stored archive.
+
+        Returns:
+            None
+        """
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO datasets (fingerprint, url, created) "
+                "VALUES (?, ?, ?)",
+                (dataset, url, time.time()),
+            )
+
+    def forget_dataset_url(self, dataset):
+        """Forgets the URL of a dataset, e.g. once it expired.
+
+        Args:
+            dataset (str): Fingerprint of the training archive.
+
+        Returns:
+            None
+        """
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM datasets WHERE fingerprint = ?", (dataset,))
+
+    def forget_training_dataset(self, training_id):
+        """Forgets the URL of the dataset a training was submitted with, e.g.
+        once the training failed, so the next submission uploads it again.
+
+        Args:
+            training_id (str): The Replicate training id.
+
+        Returns:
+            None
+        """
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "DELETE FROM datasets WHERE fingerprint IN "
+                "(SELECT dataset FROM trainings WHERE training_id = ?)",
+                (training_id,),
+            )
+
+    def get_training(self, fingerprint):
+        """Returns the training submitted before with the same fingerprint.
+
+        Args:
+            fingerprint (str): See training_fingerprint.
+
+        Returns:
+            dict: The dataset fingerprint ("dataset"), model ("model"),
+                training id ("trainingId") and creation time ("created"),
+                or None if there is none.
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT dataset, model, training_id, created FROM trainings "
+                "WHERE fingerprint = ?",
+                (fingerprint,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "dataset": row[0],
+            "model": row[1],
+            "trainingId": row[2],
+            "created": row[3],
+        }
+
+    def record_training(self, fingerprint, dataset, model, training_id):
+        """Records a submitted training.
+
+        Args:
+            fingerprint (str): See training_fingerprint.
+            dataset (str): Fingerprint of the training archive.
+            model (str): The destination model, as "owner/name".
+            training_id (str): The Replicate training id.
+
+        Returns:
+            None
+        """
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO trainings "
+                "(fingerprint, dataset, model, training_id, created) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (fingerprint, dataset, model, training_id, time.time()),
+            )
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_training_registry():
+    """Returns the process-wide training registry, creating it on first use.
+
+    Returns:
+        TrainingRegistry: The shared registry.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = TrainingRegistry()
+        return _registry
@@ -1,19 +1,288 @@
-import replicate as rep
-import time
-import os
-# from src.config import REPLICATE_OWNER
-# from src.config import REPLICATE_API_KEY
+import hashlib
+from src.services.clients import get_replicate_client
+from src.services.training_monitor import get_training_monitor
+from src.services.trainers import (
+    AUTOCAPTION,
+    REUSE,
+    SQLiteSlots,
+    TrainerBackend,
+    configured_trainers,
+    get_trainer,
+    route_training,
+)
+from src.services.registry import (
+    dataset_fingerprint,
+    get_training_registry,
+    training_fingerprint,
+)
+from src.services.metrics import external_request, timed
+from src.config import (
+    REPLICATE_API_TOKEN,
+    REPLICATE_OWNER,
+    REPLICATE_TRAINING_CONCURRENCY,
+    REPLICATE_STARTUP_SECONDS,
+    REPLICATE_SECONDS_PER_STEP,
+    REPLICATE_COST_PER_SECOND,
+)
 
-def train_LoRa(zip_file_path, settings, token):
-    """Trains a LoRA model on Replicate using the specified image dataset.
+# Training statuses after which an identical submission trains again
+FAILED_STATUSES = {"failed", "canceled"}
 
-    Creates a private model repository on Replicate and initiates 
-    fine-tuning of a FLUX.1 model with the provided training images. 
+# Replicate trainer used for FLUX.1 LoRA fine-tuning
+TRAINER_VERSION = "ostris/flux-dev-lora-trainer:e440909d3512c31646ee2e0c7d6f6f4923224863a6a10c494606e79fb5844497"
+
+# Trainer inputs of the command line trainings
+DEFAULT_TRAINING_INPUT = {
+    "steps": 1000,
+    "lora_rank": 16,
+    "optimizer": "adamw8bit",
+    "batch_size": 1,
+    "resolution": "512,768,1024",
+    "autocaption": False,
+    "learning_rate": 0.0004,
+    "wandb_project": "flux_train_replicate",
+    "wandb_save_interval": 100,
+    "caption_dropout_rate": 0.05,
+    "cache_latents_to_disk": False,
+    "wandb_sample_interval": 100
+}
+
+# Trainer inputs set by the training request settings, by setting name
+TRAINING_INPUT_SETTINGS = {
+    "steps": "steps",
+    "loraRank": "lora_rank",
+    "optimizer": "optimizer",
+    "batchSize": "batch_size",
+    "resolution": "resolution",
+    "autoCaptioning": "autocaption",
+    "learningRate": "learning_rate",
+    "captionDropoutRate": "caption_dropout_rate",
+}
+
+def _find_existing_training(client, registry, fingerprint):
+    """Returns the model and training of an identical earlier submission,
+    unless that training failed or can't be found anymore."""
+    from replicate.exceptions import ReplicateError
+
+    entry = registry.get_training(fingerprint)
+    if entry is None:
+        return None
+    try:
+        with external_request("replicate", "get_training"):
+            training = client.trainings.get(entry["trainingId"])
+        with external_request("replicate", "get_model"):
+            model = client.models.get(entry["model"])
+    except ReplicateError:
+        return None
+    if training.status in FAILED_STATUSES:
+        return None
+    return model, training
+
+def _get_or_create_model(client, registry, owner, name, token):
+    """Returns the model repository, creating it unless it already exists."""
+    from replicate.exceptions import ReplicateError
+
+    key = f"{owner}/{name}"
+    if registry.has_model(key):
+        try:
+            with external_request("replicate", "get_model"):
+                return client.models.get(key)
+        except ReplicateError:
+            # Deleted since it was recorded; create it again
+            print(f"Recorded model {key} not found, creating it")
+
+    # All the models are private
+    try:
+        with timed("create_model"), external_request("replicate", "create_model"):
+            model = client.models.create(
+                owner=owner,
+                name=name,
+                visibility="private",  
+                hardware="gpu-t4",  # Replicate will override this for fine-tuned models
+                description=f"A fine-tuned FLUX.1 model for {token}"
+            )
+        print(f"Model created: {model.name}")
+    except ReplicateError as create_error:
+        # Creating fails when the model already exists, e.g. created by an
+        # earlier version of this tool or on the website
+        try:
+            with external_request("replicate", "get_model"):
+                model = client.models.get(key)
+        except ReplicateError:
+            raise create_error
+        print(f"Using existing model: {model.name}")
+
+    registry.record_model(key)
+    return model
+
+def _start_training(client, owner, token, zip_file_path, training_input,
+                    reuse=True):
+    """Creates the model repository and starts the training on Replicate.
+
+    Submissions are recorded in the training registry. The model repository 
+    is created only if it doesn't exist yet, a dataset Replicate already 
+    stores is passed by URL instead of being uploaded again, and when reuse 
+    is enabled, a submission identical to an earlier one (same dataset 
+    content, destination and trainer inputs) returns the earlier training 
+    unless it failed.
+
+    Args:
+        client (replicate.Client): The Replicate client to use.
+        owner (str): The Replicate user or organization owning the model.
+        token (str): The token of the model.
+        zip_file_path (str): Path to the zip file containing training images.
+        training_input (dict): The trainer inputs, without the images.
+        reuse (bool): Return the training of an identical earlier 
+            submission instead of training again.
+
+    Returns:
+        tuple: The model, the training, and whether the training was 
+            reused rather than created.
+    """
+    from replicate.exceptions import ReplicateError
+
+    registry = get_training_registry()
+    name = f"flux-{token}"
+    destination = f"{owner}/{name}"
+    dataset = dataset_fingerprint(zip_file_path)
+    fingerprint = training_fingerprint(
+        dataset, destination, TRAINER_VERSION, training_input
+    )
+
+    if reuse:
+        existing = _find_existing_training(client, registry, fingerprint)
+        if existing is not None:
+            model, training = existing
+            print(f"Reusing training: {training.status}")
+            print(f"Training URL: https://replicate.com/p/{training.id}")
+            return model, training, True
+
+    model = _get_or_create_model(client, registry, owner, name, token)
+    print(f"Model URL: https://replicate.com/{model.owner}/{model.name}")
+
+    def create_training(input_images):
+        return client.trainings.create(
+            destination=f"{model.owner}/{model.name}",
+            version=TRAINER_VERSION,
+            input={
+                **training_input,
+                "input_images": input_images,
+                "trigger_word": token,
+            },
+        )
+
+    # Now use this model as the destination for your training. The images
+    # are uploaded as part of the training creation request, unless
+    # Replicate already stores the same dataset
+    images_url = registry.get_dataset_url(dataset)
+    with timed("submit"), external_request("replicate", "create_training"):
+        training = None
+        if images_url is not None:
+            try:
+                training = create_training(images_url)
+            except ReplicateError:
+                # The stored file expired; upload the archive again
+                registry.forget_dataset_url(dataset)
+        if training is None:
+            with open(zip_file_path, "rb") as input_images:
+                training = create_training(input_images)
+
+    print(f"Training started: {training.status}")
+    print(f"Training URL: https://replicate.com/p/{training.id}")
+
+    stored_url = (training.input or {}).get("input_images")
+    if isinstance(stored_url, str) and stored_url.startswith("https://"):
+        registry.record_dataset_url(dataset, stored_url)
+    registry.record_training(fingerprint, dataset, destination, training.id)
+
+    return model, training, False
+
+class ReplicateTrainer(TrainerBackend):
+    """Trains on Replicate with the FLUX LoRA trainer (TRAINER_VERSION), 
+    under one account."""
+
+    name = "replicate"
+    capabilities = frozenset({AUTOCAPTION, REUSE})
+    max_concurrency = REPLICATE_TRAINING_CONCURRENCY
+    startup_seconds = REPLICATE_STARTUP_SECONDS
+    seconds_per_step = REPLICATE_SECONDS_PER_STEP
+    cost_per_second = REPLICATE_COST_PER_SECOND
+
+    def __init__(self, api_token=None):
+        """
+        Args:
+            api_token (str, optional): The Replicate API token. Defaults to 
+                REPLICATE_API_TOKEN.
+        """
+        # Every worker process counts the trainings of the account in the
+        # same place, keyed by a hash rather than the token itself
+        account = hashlib.sha256((api_token or REPLICATE_API_TOKEN or "").encode("utf-8"))
+        self.account = f"replicate:{account.hexdigest()[:16]}"
+        super().__init__(SQLiteSlots(self.account))
+        self.api_token = api_token
+
+    def _submit(self, zip_path, token, owner, training_input, reuse):
+        model, training, reused = _start_training(
+            get_replicate_client(self.api_token),
+            owner or REPLICATE_OWNER,
+            token,
+            zip_path,
+            training_input,
+            reuse=reuse,
+        )
+        return {
+            "id": training.id,
+            "status": training.status,
+            "modelUrl": f"https://replicate.com/{model.owner}/{model.name}",
+            "trainingUrl": f"https://replicate.com/p/{training.id}",
+            "reused": reused,
+        }
+
+    def _get_status(self, training_id):
+        with external_request("replicate", "get_training"):
+            training = get_replicate_client(self.api_token).trainings.get(training_id)
+        if training.status == "failed":
+            # The stored dataset may be why it failed; upload it next time
+            get_training_registry().forget_training_dataset(training_id)
+        return {"status": training.status, "error": training.error}
+
+def build_training_input(settings):
+    """Builds the trainer inputs of a training request.
+
+    Args:
+        settings (TrainingSettings): The settings of the request.
+
+    Returns:
+        dict: The trainer inputs, without the images.
+    """
+    return dict(DEFAULT_TRAINING_INPUT, **{
+        name: getattr(settings, setting)
+        for setting, name in TRAINING_INPUT_SETTINGS.items()
+    })
+
+def train_LoRa(zip_file_path, token, owner=None, api_token=None, reuse=True,
+               trainer=None):
+    """Trains a LoRA model using the specified image dataset.
+
+    Submits the fine-tuning of a FLUX.1 model with the provided training 
+    images, by default on Replicate in a private model repository, then 
+    follows the training through the training monitor until it ends. 
 
     Args:
         zip_file_path (str): Path to the zip file containing training images.
-        settings (str): The settings for the training of the model.
         token (str): The token of the model.
+        owner (str, optional): The Replicate owner of the model. Defaults to 
+            REPLICATE_OWNER.
+        api_token (str, optional): The Replicate API token. Defaults to 
+            REPLICATE_API_TOKEN.
+        reuse (bool): Follow the training of an identical earlier 
+            submission instead of training again.
+        trainer (str, optional): Name of the trainer backend (see 
+            trainers.get_trainer). Defaults to "replicate".
+    Returns:
+        dict: The training (see TrainerBackend.submit), with the name 
+            ("trainer") and account key ("trainerAccount") of its backend.
+
     Prints:
         Model creation URL, training status updates, and final model URL.
 
@@ -21,68 +290,45 @@ def train_LoRa(zip_file_path, settings, token):
         Requires Replicate credentials to be configured.
         Uses a specific Replicate training version for FLUX.1 models.
     """
-
-    # Create the model repository on Replicate. All the models are private
-    model = rep.models.create(
-        owner=REPLICATE_OWNER,
-        name=f"flux-{token}",
-        visibility="private",  
-        hardware="gpu-t4",  # Replicate will override this for fine-tuned models
-        description=f"A fine-tuned FLUX.1 model for {token}"
+    backend = get_trainer(trainer or "replicate", api_token)
+    training = backend.submit(
+        zip_file_path, token, owner, DEFAULT_TRAINING_INPUT, reuse=reuse
     )
- 
-    print(f"Model created: {model.name}")
-    print(f"Model URL: https://replicate.com/{model.owner}/{model.name}")
 
-    # Now use this model as the destination for your training
-    training = rep.trainings.create(
-        destination=f"{model.owner}/{model.name}",
-        version="ostris/flux-dev-lora-trainer:e440909d3512c31646ee2e0c7d6f6f4923224863a6a10c494606e79fb5844497",
-        input={
-
-            "steps": 1000,
-            "lora_rank": 16,
-            "optimizer": "adamw8bit",
-            "batch_size": 1,
-            "resolution": "512,768,1024",
-            "autocaption": False,
-            "input_images": open(zip_file_path, "rb"),
-            "trigger_word": token,
-            "learning_rate": 0.0004,
-            "wandb_project": "flux_train_replicate",
-            "wandb_save_interval": 100,
-            "caption_dropout_rate": 0.05,
-            "cache_latents_to_disk": False,
-            "wandb_sample_interval": 100
-        },
-    )
- 
-    print(f"Training started: {training.status}")
-    print(f"Training URL: https://replicate.com/p/{training.id}")
+    monitor = get_training_monitor()
+    monitor.track(training["id"], backend, status=training["status"])
+    # A reused training may have ended already
+    event = monitor.wait(
+        training["id"],
+        on_event=lambda event: print(f"Training status: {event['status']}"),
+    ) or {"status": training["status"]}
 
-    status = "starting"
-    while status not in ["succeeded", "failed", "canceled"]:
-        time.sleep(30)  # Check every 30 seconds
-        training.reload()
-        print(f"Training status: {training.status}")
-
-    if training.status == "succeeded":
+    if event and event["status"] == "succeeded":
         print("Training completed successfully!")
-        print(
-            f"Model URL: https://replicate.com/{REPLICATE_OWNER}/flux-{settings.token}"
-        )
+        print(f"Model URL: {training['modelUrl']}")
     
-def train_LoRa_with_api(zip_file_path, settings, token):
-    """Trains a LoRA model on Replicate using the specified image dataset.
+def train_LoRa_with_api(zip_file_path, settings, token, on_update=None):
+    """Trains a LoRA model using the specified image dataset.
 
-    Creates a private model repository on Replicate and initiates 
-    fine-tuning of a FLUX.1 model with the provided training images.
+    Submits the fine-tuning of a FLUX.1 model with the provided training 
+    images to the trainer backend named in settings.trainerBackend, or else 
+    to the backend of TRAINER_BACKENDS expected to end it first (see 
+    trainers.route_training).
     This is the version that will be used on the API call from the frontend.
+    The training is then followed in the background by the training monitor.
+    Unless settings.reuseTrainings is off, an identical earlier submission 
+    is returned instead of training again.
 
     Args:
         zip_file_path (str): Path to the zip file containing training images.
         settings (str): The settings for the training of the model.
         token (str): The token of the model.
+        on_update (callable, optional): Called with an event dict on every 
+            status change of the training (see TrainingMonitor.track).
+    Returns:
+        dict: The training (see TrainerBackend.submit), with the name 
+            ("trainer") and account key ("trainerAccount") of its backend.
+
     Prints:
         Model creation URL, training status updates, and final model URL.
 
@@ -90,53 +336,29 @@ def train_LoRa_with_api(zip_file_path, settings, token):
         Requires Replicate credentials to be configured.
         Uses a specific Replicate training version for FLUX.1 models.
     """
-    # Set the API token for this session
-    os.environ["REPLICATE_API_TOKEN"] = settings.replicateApiKey
-
-    # Create the model repository on Replicate. All the models are private
-    model = rep.models.create(
-        owner=settings.replicateUsername,
-        name=f"flux-{token}",
-        visibility="private",  
-        hardware="gpu-t4",  # Replicate will override this for fine-tuned models
-        description=f"A fine-tuned FLUX.1 model for {token}"
-    )
- 
-    print(f"Model created: {model.name}")
-    print(f"Model URL: https://replicate.com/{model.owner}/{model.name}")
+    # Use backends bound to this user's API token
+    if settings.trainerBackend:
+        trainer = get_trainer(settings.trainerBackend, settings.replicateApiKey)
+    else:
+        trainer = route_training(
+            configured_trainers(settings.replicateApiKey),
+            settings.steps,
+            required={AUTOCAPTION} if settings.autoCaptioning else (),
+        )
 
-    # Now use this model as the destination for your training
-    training = rep.trainings.create(
-        destination=f"{model.owner}/{model.name}",
-        version="ostris/flux-dev-lora-trainer:e440909d3512c31646ee2e0c7d6f6f4923224863a6a10c494606e79fb5844497",
-        input={
-
-            "steps": settings.steps,
-            "lora_rank": settings.loraRank,
-            "optimizer": settings.optimizer,
-            "batch_size": settings.batchSize,
-            "resolution": settings.resolution,
-            "autocaption": settings.autoCaptioning,
-            "input_images": open(zip_file_path, "rb"),
-            "trigger_word": token,
-            "learning_rate": settings.learningRate,
-            "wandb_project": "flux_train_replicate",
-            "wandb_save_interval": 100,
-            "caption_dropout_rate": settings.captionDropoutRate,
-            "cache_latents_to_disk": False,
-            "wandb_sample_interval": 100
-        },
+    training = trainer.submit(
+        zip_file_path,
+        token,
+        settings.replicateUsername,
+        build_training_input(settings),
+        reuse=settings.reuseTrainings,
     )
- 
-    print(f"Training started: {training.status}")
-    print(f"Training URL: https://replicate.com/p/{training.id}")
-
 
-    model_url = f"https://replicate.com/{model.owner}/{model.name}" 
+    get_training_monitor().track(
+        training["id"],
+        trainer,
+        status=training["status"],
+        on_update=on_update,
+    )
 
-    return {
-        "status": training.status,
-        "id": training.id,
-        "modelUrl": model_url,
-        "trainingUrl": f"https://replicate.com/p/{training.id}"
-    }
\ No newline at end of file
+    return dict(training, trainer=trainer.name, trainerAccount=trainer.account)
@@ -0,0 +1,479 @@
+import os
+import math
+import time
+import uuid
+import socket
+import random
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import closing
+from src.services.training_monitor import TERMINAL_STATUSES
+from src.services.workspace import is_owner_alive
+from src.config import (
+    TRAINER_BACKENDS,
+    ENABLE_FAKE_TRAINER,
+    TRAINER_DB_PATH,
+    TRAINER_SLOT_TIMEOUT,
+    TRAINER_SLOT_MAX_AGE,
+    FAKE_TRAINER_GPUS,
+    FAKE_TRAINER_STARTUP_SECONDS,
+    FAKE_TRAINER_SECONDS_PER_STEP,
+    FAKE_TRAINER_FAILURE_RATE,
+)
+
+# Capabilities of a trainer backend
+# Captions the images itself when the dataset has no captions
+AUTOCAPTION = "autocaption"
+# Returns the training of an identical earlier submission
+REUSE = "reuse"
+
+# Seconds between checks for a free slot held by another process
+SLOT_POLL_INTERVAL = 1.0
+
+class MemorySlots:
+    """Counts the trainings of a backend in flight. Only suitable for a
+    single process.
+
+    A slot is taken while a training is submitted, then held under the id
+    of the training until it ends.
+    """
+
+    def __init__(self):
+        self._slots = set()
+        self._condition = threading.Condition()
+
+    def count(self):
+        with self._condition:
+            return len(self._slots)
+
+    def acquire(self, limit, timeout):
+        """Takes a slot once fewer than limit are held.
+
+        Args:
+            limit (int): Maximum number of slots, 0 for no limit.
+            timeout (float): Seconds to wait for a free slot.
+
+        Returns:
+            str: The slot.
+
+        Raises:
+            TimeoutError: If no slot was freed in time.
+        """
+        slot = uuid.uuid4().hex
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: not 0 < limit <= len(self._slots), timeout
+            ):
+                raise TimeoutError(
+                    f"No training slot freed within {timeout:g} seconds"
+                )
+            self._slots.add(slot)
+        return slot
+
+    def assign(self, slot, training_id):
+        with self._condition:
+            self._slots.discard(slot)
+            self._slots.add(training_id)
+
+    def release(self, slot):
+        with self._condition:
+            self._slots.discard(slot)
+            self._condition.notify_all()
+
+class SQLiteSlots:
+    """Counts the trainings of a provider account in flight in a SQLite
+    database, so the concurrency limit of the account holds across every
+    worker process (see MemorySlots).
+
+    Slots of submissions whose process on this host is gone, and slots
+    older than TRAINER_SLOT_MAX_AGE, are freed while waiting.
+    """
+
+    def __init__(self, account, db_path=TRAINER_DB_PATH, max_age=TRAINER_SLOT_MAX_AGE):
+        """
+        Args:
+            account (str): Key of the account, e.g. the backend name and a
+                hash of its API token.
+            db_path (str): Path of the database.
+            max_age (float): Seconds after which a slot is assumed lost.
+        """
+        self.account = account
+        self.db_path = db_path
+        self.max_age = max_age
+        self._condition = threading.Condition()
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS slots ("
+                "account TEXT, slot TEXT, pid INTEGER, host TEXT, created REAL, "
+                "PRIMARY KEY (account, slot))"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def count(self):
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM slots WHERE account = ? AND created > ?",
+                (self.account, time.time() - self.max_age),
+            ).fetchone()
+        return row[0]
+
+    def _free_lost(self, conn):
+        conn.execute(
+            "DELETE FROM slots WHERE account = ? AND created <= ?",
+            (self.account, time.time() - self.max_age),
+        )
+        host = socket.gethostname()
+        rows = conn.execute(
+            "SELECT slot, pid FROM slots WHERE account = ? AND host = ? AND pid != ?",
+            (self.account, host, os.getpid()),
+        ).fetchall()
+        for slot, pid in rows:
+            if not is_owner_alive({"pid": pid}):
+                conn.execute(
+                    "DELETE FROM slots WHERE account = ? AND slot = ?",
+                    (self.account, slot),
+                )
+
+    def _try_acquire(self, limit, slot):
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._free_lost(conn)
+            held = conn.execute(
+                "SELECT COUNT(*) FROM slots WHERE account = ?", (self.account,)
+            ).fetchone()[0]
+            if 0 < limit <= held:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute(
+                "INSERT INTO slots (account, slot, pid, host, created) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.account, slot, os.getpid(), socket.gethostname(), time.time()),
+            )
+            conn.execute("COMMIT")
+            return True
+
+    def acquire(self, limit, timeout):
+        """Takes a slot once fewer than limit are held by all processes.
+
+        Args:
+            limit (int): Maximum number of slots, 0 for no limit.
+            timeout (float): Seconds to wait for a free slot.
+
+        Returns:
+            str: The slot.
+
+        Raises:
+            TimeoutError: If no slot was freed in time.
+        """
+        slot = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        while not self._try_acquire(limit, slot):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(
+                    f"No training slot freed within {timeout:g} seconds"
+                )
+            # Slots freed by this process wake the waiters right away
+            with self._condition:
+                self._condition.wait(min(SLOT_POLL_INTERVAL, remaining))
+        return slot
+
+    def assign(self, slot, training_id):
+        # The training holds the slot until it ends, whichever process
+        # sees it end
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "DELETE FROM slots WHERE account = ? AND slot = ?",
+                (self.account, slot),
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO slots (account, slot, pid, host, created) "
+                "VALUES (?, ?, NULL, NULL, ?)",
+                (self.account, training_id, time.time()),
+            )
+            conn.execute("COMMIT")
+
+    def release(self, slot):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "DELETE FROM slots WHERE account = ? AND slot = ?",
+                (self.account, slot),
+            )
+        with self._condition:
+            self._condition.notify_all()
+
+class TrainerBackend(ABC):
+    """Base class of the services LoRA trainings are submitted to.
+
+    A backend describes what it can do (capabilities), how many of its
+    trainings may run at once (max_concurrency, 0 for no limit) and what a
+    training takes and costs, so jobs can be routed across providers and
+    accounts (see route_training). Submissions beyond the concurrency limit
+    wait for a running training to end, which the training monitor reports
+    by polling get_status, and fail after TRAINER_SLOT_TIMEOUT seconds.
+
+    Subclasses set the class attributes and implement _submit and
+    _get_status.
+    """
+
+    name = None
+    capabilities = frozenset()
+    max_concurrency = 0
+    # Estimates of a training: boot time, time per step and price
+    startup_seconds = 0.0
+    seconds_per_step = 0.0
+    cost_per_second = 0.0
+    # Key of the provider account the trainings are submitted under, None
+    # when they can't be polled from another process (see
+    # jobs.JobQueue.resume_tracking)
+    account = None
+
+    def __init__(self, slots=None, slot_timeout=TRAINER_SLOT_TIMEOUT):
+        """
+        Args:
+            slots (MemorySlots | SQLiteSlots, optional): Where the trainings
+                in flight are counted. Defaults to this process only.
+            slot_timeout (float): Seconds a submission waits for a free
+                slot.
+        """
+        self._slots = slots if slots is not None else MemorySlots()
+        self.slot_timeout = slot_timeout
+
+    @property
+    def in_flight(self):
+        """Number of trainings submitted and not ended yet."""
+        return self._slots.count()
+
+    def estimate(self, steps):
+        """Estimates how long a training submitted now would take and what
+        it would cost.
+
+        Args:
+            steps (int): Number of training steps.
+
+        Returns:
+            dict: The seconds waiting for a free slot ("queueSeconds"), the
+                seconds until the training ends, waiting included
+                ("seconds"), and its cost in dollars ("cost").
+        """
+        train_seconds = self.startup_seconds + steps * self.seconds_per_step
+        queue_seconds = 0.0
+        if self.max_concurrency > 0:
+            # Trainings ahead of this one end in waves of max_concurrency
+            ahead = self.in_flight - self.max_concurrency + 1
+            if ahead > 0:
+                queue_seconds = math.ceil(ahead / self.max_concurrency) * train_seconds
+        return {
+            "queueSeconds": queue_seconds,
+            "seconds": queue_seconds + train_seconds,
+            "cost": train_seconds * self.cost_per_second,
+        }
+
+    def submit(self, zip_path, token, owner, training_input, reuse=True):
+        """Submits a training, once the backend is under its concurrency
+        limit.
+
+        Args:
+            zip_path (str): Path to the zip file containing training images.
+            token (str): The token of the model.
+            owner (str): The owner of the destination model.
+            training_input (dict): The trainer inputs, without the images.
+            reuse (bool): Return the training of an identical earlier
+                submission instead of training again, if supported.
+
+        Returns:
+            dict: The training id ("id"), status ("status"), model and
+                training URLs ("modelUrl", "trainingUrl") and whether the
+                training was reused ("reused").
+
+        Raises:
+            TimeoutError: If no slot was freed within slot_timeout.
+        """
+        slot = self._slots.acquire(self.max_concurrency, self.slot_timeout)
+        training = None
+        try:
+            training = self._submit(zip_path, token, owner, training_input, reuse)
+            return training
+        finally:
+            if training is not None and training["status"] not in TERMINAL_STATUSES:
+                self._slots.assign(slot, training["id"])
+            else:
+                self._slots.release(slot)
+
+    def get_status(self, training_id):
+        """Returns the current status of a training.
+
+        Args:
+            training_id (str): The training id.
+
+        Returns:
+            dict: The status ("status") and error ("error") of the training.
+        """
+        status = self._get_status(training_id)
+        if status["status"] in TERMINAL_STATUSES:
+            self._slots.release(training_id)
+        return status
+
+    @abstractmethod
+    def _submit(self, zip_path, token, owner, training_input, reuse):
+        pass
+
+    @abstractmethod
+    def _get_status(self, training_id):
+        pass
+
+class FakeTrainer(TrainerBackend):
+    """Simulates trainings in process, to load test the submission and
+    monitoring path without a provider.
+
+    The simulated provider runs `gpus` trainings at once. A training stays
+    "starting" while it waits for a GPU and boots, is "processing" for its
+    steps, then succeeds, or fails for a share of them (failure_rate).
+    """
+
+    name = "fake"
+    capabilities = frozenset({AUTOCAPTION})
+
+    def __init__(self, gpus=FAKE_TRAINER_GPUS,
+                 startup_seconds=FAKE_TRAINER_STARTUP_SECONDS,
+                 seconds_per_step=FAKE_TRAINER_SECONDS_PER_STEP,
+                 failure_rate=FAKE_TRAINER_FAILURE_RATE, max_concurrency=0):
+        """
+        Args:
+            gpus (int): Number of trainings the simulated provider runs at
+                once; the others queue.
+            startup_seconds (float): Boot time of a training.
+            seconds_per_step (float): Time of a training step.
+            failure_rate (float): Share of the trainings failing.
+            max_concurrency (int): Concurrency limit of the backend, 0 for
+                none (see TrainerBackend).
+        """
+        super().__init__()
+        self.startup_seconds = startup_seconds
+        self.seconds_per_step = seconds_per_step
+        self.failure_rate = failure_rate
+        self.max_concurrency = max_concurrency
+        self._gpus = [0.0] * max(1, gpus)
+        self._trainings = {}
+        self._lock = threading.Lock()
+
+    def estimate(self, steps):
+        estimate = super().estimate(steps)
+        # The queue of the simulated provider is known exactly
+        with self._lock:
+            wait = max(0.0, min(self._gpus) - time.monotonic())
+        estimate["queueSeconds"] += wait
+        estimate["seconds"] += wait
+        return estimate
+
+    def _submit(self, zip_path, token, owner, training_input, reuse):
+        duration = training_input.get("steps", 1000) * self.seconds_per_step
+        now = time.monotonic()
+        with self._lock:
+            # The training runs on the GPU freed first
+            gpu = min(range(len(self._gpus)), key=self._gpus.__getitem__)
+            start = max(now, self._gpus[gpu]) + self.startup_seconds
+            self._gpus[gpu] = start + duration
+            training_id = uuid.uuid4().hex
+            self._trainings[training_id] = {
+                "start": start,
+                "end": start + duration,
+                "failed": random.random() < self.failure_rate,
+            }
+        return {
+            "id": training_id,
+            "status": "starting",
+            "modelUrl": f"fake://{owner}/flux-{token}",
+            "trainingUrl": f"fake://trainings/{training_id}",
+            "reused": False,
+        }
+
+    def _get_status(self, training_id):
+        with self._lock:
+            training = self._trainings[training_id]
+        now = time.monotonic()
+        if now < training["start"]:
+            return {"status": "starting", "error": None}
+        if now < training["end"]:
+            return {"status": "processing", "error": None}
+        if training["failed"]:
+            return {"status": "failed", "error": "Simulated training failure"}
+        return {"status": "succeeded", "error": None}
+
+_trainers = {}
+_trainers_lock = threading.Lock()
+
+def get_trainer(name, api_token=None):
+    """Returns the process-wide trainer backend of a provider account,
+    creating it on first use.
+
+    Args:
+        name (str): "replicate", or "fake" when ENABLE_FAKE_TRAINER is set.
+        api_token (str, optional): The API token of the account. Defaults
+            to the configured token of the provider.
+
+    Returns:
+        TrainerBackend: The shared backend.
+
+    Raises:
+        ValueError: If the backend is unknown or not enabled.
+    """
+    if name == "fake" and not ENABLE_FAKE_TRAINER:
+        raise ValueError("The fake trainer backend is disabled. Set ENABLE_FAKE_TRAINER to use it.")
+    with _trainers_lock:
+        trainer = _trainers.get((name, api_token))
+        if trainer is None:
+            if name == "replicate":
+                from src.services.replicate_integration import ReplicateTrainer
+                trainer = ReplicateTrainer(api_token)
+            elif name == "fake":
+                trainer = FakeTrainer()
+            else:
+                raise ValueError("Invalid trainer backend. Choose 'replicate' or 'fake'.")
+            _trainers[(name, api_token)] = trainer
+        return trainer
+
+def configured_trainers(api_token=None):
+    """Returns the backends listed in TRAINER_BACKENDS for an account.
+
+    Args:
+        api_token (str, optional): The API token of the account.
+
+    Returns:
+        list: The trainer backends.
+    """
+    names = [name.strip() for name in TRAINER_BACKENDS.split(",") if name.strip()]
+    return [get_trainer(name, api_token) for name in names]
+
+def route_training(trainers, steps, required=()):
+    """Picks the backend expected to end a training first, then the
+    cheapest.
+
+    Args:
+        trainers (list): The candidate trainer backends.
+        steps (int): Number of training steps.
+        required (iterable): Capabilities the training needs, e.g.
+            {AUTOCAPTION}.
+
+    Returns:
+        TrainerBackend: The chosen backend.
+    """
+    required = set(required)
+    candidates = [trainer for trainer in trainers if required <= trainer.capabilities]
+    if not candidates:
+        raise ValueError(
+            f"No trainer backend supports {', '.join(sorted(required))}"
+        )
+
+    def rank(trainer):
+        estimate = trainer.estimate(steps)
+        return estimate["seconds"], estimate["cost"]
+
+    return min(candidates, key=rank)
@@ -0,0 +1,246 @@
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.services.metrics import TRAININGS_TRACKED
+from src.config import (
+    MONITOR_MIN_INTERVAL,
+    MONITOR_MAX_INTERVAL,
+    MONITOR_BACKOFF,
+    MONITOR_WORKERS,
+    MONITOR_MAX_FAILURES,
+)
+
+# Statuses after which a training no longer changes
+TERMINAL_STATUSES = {"succeeded", "failed", "canceled"}
+
+class TrainingMonitor:
+    """Tracks in-flight trainings from a single background loop.
+
+    Instead of one sleeping thread per training, every tracked training is
+    polled by the same loop through its trainer backend (see
+    trainers.TrainerBackend). Polling starts fast and backs off while the
+    status stays the same, so long trainings cost few requests. Status
+    changes are passed to the training's callbacks and published to its
+    subscribers.
+
+    A training whose backend doesn't know it (LookupError), or whose status
+    can't be read max_failures times in a row, is no longer tracked; a last
+    event with its error and "untracked" set to True is published.
+    """
+
+    def __init__(self, min_interval=MONITOR_MIN_INTERVAL,
+                 max_interval=MONITOR_MAX_INTERVAL, backoff=MONITOR_BACKOFF,
+                 max_workers=MONITOR_WORKERS, max_failures=MONITOR_MAX_FAILURES):
+        """
+        Args:
+            min_interval (float): First polling interval in seconds.
+            max_interval (float): Longest polling interval in seconds.
+            backoff (float): Factor applied to the interval after every
+                poll that finds the status unchanged.
+            max_workers (int): Maximum number of concurrent status requests.
+            max_failures (int): Consecutive failed polls after which a
+                training is no longer tracked.
+        """
+        self.min_interval = min_interval
+        self.max_failures = max_failures
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self._trainings = {}
+        self._subscribers = {}
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="monitor"
+        )
+        self._thread = None
+
+    def track(self, training_id, trainer, status="starting", on_update=None):
+        """Starts tracking a training.
+
+        Args:
+            training_id (str): The training id.
+            trainer (TrainerBackend): The backend running the training.
+            status (str): The last known status of the training.
+            on_update (callable, optional): Called as on_update(event) on
+                every status change, where event is the dict published to
+                subscribers.
+
+        Returns:
+            None
+        """
+        if status in TERMINAL_STATUSES:
+            return
+
+        with self._condition:
+            tracked = self._trainings.get(training_id)
+            if tracked is not None:
+                if on_update is not None:
+                    tracked["callbacks"].append(on_update)
+                return
+
+            self._trainings[training_id] = {
+                "trainer": trainer,
+                "status": status,
+                "interval": self.min_interval,
+                "next_poll": time.monotonic() + self.min_interval,
+                "polling": False,
+                "failures": 0,
+                "callbacks": [on_update] if on_update is not None else [],
+            }
+            TRAININGS_TRACKED.inc()
+            self._ensure_running()
+            self._condition.notify()
+
+    def is_tracked(self, training_id):
+        with self._condition:
+            return training_id in self._trainings
+
+    def subscribe(self, training_id):
+        """Subscribes to the status changes of a training.
+
+        Args:
+            training_id (str): The training id.
+
+        Returns:
+            queue.Queue: Receives an event dict on every status change.
+        """
+        events = queue.Queue()
+        with self._condition:
+            self._subscribers.setdefault(training_id, []).append(events)
+        return events
+
+    def unsubscribe(self, training_id, events):
+        with self._condition:
+            subscribers = self._subscribers.get(training_id, [])
+            if events in subscribers:
+                subscribers.remove(events)
+            if not subscribers:
+                self._subscribers.pop(training_id, None)
+
+    def wait(self, training_id, on_event=None):
+        """Blocks until a tracked training reaches a terminal status.
+
+        Args:
+            training_id (str): The training id.
+            on_event (callable, optional): Called with every event received.
+
+        Returns:
+            dict: The terminal event, the event of a training no longer 
+                tracked, or None if the training is not tracked.
+        """
+        events = self.subscribe(training_id)
+        try:
+            if not self.is_tracked(training_id):
+                return None
+            while True:
+                event = events.get()
+                if on_event is not None:
+                    on_event(event)
+                if event["status"] in TERMINAL_STATUSES or event.get("untracked"):
+                    return event
+        finally:
+            self.unsubscribe(training_id, events)
+
+    def _ensure_running(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name="training-monitor", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                due = [
+                    training_id
+                    for training_id, tracked in self._trainings.items()
+                    if not tracked["polling"] and tracked["next_poll"] <= now
+                ]
+                for training_id in due:
+                    self._trainings[training_id]["polling"] = True
+
+                if not due:
+                    pending = [
+                        tracked["next_poll"] for tracked in self._trainings.values()
+                        if not tracked["polling"]
+                    ]
+                    timeout = min(pending) - now if pending else None
+                    self._condition.wait(timeout)
+                    continue
+
+            for training_id in due:
+                self._executor.submit(self._poll, training_id)
+
+    def _poll(self, training_id):
+        with self._condition:
+            tracked = self._trainings[training_id]
+            trainer = tracked["trainer"]
+
+        failure = None
+        try:
+            training = trainer.get_status(training_id)
+            status, error = training["status"], training["error"]
+        except Exception as e:
+            print(f"Error while polling training {training_id}: {e}")
+            status, error, failure = None, None, e
+
+        event = None
+        with self._condition:
+            tracked["polling"] = False
+            tracked["failures"] = 0 if failure is None else tracked["failures"] + 1
+            if status is not None and status != tracked["status"]:
+                tracked["status"] = status
+                tracked["interval"] = self.min_interval
+                event = {"trainingId": training_id, "status": status, "error": error}
+            else:
+                tracked["interval"] = min(
+                    tracked["interval"] * self.backoff, self.max_interval
+                )
+            tracked["next_poll"] = time.monotonic() + tracked["interval"]
+
+            # A training the backend doesn't know, e.g. submitted from an
+            # account or a process it can't see, won't be found by polling
+            # again
+            given_up = failure is not None and (
+                isinstance(failure, LookupError)
+                or tracked["failures"] >= self.max_failures
+            )
+            if given_up:
+                event = {
+                    "trainingId": training_id,
+                    "status": tracked["status"],
+                    "error": f"Training status unavailable: {failure}",
+                    "untracked": True,
+                }
+            if status in TERMINAL_STATUSES or given_up:
+                del self._trainings[training_id]
+                TRAININGS_TRACKED.dec()
+            callbacks = list(tracked["callbacks"])
+            subscribers = list(self._subscribers.get(training_id, []))
+            self._condition.notify()
+
+        if event is None:
+            return
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"Error in training {training_id} callback: {e}")
+        for events in subscribers:
+            events.put(event)
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+def get_training_monitor():
+    """Returns the process-wide training monitor, creating it on first use.
+
+    Returns:
+        TrainingMonitor: The shared monitor.
+    """
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = TrainingMonitor()
+        return _monitor
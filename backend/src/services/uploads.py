@@ -0,0 +1,324 @@
+import os
+import re
+import json
+import time
+import uuid
+import fcntl
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from werkzeug.utils import secure_filename
+from src.services.caption_cache import hash_image
+from src.services.file_processing import ArchiveError, validate_archive
+from src.config import (
+    UPLOAD_FOLDER,
+    UPLOAD_MAX_BYTES,
+    UPLOAD_CHUNK_MAX_BYTES,
+    UPLOAD_SESSION_MAX_AGE,
+)
+
+# Bytes read from the request stream at a time
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+class UploadError(ValueError):
+    """A chunked upload request that can't be served.
+
+    Attributes:
+        status_code (int): The HTTP status code to answer with.
+    """
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+def _sessions_folder():
+    return os.path.join(UPLOAD_FOLDER, "sessions")
+
+def _session_path(upload_id):
+    # Upload ids are generated hex strings; anything else can't be a session
+    if not re.fullmatch(r"[0-9a-f]{32}", upload_id or ""):
+        raise UploadError("Upload not found", 404)
+    return os.path.join(_sessions_folder(), f"{upload_id}.json")
+
+def _part_path(upload_id):
+    return os.path.join(_sessions_folder(), f"{upload_id}.part")
+
+def dataset_path(sha256):
+    """Returns where a completed upload with the given content is stored.
+
+    Uploads are stored under their content hash, so uploading the same
+    dataset twice keeps a single copy.
+
+    Args:
+        sha256 (str): Hex SHA-256 of the archive.
+
+    Returns:
+        str: Path of the archive.
+    """
+    return os.path.join(UPLOAD_FOLDER, f"{sha256}.zip")
+
+def _write_session(session):
+    path = _session_path(session["uploadId"])
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(session, f)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _read_session(upload_id):
+    try:
+        with open(_session_path(upload_id), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        raise UploadError("Upload not found", 404)
+
+@contextmanager
+def _locked_session(upload_id):
+    # Yields the session of an upload while holding an exclusive lock on its
+    # file, which serializes the writers of the upload across workers. The
+    # session file outlives the part file, so a completed upload is still
+    # found once its part is gone
+    path = _session_path(upload_id)
+    while True:
+        try:
+            f = open(path, "r")
+        except OSError:
+            raise UploadError("Upload not found", 404)
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                current = os.stat(path).st_ino == os.fstat(f.fileno()).st_ino
+            except OSError:
+                current = False
+            if not current:
+                # Replaced or removed while waiting for the lock; lock the
+                # file in place now
+                continue
+            try:
+                session = json.load(f)
+            except ValueError:
+                raise UploadError("Upload not found", 404)
+            yield session
+            return
+
+def _completed(session, file_path):
+    return dict(session, offset=session["size"], complete=True, filePath=file_path)
+
+def init_upload(filename, size, sha256):
+    """Starts a chunked upload.
+
+    If an archive with the same content was uploaded before, the upload is
+    complete right away and nothing needs to be sent.
+
+    Args:
+        filename (str): Name of the archive, which must be a ZIP file.
+        size (int): Size of the archive in bytes.
+        sha256 (str): Hex SHA-256 of the whole archive.
+
+    Returns:
+        dict: The upload session: its id ("uploadId"), the archive name,
+            size and hash, the number of bytes received ("offset"), the
+            maximum chunk size ("chunkSize"), whether it is complete and,
+            once it is, the archive path ("filePath").
+
+    Raises:
+        UploadError: If the archive is not a ZIP file, is too large or the
+            hash is malformed.
+    """
+    if not filename or not filename.lower().endswith(".zip"):
+        raise UploadError("Invalid file type. Please upload a ZIP file.")
+    if not isinstance(size, int) or size <= 0:
+        raise UploadError("Invalid file size")
+    if size > UPLOAD_MAX_BYTES:
+        raise UploadError(
+            f"File too large, the limit is {UPLOAD_MAX_BYTES} bytes", 413
+        )
+    sha256 = (sha256 or "").lower()
+    if not SHA256_PATTERN.match(sha256):
+        raise UploadError("Invalid SHA-256 checksum")
+
+    session = {
+        "uploadId": uuid.uuid4().hex,
+        "filename": secure_filename(filename),
+        "size": size,
+        "sha256": sha256,
+        "offset": 0,
+        "chunkSize": UPLOAD_CHUNK_MAX_BYTES,
+        "complete": False,
+        "filePath": None,
+        "created": time.time(),
+    }
+
+    os.makedirs(_sessions_folder(), exist_ok=True)
+    # Re-uploading a known dataset is a no-op
+    if os.path.exists(dataset_path(sha256)):
+        session = _completed(session, dataset_path(sha256))
+    else:
+        open(_part_path(session["uploadId"]), "wb").close()
+    _write_session(session)
+    return session
+
+def get_upload(upload_id):
+    """Returns an upload session, e.g. to find where to resume it.
+
+    Args:
+        upload_id (str): The upload id.
+
+    Returns:
+        dict: The upload session (see init_upload).
+
+    Raises:
+        UploadError: If the upload doesn't exist.
+    """
+    return _read_session(upload_id)
+
+def write_chunk(upload_id, offset, stream, length, sha256):
+    """Appends a chunk to an upload, streaming it straight to disk.
+
+    Chunks must be sent in order: offset has to match the number of bytes
+    received so far. A chunk whose checksum doesn't match is discarded, so
+    the client can send it again.
+
+    Args:
+        upload_id (str): The upload id.
+        offset (int): Position of the chunk in the archive.
+        stream (file-like): The chunk data, e.g. the request stream.
+        length (int): Length of the chunk in bytes.
+        sha256 (str): Hex SHA-256 of the chunk.
+
+    Returns:
+        dict: The updated upload session.
+
+    Raises:
+        UploadError: If the upload doesn't exist, the offset is not the
+            expected one, the chunk is too large or its checksum doesn't
+            match.
+    """
+    if length is None or length <= 0:
+        raise UploadError("Missing chunk length")
+    if length > UPLOAD_CHUNK_MAX_BYTES:
+        raise UploadError(
+            f"Chunk too large, the limit is {UPLOAD_CHUNK_MAX_BYTES} bytes", 413
+        )
+    sha256 = (sha256 or "").lower()
+    if not SHA256_PATTERN.match(sha256):
+        raise UploadError("Invalid chunk SHA-256 checksum")
+
+    with _locked_session(upload_id) as session:
+        if session["complete"]:
+            raise UploadError("Upload already completed", 409)
+        if offset != session["offset"]:
+            raise UploadError(
+                f"Expected offset {session['offset']}, got {offset}", 409
+            )
+        if offset + length > session["size"]:
+            raise UploadError("Chunk exceeds the declared file size", 413)
+        try:
+            part = open(_part_path(upload_id), "r+b")
+        except OSError:
+            raise UploadError("Upload not found", 404)
+
+        with part:
+            digest = hashlib.sha256()
+            part.seek(offset)
+            received = 0
+            while received < length:
+                data = stream.read(min(STREAM_CHUNK_SIZE, length - received))
+                if not data:
+                    break
+                digest.update(data)
+                part.write(data)
+                received += len(data)
+
+            if received != length or digest.hexdigest() != sha256:
+                # Drop the partial or corrupt chunk
+                part.truncate(offset)
+                if received != length:
+                    raise UploadError("Incomplete chunk")
+                raise UploadError("Chunk checksum mismatch")
+
+            part.flush()
+            os.fsync(part.fileno())
+            session["offset"] = offset + length
+            _write_session(session)
+            return session
+
+def complete_upload(upload_id):
+    """Verifies a fully received upload and stores the archive.
+
+    Args:
+        upload_id (str): The upload id.
+
+    Returns:
+        dict: The completed upload session, with the archive path
+            ("filePath").
+
+    Raises:
+        UploadError: If the upload doesn't exist, is missing bytes, its
+            checksum doesn't match the one declared on init or the archive
+            is rejected (see file_processing.check_archive).
+    """
+    with _locked_session(upload_id) as session:
+        if session["complete"]:
+            return session
+        if session["offset"] != session["size"]:
+            raise UploadError(
+                f"Upload incomplete, received {session['offset']} of "
+                f"{session['size']} bytes", 409
+            )
+        part_path = _part_path(upload_id)
+        if hash_image(part_path) != session["sha256"]:
+            raise UploadError("File checksum mismatch")
+        try:
+            validate_archive(part_path)
+        except ArchiveError as e:
+            raise UploadError(str(e))
+
+        target = dataset_path(session["sha256"])
+        if os.path.exists(target):
+            # Same dataset uploaded concurrently; keep the first copy
+            os.remove(part_path)
+        else:
+            os.replace(part_path, target)
+
+        session = _completed(session, target)
+        _write_session(session)
+        return session
+
+def reap_stale_uploads(max_age=None):
+    """Removes the upload sessions that were abandoned or completed long ago.
+
+    Args:
+        max_age (float, optional): Maximum age in seconds. Defaults to
+            UPLOAD_SESSION_MAX_AGE.
+
+    Returns:
+        int: Number of sessions removed.
+    """
+    max_age = UPLOAD_SESSION_MAX_AGE if max_age is None else max_age
+    folder = _sessions_folder()
+    if not os.path.isdir(folder):
+        return 0
+
+    removed = 0
+    for name in os.listdir(folder):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(folder, name)
+        try:
+            if time.time() - os.path.getmtime(path) <= max_age:
+                continue
+            os.remove(path)
+        except OSError:
+            continue
+        part_path = path[:-len(".json")] + ".part"
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        removed += 1
+    return removed
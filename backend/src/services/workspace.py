@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import atexit
+import shutil
+import socket
+import tempfile
+import threading
+from contextlib import contextmanager
+from src.config import WORKSPACE_ROOT, WORKSPACE_MAX_AGE
+
+# Marker file identifying the process that owns a workspace
+OWNER_FILE = ".owner.json"
+
+# Workspaces created by this process, removed on exit
+_active_workspaces = set()
+# Resumable workspaces in use by this process, kept on exit
+_resumable_workspaces = set()
+_lock = threading.Lock()
+
+def create_workspace(prefix="job", root=None):
+    """Creates a unique scratch directory for a job.
+
+    The directory contains a marker file recording the owning process, so
+    workspaces left behind by a crash can later be reaped (see
+    reap_orphaned_workspaces).
+
+    Args:
+        prefix (str): Prefix of the directory name.
+        root (str, optional): Parent directory. Defaults to WORKSPACE_ROOT.
+
+    Returns:
+        str: Path of the new workspace.
+    """
+    root = os.path.abspath(root or WORKSPACE_ROOT)
+    os.makedirs(root, exist_ok=True)
+    path = tempfile.mkdtemp(prefix=f"{prefix}-", dir=root)
+    with open(os.path.join(path, OWNER_FILE), "w") as f:
+        json.dump({
+            "pid": os.getpid(),
+            "host": socket.gethostname(),
+            "created": time.time(),
+        }, f)
+
+    with _lock:
+        _active_workspaces.add(path)
+    return path
+
+def remove_workspace(path):
+    """Deletes a workspace and all its contents.
+
+    Args:
+        path (str): Path of the workspace.
+
+    Returns:
+        None
+    """
+    with _lock:
+        _active_workspaces.discard(path)
+    shutil.rmtree(path, ignore_errors=True)
+
+@contextmanager
+def job_workspace(prefix="job", root=None, keep=False):
+    """Context manager providing an isolated workspace for a job.
+
+    The workspace is removed when the block exits, whether it succeeded or
+    raised, unless keep is True.
+
+    Args:
+        prefix (str): Prefix of the directory name.
+        root (str, optional): Parent directory. Defaults to WORKSPACE_ROOT.
+        keep (bool): Leave the workspace in place on exit.
+
+    Yields:
+        str: Path of the workspace.
+    """
+    path = create_workspace(prefix, root)
+    try:
+        yield path
+    finally:
+        if not keep:
+            remove_workspace(path)
+
+@contextmanager
+def resumable_workspace(key, prefix="job", root=None):
+    """Context manager providing a workspace that survives failed attempts.
+
+    The workspace is named after key, so a retry of the same work reopens
+    the workspace of the failed attempt, with everything it saved. It is
+    removed once the block succeeds, and kept when the block raises or the
+    process dies, until it is older than WORKSPACE_MAX_AGE (see
+    reap_orphaned_workspaces).
+
+    Args:
+        key (str): Identifies the work, e.g. a preparation checkpoint key.
+        prefix (str): Prefix of the directory name.
+        root (str, optional): Parent directory. Defaults to WORKSPACE_ROOT.
+
+    Yields:
+        str: Path of the workspace.
+
+    Raises:
+        RuntimeError: If another attempt is using the workspace.
+    """
+    root = os.path.abspath(root or WORKSPACE_ROOT)
+    path = os.path.join(root, f"{prefix}-{key}")
+    with _lock:
+        if path in _active_workspaces or path in _resumable_workspaces:
+            raise RuntimeError(f"Workspace {path} is already in use")
+        _resumable_workspaces.add(path)
+
+    try:
+        owner = _read_owner(path)
+        if (owner is not None and owner.get("host") == socket.gethostname()
+                and owner.get("pid") != os.getpid() and is_owner_alive(owner)):
+            raise RuntimeError(f"Workspace {path} is already in use")
+
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, OWNER_FILE), "w") as f:
+            json.dump({
+                "pid": os.getpid(),
+                "host": socket.gethostname(),
+                "created": time.time(),
+                "resumable": True,
+            }, f)
+
+        yield path
+        shutil.rmtree(path, ignore_errors=True)
+    finally:
+        with _lock:
+            _resumable_workspaces.discard(path)
+
+def _read_owner(path):
+    try:
+        with open(os.path.join(path, OWNER_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def is_owner_alive(owner):
+    """Checks whether the process recorded as an owner is still running.
+
+    Only meaningful for owners on this host (owner["host"]).
+
+    Args:
+        owner (dict): The owner record, with its process id ("pid").
+
+    Returns:
+        bool: True if the process exists.
+    """
+    pid = owner.get("pid")
+    return isinstance(pid, int) and pid > 0 and _is_process_alive(pid)
+
+def _is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists but belongs to another user
+        return True
+    return True
+
+def is_orphaned(path, max_age=None):
+    """Checks whether a workspace has been abandoned.
+
+    A workspace is orphaned when it is older than max_age, when its marker
+    file is missing or unreadable, or when its owning process on this host
+    is gone, unless it is a resumable workspace.
+
+    Args:
+        path (str): Path of the workspace.
+        max_age (float, optional): Maximum age in seconds. Defaults to
+            WORKSPACE_MAX_AGE.
+
+    Returns:
+        bool: True if the workspace can be removed.
+    """
+    max_age = WORKSPACE_MAX_AGE if max_age is None else max_age
+    owner = _read_owner(path)
+    if owner is None:
+        # Give a workspace being created a moment to write its marker
+        try:
+            return time.time() - os.path.getmtime(path) > 60
+        except OSError:
+            return False
+
+    if time.time() - owner.get("created", 0) > max_age:
+        return True
+    if owner.get("resumable"):
+        # Kept for a retry to resume until it expires
+        return False
+    if owner.get("host") == socket.gethostname():
+        return not is_owner_alive(owner)
+    return False
+
+def reap_orphaned_workspaces(root=None, max_age=None):
+    """Removes the workspaces abandoned by crashed or killed processes.
+
+    Args:
+        root (str, optional): Parent directory. Defaults to WORKSPACE_ROOT.
+        max_age (float, optional): Maximum age in seconds. Defaults to
+            WORKSPACE_MAX_AGE.
+
+    Returns:
+        int: Number of workspaces removed.
+    """
+    root = os.path.abspath(root or WORKSPACE_ROOT)
+    if not os.path.isdir(root):
+        return 0
+
+    removed = 0
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        with _lock:
+            if path in _active_workspaces or path in _resumable_workspaces:
+                continue
+        if os.path.isdir(path) and is_orphaned(path, max_age):
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    return removed
+
+def _remove_active_workspaces():
+    with _lock:
+        paths = list(_active_workspaces)
+    for path in paths:
+        remove_workspace(path)
+
+atexit.register(_remove_active_workspaces)
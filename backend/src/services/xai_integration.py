@@ -1,7 +1,64 @@
 import os
+import mmap
+import time
+import random
+import threading
 import base64
-from openai import OpenAI
-from src.config import XAI_API_KEY
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
+from src.config import (
+    CAPTION_CONCURRENCY,
+    CAPTION_TIMEOUT,
+    CAPTION_MAX_RETRIES,
+    CAPTION_BACKOFF,
+    CAPTION_QUALITY_RETRIES,
+    CAPTION_RETRY_TEMPERATURE,
+    XAI_API_KEY,
+    XAI_CAPTION_TOKENS,
+)
+from src.services.caption_cache import get_caption_cache, hash_image
+from src.services.caption_quality import (
+    CaptionQualityError,
+    validate_captions,
+    validation_stats,
+)
+from src.services.clients import get_xai_client
+from src.services.metrics import external_request, observe_caption
+from src.services.rate_limit import (
+    get_rate_limiter,
+    is_rate_limited,
+    parse_retry_after,
+)
+
+# Vision model used for captioning
+XAI_MODEL = "grok-vision-beta"
+
+# Sampling temperature of caption requests, low for consistent captions
+CAPTION_TEMPERATURE = 0.01
+
+# Bytes encoded at a time; a multiple of 3 so chunks need no padding
+ENCODE_CHUNK_SIZE = 3 * 256 * 1024
+
+# HTTP status codes worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def load_image(image):
+    """Returns the raw bytes of an image.
+
+    Args:
+        image (str | bytes | callable): Path to the image file, its raw 
+            bytes, or a callable without arguments returning the bytes (e.g. 
+            reading a member of a ZIP archive).
+
+    Returns:
+        bytes: The image content.
+    """
+    if callable(image):
+        return image()
+    if isinstance(image, (bytes, bytearray)):
+        return image
+    with open(image, "rb") as image_file:
+        return image_file.read()
 
 def encode_image(image_path):
     """Encodes an image file to base64 string format.
@@ -11,43 +68,80 @@ def encode_image(image_path):
     image data in base64 format.
 
     Args:
-        image_path (str): Path to the image file that needs to be encoded.
+        image_path (str | bytes): Path to the image file that needs to be 
+            encoded, or its raw bytes.
 
     Returns:
         str: Base64 encoded string representation of the input image.
     """
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
-  
-def generate_description(image_path, token, type, infos, API_KEY):
+    return base64.b64encode(load_image(image_path)).decode('utf-8')
+
+@contextmanager
+def _image_buffer(image):
+    """Exposes an image as a buffer without reading a file into memory.
+
+    Files are memory-mapped, so their pages are read on demand by the 
+    encoder and can be dropped by the OS at any time.
     """
-    Generates a physical description of a person from an input image using 
-    X.AI API through the openAI SDK.
+    if callable(image):
+        image = image()
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        yield memoryview(image)
+        return
 
-    This function takes an image containing a person, encodes it to base64, 
-    and uses the X.AI API to generate a concise description focusing on 
-    physical characteristics relevant for image generation training.
+    with open(image, "rb") as image_file:
+        if os.fstat(image_file.fileno()).st_size == 0:
+            yield memoryview(b"")
+            return
+        with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                yield view
+            finally:
+                view.release()
+
+def build_image_url(image, mime_type="image/jpeg"):
+    """Builds the base64 data URL of an image for the vision API.
+
+    The image is encoded chunk by chunk into a buffer preallocated to the 
+    exact size of the URL, which is then decoded once. Compared to reading 
+    the file, encoding it, decoding it and formatting it into an f-string, 
+    each in-flight request holds about one encoded copy of the image 
+    instead of four.
+
+    Args:
+        image (str | bytes | callable): Path to the image file, its raw 
+            bytes, or a callable returning them (see load_image).
+        mime_type (str): MIME type announced in the URL.
+
+    Returns:
+        str: The data URL.
+    """
+    prefix = f"data:{mime_type};base64,".encode("ascii")
+    with _image_buffer(image) as data:
+        url = bytearray(len(prefix) + 4 * ((len(data) + 2) // 3))
+        url[:len(prefix)] = prefix
+        offset = len(prefix)
+        for start in range(0, len(data), ENCODE_CHUNK_SIZE):
+            chunk = base64.b64encode(data[start:start + ENCODE_CHUNK_SIZE])
+            url[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+    return url.decode("ascii")
+  
+def build_prompt(token, type, infos):
+    """Builds the captioning prompt for the given subject type.
 
     Args:
-        image_path (str): Path to the input image file containing a person.
         token (str): Token to include in the description (e.g., "a person").
         type (str): Determines which prompt to use ("human", "pet", or "item").
         infos (str): Additional informations about the subject of the images.
-        API_KEY (str): The API key to use for the X.AI API (if different from the default).
 
     Returns:
-        str: A cleaned string containing the generated description with all tabs 
-            and newlines removed.
-    """
-    base64_image = encode_image(image_path)
-    
-    api_key = API_KEY if API_KEY else XAI_API_KEY
-    client = OpenAI(
-        
-        api_key=api_key,
-        base_url="https://api.x.ai/v1",
-    )
+        str: The formatted prompt.
 
+    Raises:
+        ValueError: If the type is not one of "human", "pet" or "item".
+    """
     # Define the prompts for different types
     if type == "human":
         prompt = """Provide a brief, objective description of the person in this image, focusing on:\
@@ -81,7 +175,38 @@ def generate_description(image_path, token, type, infos, API_KEY):
         raise ValueError("Invalid type. Choose 'human', 'pet', or 'item'.")
 
     # Format the prompt with the token
-    formatted_prompt = prompt.format(token=token, infos=infos)
+    return prompt.format(token=token, infos=infos)
+
+def generate_description(image_path, token, type, infos, API_KEY, timeout=None,
+                         temperature=CAPTION_TEMPERATURE):
+    """
+    Generates a physical description of a person from an input image using 
+    X.AI API through the openAI SDK.
+
+    This function takes an image containing a person, encodes it to base64, 
+    and uses the X.AI API to generate a concise description focusing on 
+    physical characteristics relevant for image generation training.
+
+    Args:
+        image_path (str | bytes): Path to the input image file containing a 
+            person, or its raw bytes.
+        token (str): Token to include in the description (e.g., "a person").
+        type (str): Determines which prompt to use ("human", "pet", or "item").
+        infos (str): Additional informations about the subject of the images.
+        API_KEY (str): The API key to use for the X.AI API (if different from the default).
+        timeout (float, optional): Request timeout in seconds. Defaults to 
+            CAPTION_TIMEOUT.
+        temperature (float): Sampling temperature of the model.
+
+    Returns:
+        str: A cleaned string containing the generated description with all tabs 
+            and newlines removed.
+    """
+    formatted_prompt = build_prompt(token, type, infos)
+    image_url = build_image_url(image_path)
+    
+    # Pooled client, shared across images and requests
+    client = get_xai_client(API_KEY)
 
     messages = [
         {
@@ -90,7 +215,7 @@ def generate_description(image_path, token, type, infos, API_KEY):
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_image}",
+                        "url": image_url,
                         "detail": "high",
                     },
                 },
@@ -102,21 +227,345 @@ def generate_description(image_path, token, type, infos, API_KEY):
         },
     ]
 
-    stream = client.chat.completions.create(
-        model="grok-vision-beta",
-        messages=messages,
-        stream=True,
-        temperature=0.01,       
-    )
+    # Wait for our turn under the requests and tokens per minute limits
+    get_rate_limiter("xai").acquire(API_KEY or XAI_API_KEY, tokens=XAI_CAPTION_TOKENS)
+
+    start = time.perf_counter()
+    first_token = None
+    with external_request("xai", "caption"):
+        stream = client.chat.completions.create(
+            model=XAI_MODEL,
+            messages=messages,
+            stream=True,
+            temperature=temperature,
+            timeout=timeout if timeout is not None else CAPTION_TIMEOUT,
+        )
 
-    # Collect streamed content into a variable
-    response_content = ""
-    for chunk in stream:
-        content = chunk.choices[0].delta.content
-        if content:
-            response_content += content
+        # Collect streamed content into a variable
+        response_content = ""
+        for chunk in stream:
+            content = chunk.choices[0].delta.content
+            if content:
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                response_content += content
+    observe_caption(first_token, time.perf_counter() - start)
 
     # Remove tabs and newlines
     cleaned_content = response_content.replace("\t", "").replace("\n", "")
 
     return cleaned_content
+
+def is_retryable_error(error):
+    """Checks whether a failed X.AI request is worth retrying.
+
+    Args:
+        error (Exception): The exception raised by the request.
+
+    Returns:
+        bool: True for timeouts, connection errors, rate limiting (429) and 
+            server errors (5xx), False otherwise.
+    """
+    from openai import APIConnectionError, APIStatusError
+
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    # Also covers APITimeoutError, which subclasses APIConnectionError
+    return isinstance(error, APIConnectionError)
+
+def rate_limited_delay(error):
+    """Returns the delay requested by a rate limited X.AI response.
+
+    Args:
+        error (Exception): The exception raised by the request.
+
+    Returns:
+        float: The Retry-After delay in seconds, 0 if the response was rate 
+            limited without one, or None if it was not rate limited.
+    """
+    from openai import APIStatusError
+
+    if not isinstance(error, APIStatusError):
+        return None
+    retry_after = parse_retry_after(error.response.headers)
+    if not is_rate_limited(error.status_code, retry_after):
+        return None
+    return retry_after if retry_after is not None else 0.0
+
+def generate_description_with_retries(image_path, token, type, infos, API_KEY,
+                                      timeout=None, max_retries=None,
+                                      backoff=None,
+                                      temperature=CAPTION_TEMPERATURE):
+    """Calls generate_description, retrying transient failures with 
+    exponential backoff and jitter. Rate limited requests are retried 
+    after the delay asked by their Retry-After header, which applies to 
+    every request made with the same key.
+
+    Args:
+        image_path (str | bytes): Path to the input image file, or its raw 
+            bytes.
+        token (str): Token to include in the description.
+        type (str): Determines which prompt to use ("human", "pet", or "item").
+        infos (str): Additional informations about the subject of the images.
+        API_KEY (str): The API key to use for the X.AI API.
+        timeout (float, optional): Per-request timeout in seconds.
+        max_retries (int, optional): Number of retries after the first 
+            attempt. Defaults to CAPTION_MAX_RETRIES.
+        backoff (float, optional): Base delay in seconds, doubled on every 
+            retry. Defaults to CAPTION_BACKOFF.
+        temperature (float): Sampling temperature of the model.
+
+    Returns:
+        str: The generated description.
+    """
+    max_retries = CAPTION_MAX_RETRIES if max_retries is None else max_retries
+    backoff = CAPTION_BACKOFF if backoff is None else backoff
+
+    for attempt in range(max_retries + 1):
+        try:
+            return generate_description(
+                image_path, token, type, infos, API_KEY, timeout=timeout,
+                temperature=temperature,
+            )
+        except Exception as e:
+            if attempt == max_retries or not is_retryable_error(e):
+                raise
+            delay = backoff * (2 ** attempt)
+            retry_after = rate_limited_delay(e)
+            if retry_after is not None:
+                # Hold back every job using this key, not only this image;
+                # the next attempt waits for the limiter
+                get_rate_limiter("xai").block(
+                    API_KEY or XAI_API_KEY, retry_after or delay
+                )
+            else:
+                time.sleep(delay + random.uniform(0, delay))
+
+def _map_images(executor, fn, images, window=None, on_done=None):
+    """Runs fn on every image on an executor, stopping at the first failure.
+
+    Args:
+        executor (Executor): The executor to run on.
+        fn (callable): Called with each image.
+        images (list): The images.
+        window (Semaphore, optional): Bounds the images queued at once.
+        on_done (callable, optional): Called with each finished future.
+
+    Returns:
+        list: The results, in the same order as images.
+    """
+    failed = threading.Event()
+
+    def done(future):
+        try:
+            if not future.cancelled() and future.exception() is not None:
+                failed.set()
+            if on_done is not None:
+                on_done(future)
+        finally:
+            # A failing callback must not leak a slot of the window
+            if window is not None:
+                window.release()
+
+    futures = []
+    try:
+        for image in images:
+            if window is not None:
+                window.acquire()
+            if failed.is_set():
+                break
+            future = executor.submit(fn, image)
+            futures.append(future)
+            future.add_done_callback(done)
+        return [future.result() for future in futures]
+    finally:
+        # Stop the images still queued once one failed
+        for future in futures:
+            future.cancel()
+        wait(futures)
+
+def generate_descriptions(images, token, type, infos, API_KEY,
+                          max_workers=None, timeout=None, max_retries=None,
+                          use_cache=True, cache=None, progress=None,
+                          checkpoint=None, executor=None, validate=True,
+                          quality_retries=None, on_validated=None):
+    """Generates descriptions for a batch of images concurrently.
+
+    Requests run on a bounded thread pool, so the total time tracks the 
+    slowest request rather than the sum of all of them. Transient failures 
+    are retried with exponential backoff. If any image ultimately fails, 
+    pending requests are cancelled and the error is raised.
+
+    Captions are looked up in the caption cache first, keyed by the image 
+    content, type, infos, token and model, so unchanged images are never 
+    sent to the API twice.
+
+    Once every image is described, the captions are validated together 
+    (see caption_quality.check_caption). Those failing are requested again, 
+    bypassing the cache and checkpoint, for up to quality_retries rounds.
+
+    Args:
+        images (list): Images to describe, as paths, raw bytes or callables 
+            returning the bytes (see load_image). Each image is loaded by 
+            the worker that describes it, so at most max_workers images are 
+            held in memory at once.
+        token (str): Token to include in the descriptions.
+        type (str): Determines which prompt to use ("human", "pet", or "item").
+        infos (str): Additional informations about the subject of the images.
+        API_KEY (str): The API key to use for the X.AI API.
+        max_workers (int, optional): Maximum number of concurrent requests. 
+            Defaults to CAPTION_CONCURRENCY.
+        timeout (float, optional): Per-request timeout in seconds.
+        max_retries (int, optional): Number of retries per image.
+        use_cache (bool): Whether to read and write the caption cache.
+        cache (CaptionCache, optional): Cache to use instead of the default 
+            one.
+        progress (callable, optional): Called as progress(done, total) each 
+            time an image has been described.
+        checkpoint (PrepManifest, optional): Records every caption as soon 
+            as it is generated, and provides the captions recorded by a 
+            previous, failed attempt, which are not requested again. The 
+            validation statistics are recorded in it too.
+        executor (Executor, optional): Executor shared with other batches, 
+            e.g. get_caption_executor(), whose size is then the concurrency 
+            budget of all of them; max_workers is ignored. Images are fed to 
+            it a few at a time, so concurrent batches progress evenly.
+        validate (bool): Whether to validate the captions.
+        quality_retries (int, optional): Rounds of re-requests for invalid 
+            captions. Defaults to CAPTION_QUALITY_RETRIES.
+        on_validated (callable, optional): Called with the validation 
+            statistics (see caption_quality.validation_stats).
+
+    Returns:
+        list: The descriptions, in the same order as images.
+
+    Raises:
+        CaptionQualityError: If captions are still invalid after the 
+            re-requests.
+    """
+    # Fail fast on an invalid type instead of once per image
+    build_prompt(token, type, infos)
+    if not images:
+        return []
+
+    quality_retries = (
+        CAPTION_QUALITY_RETRIES if quality_retries is None else quality_retries
+    )
+    if use_cache and cache is None:
+        cache = get_caption_cache()
+
+    def describe(image, refresh=False):
+        # Files are hashed and encoded straight from disk; loaders are
+        # called once and their bytes reused for every attempt
+        image_data = image if isinstance(image, str) else load_image(image)
+        image_hash = None
+        if use_cache or checkpoint is not None:
+            image_hash = hash_image(image_data)
+        if checkpoint is not None and not refresh:
+            description = checkpoint.get_caption(image_hash)
+            if description is not None:
+                return description
+
+        description = None
+        if use_cache:
+            key = cache.make_key(image_hash, token, type, infos, XAI_MODEL)
+            if not refresh:
+                description = cache.get(key)
+        if description is None:
+            description = generate_description_with_retries(
+                image_data, token, type, infos, API_KEY,
+                timeout=timeout, max_retries=max_retries,
+                temperature=CAPTION_RETRY_TEMPERATURE if refresh else CAPTION_TEMPERATURE,
+            )
+            if use_cache:
+                cache.set(key, description)
+
+        if checkpoint is not None:
+            checkpoint.set_caption(image_hash, description)
+        return description
+
+    def request_again(image):
+        return describe(image, refresh=True)
+
+    completed = [0]
+    completed_lock = threading.Lock()
+
+    def report(future):
+        if progress is None or future.cancelled() or future.exception():
+            return
+        with completed_lock:
+            completed[0] += 1
+            progress(completed[0], len(images))
+
+    shared = executor is not None
+    if not shared:
+        max_workers = max_workers or CAPTION_CONCURRENCY
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(images)))
+
+    def window():
+        # Keep only a window of our images queued on the shared executor,
+        # so batches started later are interleaved with ours instead of
+        # waiting for all of them
+        return threading.BoundedSemaphore(CAPTION_CONCURRENCY) if shared else None
+
+    try:
+        descriptions = _map_images(executor, describe, images, window(), report)
+        if not validate:
+            return descriptions
+
+        first_failures = failures = validate_captions(descriptions, token)
+        rounds = 0
+        while failures and rounds < quality_retries:
+            rounds += 1
+            indexes = sorted(failures)
+            retried = _map_images(
+                executor, request_again, [images[i] for i in indexes], window()
+            )
+            for i, description in zip(indexes, retried):
+                descriptions[i] = description
+            failures = validate_captions(descriptions, token)
+    finally:
+        if not shared:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if use_cache:
+            # Eviction is housekeeping; it must not hide the outcome
+            try:
+                cache.evict()
+            except OSError as e:
+                print(f"Error while evicting caption cache: {e}")
+
+    stats = validation_stats(len(images), first_failures, failures, rounds)
+    if checkpoint is not None:
+        checkpoint.set_quality(stats)
+    if on_validated is not None:
+        on_validated(stats)
+    if failures:
+        issues = ", ".join(
+            f"{issue} ({count})" for issue, count in stats["remainingIssues"].items()
+        )
+        raise CaptionQualityError(
+            f"{len(failures)} of {len(images)} captions are still invalid "
+            f"after {rounds} rounds of re-requests: {issues}", stats
+        )
+    return descriptions
+
+_caption_executor = None
+_caption_executor_lock = threading.Lock()
+
+def get_caption_executor():
+    """Returns the executor shared by concurrent captioning batches.
+
+    Batches of different subjects or jobs passing it to
+    generate_descriptions share a single budget of CAPTION_CONCURRENCY
+    requests in flight.
+
+    Returns:
+        ThreadPoolExecutor: The shared executor.
+    """
+    global _caption_executor
+    with _caption_executor_lock:
+        if _caption_executor is None:
+            _caption_executor = ThreadPoolExecutor(
+                max_workers=CAPTION_CONCURRENCY, thread_name_prefix="caption"
+            )
+        return _caption_executor